@@ -0,0 +1,70 @@
+"""
+不同bucket精度下DelayManager.update的耗时和target delay效果。
+
+target delay会向上取整到bucket边界，精度越高越贴近真实的分位数，平均延迟更低，late rate更接近1 - quantile。
+python和numpy直方图每次add都要缩放所有bucket，每个包的耗时与bucket数成正比，fenwick直方图是对数级。
+reorder列为on时开启乱序优化(DelayManagerConfig的默认配置)，ReorderOptimizer只在基础延迟处和概率足够大的bucket上
+求代价，使用fenwick直方图时同样与bucket数无关。
+"""
+import random
+import time
+
+from pirtc.base.tick_timer import TickTimer
+from pirtc.neteq.delay_manager import DelayManager, DelayManagerConfig
+
+PACKET_INTERVAL_MS = 20
+
+RESOLUTIONS = [
+    # (bucket_size_ms, delay_buckets)，上限都是2s
+    (20, 100),
+    (10, 200),
+    (5, 400),
+    (1, 2000),
+]
+
+
+def make_trace(num_packets, seed=0):
+    rnd = random.Random(seed)
+    # 大部分包是小抖动，偶尔有突发的大延迟
+    delays = [rnd.expovariate(1 / 15) + (rnd.uniform(50, 150) if rnd.random() < 0.02 else 0)
+              for _ in range(num_packets)]
+    # 比上一个包早到就是乱序
+    reordered = [i > 0 and delays[i] + PACKET_INTERVAL_MS < delays[i - 1] for i in range(num_packets)]
+    return list(zip(delays, reordered))
+
+
+def bench(histogram_type, bucket_size_ms, delay_buckets, use_reorder_optimizer, trace):
+    tick_timer = TickTimer()
+    config = DelayManagerConfig(histogram_type=histogram_type,
+                                delay_buckets=delay_buckets,
+                                bucket_size_ms=bucket_size_ms,
+                                use_reorder_optimizer=use_reorder_optimizer)
+    delay_manager = DelayManager(config, tick_timer)
+
+    target_sum = 0
+    late = 0
+    start = time.perf_counter()
+    for delay, reordered in trace:
+        tick_timer.increment(2)
+        late += delay > delay_manager.get_target_delay_ms()
+        delay_manager.update(delay, reordered)
+        target_sum += delay_manager.get_target_delay_ms()
+    elapsed = time.perf_counter() - start
+    return elapsed / len(trace), target_sum / len(trace), late / len(trace)
+
+
+def main():
+    trace = make_trace(20000)
+    print(f'{"histogram":>9} {"reorder":>7} {"bucket(ms)":>10} {"buckets":>8} {"us/update":>10} '
+          f'{"mean target":>12} {"late rate":>10}')
+    for histogram_type in ['python', 'numpy', 'fenwick']:
+        for use_reorder_optimizer in [False, True]:
+            for bucket_size_ms, delay_buckets in RESOLUTIONS:
+                per_update, mean_target, late_rate = bench(histogram_type, bucket_size_ms, delay_buckets,
+                                                           use_reorder_optimizer, trace)
+                print(f'{histogram_type:>9} {"on" if use_reorder_optimizer else "off":>7} {bucket_size_ms:>10} '
+                      f'{delay_buckets:>8} {per_update * 1e6:>10.1f} {mean_target:>12.1f} {late_rate:>10.4f}')
+
+
+if __name__ == '__main__':
+    main()
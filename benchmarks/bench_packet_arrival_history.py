@@ -0,0 +1,43 @@
+"""
+PacketArrivalHistory.insert在不同窗口大小下的耗时，单包耗时应该与窗口大小无关。
+"""
+import random
+import time
+
+from pirtc.neteq.packet_arrival_history import PacketArrivalHistory
+
+
+def bench_insert(window_size_ms, packets_per_second, num_packets, seed=0):
+    rnd = random.Random(seed)
+    sample_rate = 48000
+    samples_per_packet = sample_rate // packets_per_second
+    ms_per_packet = 1000 / packets_per_second
+
+    history = PacketArrivalHistory(window_size_ms)
+    history.set_sample_rate(sample_rate // 1000)
+    # 最小/最大延迟经常滑出窗口，对旧实现是最差情况
+    trace = []
+    for i in range(num_packets):
+        rtp_timestamp = (1000 + i * samples_per_packet) & 0xffffffff
+        arrival_time_ms = int(i * ms_per_packet + rnd.expovariate(1 / 20))
+        trace.append((rtp_timestamp, arrival_time_ms))
+
+    start = time.perf_counter()
+    for rtp_timestamp, arrival_time_ms in trace:
+        history.insert(rtp_timestamp, arrival_time_ms)
+        history.get_max_delay_ms()
+    elapsed = time.perf_counter() - start
+    return elapsed / num_packets, history.size()
+
+
+def main():
+    packets_per_second = 1000
+    num_packets = 100000
+    print(f'{"window(ms)":>10} {"packets":>8} {"us/insert":>10}')
+    for window_size_ms in [500, 2000, 10000, 30000, 60000]:
+        per_insert, size = bench_insert(window_size_ms, packets_per_second, num_packets)
+        print(f'{window_size_ms:>10} {size:>8} {per_insert * 1e6:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+每个缓存的包和每条到达记录占用的内存，以及优先级比较的耗时。
+
+"before"是改为__slots__之前的实现(普通类 + 每个包一个PacketPriority dataclass + 普通StopWatch)，
+原样复制在这里作为对照；"after"是当前pirtc中的实现。内存用tracemalloc统计，不含帧和payload。
+"""
+import timeit
+import tracemalloc
+from collections import deque
+from dataclasses import dataclass
+
+from pirtc.base.tick_timer import TickTimer, StopWatch
+from pirtc.neteq.packet import Packet, PacketPriority
+from pirtc.neteq.packet_arrival_history import PacketArrival
+from pirtc.neteq.packet_buffer import PacketBuffer
+
+NUM_PACKETS = 10000
+SAMPLES_PER_PACKET = 960
+
+
+@dataclass
+class LegacyPacketPriority:
+    codec_level: int = 0
+    red_level: int = 0
+
+    def __lt__(self, other):
+        return self.red_level < other.red_level if self.codec_level == other.codec_level \
+            else self.codec_level < other.codec_level
+
+    def __eq__(self, other):
+        return self.codec_level == other.codec_level and self.red_level == other.red_level
+
+
+class LegacyStopWatch:
+    def __init__(self, tick_timer):
+        self.tick_timer = tick_timer
+        self.start_tick = tick_timer.get_ticks()
+
+
+class LegacyPacket:
+    def __init__(self):
+        self.timestamp = 0
+        self.sequence_number = 0
+        self.payload_type = 0
+        self.payload = None
+        self.priority = LegacyPacketPriority()
+        self.frame = None
+
+
+@dataclass
+class LegacyPacketArrival:
+    rtp_timestamp_ms: int = 0
+    arrival_time_ms: int = 0
+
+
+def bytes_per_buffered_packet(packet_type, stop_watch_type):
+    tick_timer = TickTimer()
+    buffer = PacketBuffer(NUM_PACKETS + 1, tick_timer)
+    buffer.smart_flush_config.target_level_threshold = 1 << 40
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(NUM_PACKETS):
+        packet = packet_type()
+        # 时间戳用大整数，与unwrap之后的值一致
+        packet.timestamp = (1 << 32) + i * SAMPLES_PER_PACKET
+        packet.sequence_number = i & 0xffff
+        packet.payload = b''
+        buffer.insert_packet(packet, SAMPLES_PER_PACKET, 48000, 0, None)
+        # insert_packet设置的是当前的StopWatch，对照组换成旧的实现
+        packet.waiting_time = stop_watch_type(tick_timer)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert buffer.num_packets_in_buffer() == NUM_PACKETS
+    return used / NUM_PACKETS
+
+
+def bytes_per_arrival(arrival_type):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    history = deque(arrival_type((1 << 32) + i * 20, (1 << 32) + i * 20 + 5) for i in range(NUM_PACKETS))
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert len(history) == NUM_PACKETS
+    return used / NUM_PACKETS
+
+
+def ns_per_compare(priority_type):
+    a = priority_type(1, 0)
+    b = priority_type(0, 1)
+    number = 200000
+    return min(timeit.repeat(lambda: a < b, number=number, repeat=5)) / number * 1e9
+
+
+def main():
+    rows = [
+        ('bytes per buffered packet',
+         bytes_per_buffered_packet(LegacyPacket, LegacyStopWatch), bytes_per_buffered_packet(Packet, StopWatch)),
+        ('bytes per PacketArrival', bytes_per_arrival(LegacyPacketArrival), bytes_per_arrival(PacketArrival)),
+        ('ns per PacketPriority <', ns_per_compare(LegacyPacketPriority), ns_per_compare(PacketPriority)),
+    ]
+    print(f'{"":>26} {"before":>8} {"after":>8} {"ratio":>6}')
+    for name, before, after in rows:
+        print(f'{name:>26} {before:>8.1f} {after:>8.1f} {after / before:>6.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+按流水线阶段剖析NetEQ和GCC的trace回放。
+
+    python benchmarks/profile_pipeline.py [-o 前缀] [--memory none|tracemalloc] [--neteq-trace trace] [--gcc-trace trace]
+
+只在组件的方法上加计时器(StageProfiler)，不像cProfile那样放大每个小函数，亚微秒级的方法(例如
+PacketBuffer.peak_next_packet、next_timestamp)也不单独计时，算在调用者中。每个流水线回放三次：
+不剖析、只计时、只统计内存(统计内存时分配变慢，耗时不可信，所以单独一次)。输出：
+- 不剖析时的耗时，以及各阶段自身耗时之和比它多出的部分，即剖析本身带来的偏差；
+- 每个阶段的调用次数、总耗时、自身耗时、ops/sec，以及自身分配的字节数和调用结束时仍占用的字节数；
+- 指定-o时写出collapsed stack文件(前缀.neteq.folded和前缀.neteq.alloc.folded等)，
+  可以直接用flamegraph.pl或speedscope打开。
+不指定trace时使用固定种子生成的合成trace。
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from pirtc.base.packet_trace import PacketTraceWriter, PacketTraceReader
+from pirtc.base.stage_profiler import StageProfiler
+from pirtc.gcc.delay_based_bwe import DelayBasedBwe, replay_packet_trace
+from pirtc.neteq.neteq import NetEq, NetEqConfig
+from pirtc.neteq.trace_replay import replay_neteq
+
+SEED = 0
+SAMPLE_RATE_HZ = 16000
+PACKET_DURATION_MS = 20
+
+
+def make_neteq_trace(path, num_packets=50000, jitter_ms=30, loss_rate=0.02):
+    rnd = random.Random(SEED)
+    send_time_ms = np.arange(num_packets) * PACKET_DURATION_MS
+    arrival_time_ms = send_time_ms + np.array([rnd.expovariate(1 / jitter_ms) for _ in range(num_packets)])
+    received = np.array([rnd.random() >= loss_rate for _ in range(num_packets)])
+    order = np.argsort(arrival_time_ms[received], kind='stable')
+    sequence_number = np.arange(num_packets)[received][order]
+    with PacketTraceWriter(path) as writer:
+        writer.write(rtp_timestamp=sequence_number * SAMPLE_RATE_HZ * PACKET_DURATION_MS // 1000,
+                     sequence_number=sequence_number & 0xffff,
+                     arrival_time_ms=arrival_time_ms[received][order],
+                     send_time_ms=send_time_ms[received][order],
+                     size=np.full(len(sequence_number), 60))
+
+
+def make_gcc_trace(path, num_packets=200000, packet_interval_ms=5):
+    # 1.9Mbps的视频流，排队延迟周期性地上升再排空，让检测器经历overuse/normal/underuse
+    rng = np.random.default_rng(SEED)
+    send_time_ms = np.arange(num_packets) * packet_interval_ms + rng.uniform(0, 1, num_packets)
+    queue_ms = 60 * np.maximum(np.sin(send_time_ms / 20000 * 2 * np.pi), 0)
+    arrival_time_ms = send_time_ms + 30 + queue_ms + rng.exponential(2, num_packets)
+    order = np.argsort(arrival_time_ms, kind='stable')
+    with PacketTraceWriter(path) as writer:
+        writer.write(sequence_number=order & 0xffff,
+                     arrival_time_ms=arrival_time_ms[order],
+                     send_time_ms=send_time_ms[order],
+                     size=np.full(num_packets, 1200))
+
+
+def instrument_neteq(profiler: StageProfiler, neteq: NetEq):
+    decision_logic = neteq.decision_logic
+    delay_manager = decision_logic.delay_manager
+    profiler.instrument(neteq, 'neteq', ['insert_packet', 'get_audio', 'skip_idle'])
+    profiler.instrument(neteq.timestamp_unwrapper, 'unwrap', ['unwrap'])
+    # peak_next_packet、next_timestamp、recycle、num_samples_in_buffer都是亚微秒级，计时器的开销比它们本身还大
+    profiler.instrument(neteq.packet_buffer, 'packet_buffer',
+                        ['insert_packet', 'partial_flush', 'get_next_packet', 'discard_all_old_packets'])
+    profiler.instrument(decision_logic, 'decision_logic',
+                        ['packet_arrived', 'get_decision', 'expand_decision', 'skip_no_packet', 'time_stretched'])
+    profiler.instrument(decision_logic.packet_arrival_history, 'arrival_history', ['insert', 'get_delay_ms'])
+    profiler.instrument(delay_manager, 'delay_manager', ['update'])
+    profiler.instrument(delay_manager.underrun_optimizer, 'underrun_optimizer', ['update'])
+    if delay_manager.reorder_optimizer is not None:
+        profiler.instrument(delay_manager.reorder_optimizer, 'reorder_optimizer', ['update'])
+
+
+def instrument_gcc(profiler: StageProfiler, bwe: DelayBasedBwe):
+    profiler.instrument(bwe, 'delay_based_bwe', ['incoming_feedback_batch', 'update_estimate'])
+    profiler.instrument(bwe.inter_arrival, 'inter_arrival', ['compute_deltas'])
+    profiler.instrument(bwe.trendline, 'trendline', ['update_batch'])
+    profiler.instrument(bwe.detector, 'overuse_detector', ['detect'])
+    profiler.instrument(bwe.rate_control, 'aimd', ['update', 'set_estimate'])
+    # incoming_packet是亚微秒级，算在delay_based_bwe中
+    profiler.instrument(bwe.acknowledged_bitrate, 'acked_bitrate', ['bitrate_bps'])
+
+
+def run_neteq(path):
+    neteq = NetEq(NetEqConfig(sample_rate_hz=SAMPLE_RATE_HZ))
+    return neteq, lambda: replay_neteq(neteq, PacketTraceReader(path), PACKET_DURATION_MS)
+
+
+def run_gcc(path):
+    bwe = DelayBasedBwe()
+    return bwe, lambda: replay_packet_trace(bwe, PacketTraceReader(path))
+
+
+def profile(name, path, make, instrument, memory, prefix):
+    _, replay = make(path)
+    start = time.perf_counter_ns()
+    replay()
+    unprofiled_ns = time.perf_counter_ns() - start
+
+    profiler = StageProfiler()
+    profiler.calibrate()
+    pipeline, replay = make(path)
+    instrument(profiler, pipeline)
+    with profiler.stage('replay'):
+        replay()
+
+    print(f'{name}: {len(PacketTraceReader(path))} packets, unprofiled {unprofiled_ns / 1e6:.1f}ms')
+    print(profiler.report(unprofiled_ns))
+    if prefix:
+        profiler.write_folded(f'{prefix}.{name}.folded')
+        print(f'wrote {prefix}.{name}.folded')
+
+    if memory != 'none':
+        tracemalloc.start()
+        memory_profiler = StageProfiler(memory)
+        memory_profiler.calibrate()
+        pipeline, replay = make(path)
+        instrument(memory_profiler, pipeline)
+        with memory_profiler.stage('replay'):
+            replay()
+        tracemalloc.stop()
+        print(memory_profiler.report())
+        if prefix:
+            memory_profiler.write_folded(f'{prefix}.{name}.alloc.folded', 'memory')
+            print(f'wrote {prefix}.{name}.alloc.folded')
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', help='collapsed stack文件的前缀')
+    parser.add_argument('--memory', default='tracemalloc', choices=['none', 'tracemalloc'])
+    parser.add_argument('--neteq-trace')
+    parser.add_argument('--gcc-trace')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as trace_dir:
+        neteq_trace = args.neteq_trace
+        if neteq_trace is None:
+            neteq_trace = os.path.join(trace_dir, 'neteq.trace')
+            make_neteq_trace(neteq_trace)
+        gcc_trace = args.gcc_trace
+        if gcc_trace is None:
+            gcc_trace = os.path.join(trace_dir, 'gcc.trace')
+            make_gcc_trace(gcc_trace)
+
+        profile('neteq', neteq_trace, run_neteq, instrument_neteq, args.memory, args.output)
+        profile('gcc', gcc_trace, run_gcc, instrument_gcc, args.memory, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,465 @@
+"""
+NetEQ和GCC热点路径的基准测试。
+
+    python benchmarks/suite.py [-k 过滤] [-o results.json] [--compare baseline.json] [--threshold 0.1]
+
+每个用例的输入由固定种子生成，计时前先预热一次，然后每次重复都新建实例、只对负载计时，
+取最快的一次得到ops/sec。内存是用tracemalloc统计的一个实例在跑完负载之后保留的字节数。
+结果和运行环境一起写成JSON；--compare与之前的结果比较，ops/sec下降超过阈值时返回1，可以用在发布前的检查中。
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from pirtc.base.audio_decoder import SimulatedAudioFrame
+from pirtc.base.instrumentation import Instrumentation
+from pirtc.base.number_unwrapper import NumberUnwrapper
+from pirtc.base.tick_timer import TickTimer
+from pirtc.gcc.aimd_control import AimdRateControl
+from pirtc.gcc.trendline_estimator import TrendlineEstimator
+from pirtc.neteq.delay_manager import DelayManager, DelayManagerConfig
+from pirtc.neteq.histogram import create_histogram, HISTOGRAM_TYPES
+from pirtc.neteq.packet import Packet, PacketPool
+from pirtc.neteq.packet_arrival_history import PacketArrivalHistory
+from pirtc.neteq.packet_buffer import PacketBuffer
+from pirtc.neteq.reorder_optimizer import ReorderOptimizer
+from pirtc.neteq.underrun_optimizer import UnderRunOptimizer
+
+SEED = 0
+FORGET_FACTOR = 32745
+START_FORGET_WEIGHT = 2
+QUANTILE = 1041529569
+NUM_BUCKETS = 100
+
+
+@dataclass
+class Case:
+    name: str
+    # setup(params) -> workload，生成输入，不计时
+    setup: callable
+    # make(params) -> 被测实例
+    make: callable
+    # run(instance, workload) -> 操作次数
+    run: callable
+    params: dict = field(default_factory=dict)
+
+    @property
+    def key(self):
+        if not self.params:
+            return self.name
+        return self.name + '[' + ','.join(f'{k}={v}' for k, v in self.params.items()) + ']'
+
+
+CASES = []
+
+
+def register(name, setup, make, run, **param_grid):
+    # 参数取值的笛卡尔积，每个组合是一个用例
+    combinations = [{}]
+    for key, values in param_grid.items():
+        combinations = [dict(c, **{key: v}) for c in combinations for v in values]
+    for params in combinations:
+        CASES.append(Case(name, setup, make, run, params))
+
+
+def _histogram_indices(params, n=20000):
+    rnd = random.Random(SEED)
+    return [min(int(rnd.expovariate(1 / 5)), NUM_BUCKETS - 1) for _ in range(n)]
+
+
+def _make_histogram(params):
+    return create_histogram(params['hist_type'], NUM_BUCKETS, FORGET_FACTOR, START_FORGET_WEIGHT)
+
+
+def _histogram_add(hist, indices):
+    for index in indices:
+        hist.add(index)
+    return len(indices)
+
+
+def _make_filled_histogram(params):
+    hist = _make_histogram(params)
+    _histogram_add(hist, _histogram_indices(params, 2000))
+    return hist
+
+
+def _histogram_quantile(hist, probabilities):
+    for probability in probabilities:
+        hist.quantile(probability)
+    return len(probabilities)
+
+
+register('histogram.add', _histogram_indices, _make_histogram, _histogram_add,
+         hist_type=list(HISTOGRAM_TYPES))
+register('histogram.quantile',
+         lambda params: [int((1 << 30) * (0.5 + 0.5 * random.Random(i).random())) for i in range(20000)],
+         _make_filled_histogram, _histogram_quantile,
+         hist_type=list(HISTOGRAM_TYPES))
+
+
+def _relative_delays(params, n=20000):
+    rnd = random.Random(SEED)
+    # 大部分包是小抖动，偶尔有突发的大延迟
+    return [int(rnd.expovariate(1 / 15) + (rnd.uniform(50, 150) if rnd.random() < 0.02 else 0))
+            for _ in range(n)]
+
+
+def _make_underrun_optimizer(params):
+    return UnderRunOptimizer(TickTimer(), QUANTILE, FORGET_FACTOR, START_FORGET_WEIGHT,
+                             resample_interval_ms=500, hist_type=params['hist_type'])
+
+
+def _underrun_update(optimizer, delays):
+    for delay in delays:
+        optimizer.tick_timer.increment(2)
+        optimizer.update(delay)
+    return len(delays)
+
+
+register('underrun_optimizer.update', _relative_delays, _make_underrun_optimizer, _underrun_update,
+         hist_type=list(HISTOGRAM_TYPES))
+
+
+def _delay_manager_workload(params, n=20000):
+    rnd = random.Random(SEED)
+    return [(delay, rnd.random() < 0.05) for delay in _relative_delays(params, n)]
+
+
+def _make_delay_manager(params):
+    # off: 不埋点；counters: 只有计数和事件；timing: 计数并对update计时
+    instrumentation = None if params['instrumentation'] == 'off' else \
+        Instrumentation(timing=params['instrumentation'] == 'timing')
+    delay_manager = DelayManager(DelayManagerConfig(), TickTimer(), instrumentation)
+    delay_manager.set_packet_audio_length(20)
+    return delay_manager
+
+
+def _delay_manager_update(delay_manager, workload):
+    tick_timer = delay_manager.underrun_optimizer.tick_timer
+    for delay, reordered in workload:
+        tick_timer.increment(2)
+        delay_manager.update(delay, reordered)
+    return len(workload)
+
+
+register('delay_manager.update', _delay_manager_workload, _make_delay_manager, _delay_manager_update,
+         instrumentation=['off', 'counters', 'timing'])
+
+
+def _make_reorder_optimizer(params):
+    optimizer = ReorderOptimizer(FORGET_FACTOR, 20, START_FORGET_WEIGHT, hist_type=params['hist_type'])
+    for delay in _relative_delays(params, 2000):
+        optimizer.update(delay, delay > 30, 40)
+    return optimizer
+
+
+def _minimize_cost(optimizer, base_delays):
+    for base_delay in base_delays:
+        optimizer.minimize_cost_function(base_delay)
+    return len(base_delays)
+
+
+register('reorder_optimizer.minimize_cost_function',
+         lambda params: [random.Random(SEED + i).randrange(0, 200) for i in range(20000)],
+         _make_reorder_optimizer, _minimize_cost,
+         hist_type=list(HISTOGRAM_TYPES))
+
+
+def _arrival_trace(params, n=50000):
+    rnd = random.Random(SEED)
+    return [((1000 + i * 960) & 0xffffffff, int(i * 20 + rnd.expovariate(1 / 20))) for i in range(n)]
+
+
+def _make_packet_arrival_history(params):
+    history = PacketArrivalHistory(params['window_ms'])
+    history.set_sample_rate(48)
+    return history
+
+
+def _arrival_history_insert(history, trace):
+    for rtp_timestamp, arrival_time_ms in trace:
+        history.insert(rtp_timestamp, arrival_time_ms)
+        history.get_max_delay_ms()
+    return len(trace)
+
+
+register('packet_arrival_history.insert', _arrival_trace, _make_packet_arrival_history, _arrival_history_insert,
+         window_ms=[2000, 60000])
+
+
+def _packet_buffer_workload(params, n=20000):
+    # 轻微乱序的包，buffer中保持约level个包
+    rnd = random.Random(SEED)
+    order = list(range(n))
+    for i in range(0, n - 1, 10):
+        if rnd.random() < 0.3:
+            order[i], order[i + 1] = order[i + 1], order[i]
+    return [(i * 960, i & 0xffff) for i in order]
+
+
+def _make_packet_buffer(params):
+    return PacketBuffer(200, TickTimer(), PacketPool() if params['pool'] else None)
+
+
+def _packet_buffer_ops(buffer, workload):
+    ops = 0
+    pool = buffer.packet_pool
+    for timestamp, sequence_number in workload:
+        packet = pool.acquire() if pool is not None else Packet()
+        packet.timestamp = timestamp
+        packet.sequence_number = sequence_number
+        packet.frame = SimulatedAudioFrame(960)
+        buffer.insert_packet(packet, 960, 48000, 120, None)
+        buffer.num_samples_in_buffer()
+        ops += 2
+        if buffer.num_packets_in_buffer() > 6:
+            buffer.recycle(buffer.get_next_packet())
+            buffer.discard_old_packets(buffer.next_timestamp(), 48000 * 5)
+            ops += 2
+    return ops
+
+
+register('packet_buffer.insert_get', _packet_buffer_workload, _make_packet_buffer, _packet_buffer_ops,
+         pool=[False, True])
+
+
+def _reordered_insert_workload(params, n=20000):
+    # 按顺序到达的包占偶数位置，乱序包插入到buffer中间的奇数位置
+    level = params['level']
+    return [(2 * (level + k), 2 * (level // 2 + k) + 1) for k in range(n)]
+
+
+def _make_filled_packet_buffer(params):
+    level = params['level']
+    buffer = PacketBuffer(2 * level + 2, TickTimer())
+    for slot in range(0, 2 * level, 2):
+        _insert_slot(buffer, slot, level)
+    return buffer
+
+
+def _insert_slot(buffer, slot, level):
+    packet = Packet()
+    packet.timestamp = slot * 960
+    packet.sequence_number = slot & 0xffff
+    packet.frame = SimulatedAudioFrame(960)
+    # target level足够大，不触发smart flush
+    buffer.insert_packet(packet, 960, 48000, 40 * level, None)
+
+
+def _packet_buffer_reordered_ops(buffer, workload):
+    # 每步追加一个包、在中间插入一个乱序包、取出两个包，buffer中保持level个包
+    level = buffer.max_number_of_packets // 2 - 1
+    for in_order_slot, reordered_slot in workload:
+        _insert_slot(buffer, in_order_slot, level)
+        _insert_slot(buffer, reordered_slot, level)
+        buffer.get_next_packet()
+        buffer.get_next_packet()
+    return 4 * len(workload)
+
+
+register('packet_buffer.insert_reordered', _reordered_insert_workload, _make_filled_packet_buffer,
+         _packet_buffer_reordered_ops, level=[50, 200, 800])
+
+
+def _unwrapper_input(params, n=100000):
+    wrap = (1 << params['bits']) - 1
+    rnd = random.Random(SEED)
+    value = 0
+    values = []
+    for _ in range(n):
+        value = (value + rnd.randrange(-10, 200)) & wrap
+        values.append(value)
+    return values
+
+
+def _unwrap(unwrapper, values):
+    for value in values:
+        unwrapper.unwrap(value)
+    return len(values)
+
+
+def _unwrap_array(unwrapper, values):
+    # 每次1000个
+    array = np.asarray(values, dtype=np.int64)
+    for begin in range(0, len(array), 1000):
+        unwrapper.unwrap_array(array[begin:begin + 1000])
+    return len(array)
+
+
+register('number_unwrapper.unwrap', _unwrapper_input, lambda params: NumberUnwrapper(params['bits']), _unwrap,
+         bits=[16, 32])
+register('number_unwrapper.unwrap_array', _unwrapper_input, lambda params: NumberUnwrapper(params['bits']),
+         _unwrap_array, bits=[16, 32])
+
+
+def _aimd_workload(params, n=50000):
+    # 大部分是normal，周期性出现overuse/underuse，吞吐率在1M附近
+    rnd = random.Random(SEED)
+    workload = []
+    for i in range(n):
+        phase = i % 200
+        if phase < 170:
+            state = AimdRateControl.BW_USAGE_NORMAL
+        elif phase < 185:
+            state = AimdRateControl.BW_USAGE_OVERUSING
+        else:
+            state = AimdRateControl.BW_USAGE_UNDERUSING
+        workload.append((state, int(rnd.gauss(1000000, 100000)), 100000 + i * 50))
+    return workload
+
+
+def _make_aimd(params):
+    aimd = AimdRateControl()
+    aimd.set_start_bitrate(300000)
+    return aimd
+
+
+def _aimd_update(aimd, workload):
+    for state, bitrate, ts in workload:
+        aimd.update(state, bitrate, ts)
+    return len(workload)
+
+
+register('aimd_control.update', _aimd_workload, _make_aimd, _aimd_update)
+
+
+def _trendline_workload(params, n=50000):
+    rng = np.random.default_rng(SEED)
+    send_delta_ms = rng.exponential(8, n)
+    recv_delta_ms = send_delta_ms + rng.normal(0, 2, n)
+    arrival_time_ms = np.cumsum(np.abs(recv_delta_ms))
+    return recv_delta_ms, send_delta_ms, arrival_time_ms
+
+
+def _trendline_update(trendline, workload):
+    for recv_delta_ms, send_delta_ms, arrival_time_ms in zip(*(w.tolist() for w in workload)):
+        trendline.update(recv_delta_ms, send_delta_ms, arrival_time_ms)
+    return len(workload[0])
+
+
+def _trendline_update_batch(trendline, workload):
+    trendline.update_batch(*workload)
+    return len(workload[0])
+
+
+register('trendline_estimator.update', _trendline_workload, lambda params: TrendlineEstimator(), _trendline_update)
+register('trendline_estimator.update_batch', _trendline_workload, lambda params: TrendlineEstimator(),
+         _trendline_update_batch)
+
+
+def measure(case: Case, repeat: int):
+    workload = case.setup(case.params)
+
+    # 预热
+    case.run(case.make(case.params), workload)
+
+    times = []
+    ops = 0
+    for _ in range(repeat):
+        instance = case.make(case.params)
+        start = time.perf_counter()
+        ops = case.run(instance, workload)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    instance = case.make(case.params)
+    case.run(instance, workload)
+    memory_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del instance
+
+    return {
+        'name': case.name,
+        'params': case.params,
+        'ops': ops,
+        'repeat': repeat,
+        'best_s': min(times),
+        'median_s': statistics.median(times),
+        'ops_per_sec': ops / min(times),
+        'median_ops_per_sec': ops / statistics.median(times),
+        'memory_bytes': memory_bytes,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'commit': commit,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    返回ops/sec下降超过threshold的用例
+    """
+    baseline_by_key = {Case(r['name'], None, None, None, r['params']).key: r for r in baseline['results']}
+    regressions = []
+    print(f'\n{"benchmark":<56} {"baseline":>12} {"current":>12} {"change":>8}')
+    for r in results:
+        key = Case(r['name'], None, None, None, r['params']).key
+        if key not in baseline_by_key:
+            continue
+        old = baseline_by_key[key]['ops_per_sec']
+        change = r['ops_per_sec'] / old - 1
+        flag = ' !' if change < -threshold else ''
+        print(f'{key:<56} {old:>12.0f} {r["ops_per_sec"]:>12.0f} {change:>+8.1%}{flag}')
+        if change < -threshold:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-k', '--filter', default='', help='只运行名字包含该字符串的用例')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-o', '--output', help='结果写入的JSON文件')
+    parser.add_argument('--compare', help='作为基准的JSON结果')
+    parser.add_argument('--threshold', type=float, default=0.1, help='ops/sec下降超过该比例视为退化')
+    args = parser.parse_args()
+
+    results = []
+    print(f'{"benchmark":<56} {"ops/sec":>12} {"median":>12} {"memory":>10}')
+    for case in CASES:
+        if args.filter not in case.key:
+            continue
+        r = measure(case, args.repeat)
+        results.append(r)
+        print(f'{case.key:<56} {r["ops_per_sec"]:>12.0f} {r["median_ops_per_sec"]:>12.0f} '
+              f'{r["memory_bytes"] / 1024:>8.1f}KB')
+
+    report = {'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regressions over {args.threshold:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,7 @@ setup(
     author='tkorays',
     author_email='tkorays@hotmail.com',
     packages=find_packages(),
+    python_requires='>=3.10',
     include_package_data=True,
     zip_safe=True,
     scripts=[],
@@ -0,0 +1,47 @@
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from pirtc.neteq.delay_manager import DelayManagerConfig
+from pirtc.neteq.delay_manager_sweep import save_delay_trace, grid_configs, sweep, summarize
+
+
+def make_trace(path, num_packets, jitter_ms, reorder_rate, seed):
+    # 20ms一个包，tick为10ms
+    rnd = random.Random(seed)
+    ticks = np.arange(num_packets) * 2
+    delays = [max(0.0, rnd.gauss(jitter_ms, jitter_ms)) for _ in range(num_packets)]
+    reordered = [rnd.random() < reorder_rate for _ in range(num_packets)]
+    save_delay_trace(path, ticks, delays, reordered)
+
+
+def main():
+    trace_dir = tempfile.mkdtemp()
+    trace_paths = []
+    for i, (jitter_ms, reorder_rate) in enumerate([(20, 0.01), (60, 0.05)]):
+        path = os.path.join(trace_dir, f'trace_{i}.npy')
+        make_trace(path, 30000, jitter_ms, reorder_rate, i)
+        trace_paths.append(path)
+
+    configs = grid_configs(DelayManagerConfig(),
+                           quantile=[0.9, 0.95, 0.97],
+                           forget_factor=[0.97, 0.983, 0.99],
+                           resample_interval_ms=[0, 500],
+                           ms_per_loss_percent=[10, 20])
+    start = time.time()
+    result = sweep(configs, trace_paths)
+    print(f'{len(configs)} configs x {len(trace_paths)} traces in {time.time() - start:.1f}s')
+
+    summary = summarize(result)
+    output = sys.argv[1] if len(sys.argv) > 1 else None
+    if output:
+        summary.to_csv(output, index=False)
+    print(summary.sort_values('late_loss_rate').head(10).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+用packet trace驱动完整的NetEQ收包/出音频流程，不等待真实时间，输出每秒墙钟时间能仿真多少秒。
+
+    python simulations/neteq.py [--instrument] [trace]
+
+不指定trace时生成带抖动、丢包和乱序的合成trace，一个是连续语音，一个大部分时间是静音。
+没有包的时候时钟直接跳到下一个包到达，静音越多仿真越快。
+--instrument输出target delay由哪个因素决定、丢包原因以及各个调用的耗时。
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from pirtc.base.instrumentation import Instrumentation
+from pirtc.base.packet_trace import PacketTraceWriter, PacketTraceReader
+from pirtc.neteq.neteq import NetEq, NetEqConfig
+from pirtc.neteq.trace_replay import replay_neteq
+
+SAMPLE_RATE_HZ = 16000
+PACKET_DURATION_MS = 20
+
+
+def make_trace(path, num_packets, jitter_ms, loss_rate, seed, talk_ms=0, silence_ms=0):
+    # talk_ms和silence_ms不为0时，交替发送talk_ms的语音和停止发送silence_ms（DTX）
+    rnd = random.Random(seed)
+    send_time_ms = np.arange(num_packets) * PACKET_DURATION_MS
+    arrival_time_ms = send_time_ms + np.array([rnd.expovariate(1 / jitter_ms) for _ in range(num_packets)])
+    received = np.array([rnd.random() >= loss_rate for _ in range(num_packets)])
+    if talk_ms and silence_ms:
+        received &= send_time_ms % (talk_ms + silence_ms) < talk_ms
+    order = np.argsort(arrival_time_ms[received], kind='stable')
+    sequence_number = np.arange(num_packets)[received][order]
+    with PacketTraceWriter(path) as writer:
+        writer.write(rtp_timestamp=sequence_number * SAMPLE_RATE_HZ * PACKET_DURATION_MS // 1000,
+                     sequence_number=sequence_number & 0xffff,
+                     arrival_time_ms=arrival_time_ms[received][order],
+                     send_time_ms=send_time_ms[received][order],
+                     size=np.full(len(sequence_number), 60))
+
+
+def run(path, instrument=False):
+    reader = PacketTraceReader(path)
+    instrumentation = Instrumentation() if instrument else None
+    neteq = NetEq(NetEqConfig(sample_rate_hz=SAMPLE_RATE_HZ), instrumentation=instrumentation)
+    start = time.perf_counter()
+    simulated_s = replay_neteq(neteq, reader, PACKET_DURATION_MS)
+    wall_s = time.perf_counter() - start
+
+    print(f'{len(reader)} packets, {simulated_s:.1f}s simulated in {wall_s:.2f}s, '
+          f'{simulated_s / wall_s:.1f} simulated-s/wall-s')
+    stats = neteq.stats
+    total = sum(stats.operations.values())
+    for operation, count in stats.operations.items():
+        print(f'{operation:>18} {count:>8} {count / total:>8.2%}')
+    print(f'discarded packets {stats.packets_discarded}, buffer flushes {stats.buffer_flushes}, '
+          f'expanded {stats.expanded_samples * 1000 // SAMPLE_RATE_HZ}ms, '
+          f'accelerated {stats.accelerated_samples * 1000 // SAMPLE_RATE_HZ}ms, '
+          f'preemptive expanded {stats.preemptive_samples * 1000 // SAMPLE_RATE_HZ}ms')
+    if instrumentation is not None:
+        print(instrumentation.report())
+
+
+def main():
+    args = sys.argv[1:]
+    instrument = '--instrument' in args
+    args = [arg for arg in args if arg != '--instrument']
+    if args:
+        run(args[0], instrument)
+        return
+
+    trace_dir = tempfile.mkdtemp()
+    # 连续语音，以及大部分时间是静音的trace
+    for name, talk_ms, silence_ms in [('speech', 0, 0), ('dtx', 2000, 20000)]:
+        path = os.path.join(trace_dir, f'{name}.trace')
+        make_trace(path, 50000, 30, 0.02, 0, talk_ms, silence_ms)
+        print(name)
+        run(path, instrument)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+本地回环测试RtpReceiver：多个SSRC同时发送到同一个端口，每个流一个消费者读取输出的帧。
+
+    python simulations/rtp_receiver.py [num_streams]
+"""
+import asyncio
+import sys
+import time
+
+from pirtc.neteq.neteq import NetEqConfig
+from pirtc.neteq.rtp_receiver import RtpReceiver, send_rtp_stream
+
+DURATION_S = 5
+PACKET_DURATION_MS = 20
+
+
+async def consume(stream, result):
+    operations = {}
+    async for frame in stream:
+        operations[frame.operation] = operations.get(frame.operation, 0) + 1
+    result[stream.ssrc] = (operations, stream.dropped_frames, stream.neteq.get_target_delay_ms())
+
+
+async def main(num_streams):
+    result = {}
+    consumers = []
+    async with RtpReceiver(NetEqConfig(sample_rate_hz=16000), stream_timeout_ms=1000) as receiver:
+        async def accept_streams():
+            while True:
+                stream = await receiver.accept()
+                if stream is None:
+                    return
+                consumers.append(asyncio.create_task(consume(stream, result)))
+
+        accept_task = asyncio.create_task(accept_streams())
+        start = time.perf_counter()
+        await asyncio.gather(*[send_rtp_stream('127.0.0.1', receiver.port, 0x1000 + i,
+                                               DURATION_S * 1000 // PACKET_DURATION_MS, PACKET_DURATION_MS,
+                                               jitter_ms=10 * (i % 5), loss_rate=0.01 * (i % 3), seed=i)
+                               for i in range(num_streams)])
+        # 等待所有流超时关闭
+        while receiver.streams:
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - start
+        await asyncio.gather(*consumers)
+        accept_task.cancel()
+        arena = receiver.arena
+        packet_pool = receiver.packet_pool
+
+    print(f'{num_streams} streams, {elapsed:.1f}s')
+    # 所有流关闭之后arena应该全部归还
+    print(f'arena slots acquired {arena.hits}, exhausted {arena.misses}, still in use {arena.num_used_slots()}')
+    print('packet pool ' + ', '.join(f'{k} {v}' for k, v in packet_pool.stats().items()))
+    for ssrc, (operations, dropped, target_delay_ms) in sorted(result.items()):
+        total = sum(operations.values())
+        mix = ' '.join(f'{op}={count / total:.1%}' for op, count in sorted(operations.items(), key=str))
+        print(f'ssrc {ssrc:#x}: {total} frames, dropped {dropped}, target {target_delay_ms}ms, {mix}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 8))
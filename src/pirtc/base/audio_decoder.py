@@ -1,11 +1,14 @@
 
+import numpy as np
+
 AUDIO_SPEECH_TYPE_SPEECH = 1
 AUDIO_SPEECH_TYPE_COMFORT_NOISE = 2
 
 
 class EncodedAudioFrame:
-    def __init__(self):
-        pass
+    def __init__(self, payload=None):
+        # 编码数据，通常是指向接收缓冲区的memoryview，解码时直接读取，不复制
+        self.payload = payload
 
     def duration(self) -> int:
         pass
@@ -15,3 +18,47 @@ class EncodedAudioFrame:
 
     def decode(self, b):
         pass
+
+
+class SimulatedAudioFrame(EncodedAudioFrame):
+    """
+    只有时长信息的帧，仿真时使用，解码输出静音
+    """
+    def __init__(self, num_samples: int, dtx: bool = False):
+        super().__init__()
+        self.num_samples = num_samples
+        self.dtx = dtx
+
+    def duration(self) -> int:
+        return self.num_samples
+
+    def is_dtx_packet(self) -> bool:
+        return self.dtx
+
+    def decode(self, b):
+        # 输出写到b中，返回(解码的样本数, 语音类型)
+        if b is not None:
+            b[:self.num_samples] = 0
+        speech_type = AUDIO_SPEECH_TYPE_COMFORT_NOISE if self.dtx else AUDIO_SPEECH_TYPE_SPEECH
+        return self.num_samples, speech_type
+
+
+class Pcm16AudioFrame(EncodedAudioFrame):
+    """
+    L16单声道帧（RFC 3551），payload是大端16bit采样，解码时直接从payload的memoryview转换到输出中
+    """
+    def __init__(self, payload):
+        super().__init__(payload)
+        # 归还接收缓冲区之后payload会被清空，时长提前算好
+        self.num_samples = len(payload) // 2
+
+    def duration(self) -> int:
+        return self.num_samples
+
+    def is_dtx_packet(self) -> bool:
+        return False
+
+    def decode(self, b):
+        if b is not None:
+            b[:self.num_samples] = np.frombuffer(self.payload, dtype='>i2', count=self.num_samples)
+        return self.num_samples, AUDIO_SPEECH_TYPE_SPEECH
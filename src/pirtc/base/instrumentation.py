@@ -0,0 +1,122 @@
+"""
+热路径的埋点：计数器、耗时直方图和可选的事件回调。
+
+组件构造时传入instrumentation，缺省为None。关闭时：
+- 事件埋点只多一次`is not None`判断；
+- 计时通过在实例上替换方法实现(wrap_methods)，不开启时方法调用没有任何额外开销。
+
+事件会累加同名计数器，设置了sink时再调用sink(name, fields)，sink可以写日志或者上报。
+"""
+from collections import Counter
+from time import perf_counter_ns
+
+# 耗时直方图按2的幂分桶，单位ns，最大的桶约为2^40ns(18分钟)
+NUM_TIMING_BUCKETS = 41
+
+
+class TimingHistogram:
+    __slots__ = ('count', 'total_ns', 'max_ns', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        # buckets[i]为耗时在[2^(i-1), 2^i)ns之间的次数
+        self.buckets = [0] * NUM_TIMING_BUCKETS
+
+    def add(self, elapsed_ns: int):
+        self.count += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        self.buckets[min(elapsed_ns.bit_length(), NUM_TIMING_BUCKETS - 1)] += 1
+
+    def mean_ns(self):
+        return self.total_ns / self.count if self.count else 0.0
+
+    def quantile_ns(self, q: float):
+        """
+        返回q分位所在桶的上界，精度为2倍
+        """
+        if self.count == 0:
+            return 0
+        target = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.buckets):
+            cumulative += n
+            if cumulative >= target:
+                return min(1 << i, self.max_ns)
+        return self.max_ns
+
+
+class Instrumentation:
+    def __init__(self, sink=None, timing: bool = True):
+        """
+        sink: 可选的回调sink(name, fields)，每个事件调用一次
+        timing: 是否对wrap_methods指定的方法计时
+        """
+        self.sink = sink
+        self.timing = timing
+        self.counters = Counter()
+        self.timings = {}
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def event(self, name: str, **fields):
+        self.counters[name] += 1
+        if self.sink is not None:
+            self.sink(name, fields)
+
+    def timing_histogram(self, name: str) -> TimingHistogram:
+        histogram = self.timings.get(name)
+        if histogram is None:
+            histogram = self.timings[name] = TimingHistogram()
+        return histogram
+
+    def timed(self, name: str, func):
+        histogram = self.timing_histogram(name)
+
+        def wrapper(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.add(perf_counter_ns() - start)
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def wrap_methods(self, obj, prefix: str, names):
+        """
+        用计时的版本替换obj上的方法，只影响这个实例
+        """
+        if not self.timing:
+            return
+        for name in names:
+            setattr(obj, name, self.timed(f'{prefix}.{name}', getattr(obj, name)))
+
+    def reset(self):
+        self.counters.clear()
+        self.timings.clear()
+
+    def snapshot(self):
+        return {
+            'counters': dict(self.counters),
+            'timings': {name: {'count': h.count,
+                               'mean_ns': h.mean_ns(),
+                               'p50_ns': h.quantile_ns(0.5),
+                               'p99_ns': h.quantile_ns(0.99),
+                               'max_ns': h.max_ns} for name, h in self.timings.items()},
+        }
+
+    def report(self):
+        lines = []
+        for name in sorted(self.counters):
+            lines.append(f'{name:<48} {self.counters[name]:>10}')
+        if self.timings:
+            lines.append(f'{"":<40} {"calls":>10} {"mean":>8} {"p50":>8} {"p99":>8} {"max":>8}')
+        for name in sorted(self.timings):
+            h = self.timings[name]
+            lines.append(f'{name:<40} {h.count:>10} {h.mean_ns() / 1000:>6.1f}us {h.quantile_ns(0.5) / 1000:>6.1f}us '
+                         f'{h.quantile_ns(0.99) / 1000:>6.1f}us {h.max_ns / 1000:>6.1f}us')
+        return '\n'.join(lines)
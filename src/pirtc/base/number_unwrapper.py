@@ -1,3 +1,5 @@
+import numpy as np
+
 
 class NumberUnwrapper:
     def __init__(self, bits: int):
@@ -14,22 +16,48 @@ class NumberUnwrapper:
             raise Exception(f"not support for {bits}bits")
 
     def unwrap(self, num):
-        if not self.last_value:
-            self.last_value = num
+        if self.last_value is None:
+            # 第一个值原样返回
+            self.last_unwrapped = num
         else:
-            wrap = self.wrap + 1
-            self.last_unwrapped += (num - self.last_value if self.last_value < num else wrap - (self.last_value - num))
-            if num > self.last_value and num - self.last_value > wrap / 2:
-                self.last_unwrapped -= wrap
+            self.last_unwrapped += self._diff(num)
 
         self.last_value = num
         return self.last_unwrapped
 
     def peek_unwrap(self, num):
-        if not self.last_value:
+        if self.last_value is None:
             return None
+        return self.last_unwrapped + self._diff(num)
+
+    def unwrap_array(self, nums) -> np.ndarray:
+        """
+        一次unwrap一个数组，结果与逐个调用unwrap相同，状态会延续到下一次调用。
+        """
+        nums = np.asarray(nums, dtype=np.int64)
+        if len(nums) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if self.last_value is None:
+            self.last_unwrapped = int(nums[0])
+            self.last_value = int(nums[0])
+
+        prev = np.empty_like(nums)
+        prev[0] = self.last_value
+        prev[1:] = nums[:-1]
+        wrap = self.wrap + 1
+        diff = (nums - prev) & self.wrap
+        diff -= wrap * ((diff > wrap // 2) | ((diff == wrap // 2) & (nums < prev)))
+        unwrapped = self.last_unwrapped + np.cumsum(diff)
+
+        self.last_unwrapped = int(unwrapped[-1])
+        self.last_value = int(nums[-1])
+        return unwrapped
+
+    def _diff(self, num):
+        # 距离上一个值不超过半个周期，超过半个周期认为是往回走
+        # 刚好半个周期时，数值更大的认为是更新的
         wrap = self.wrap + 1
-        last_unwrapped = self.last_unwrapped + (num - self.last_value if self.last_value < num else wrap - (self.last_value - num))
-        if num > self.last_value and num - self.last_value > wrap / 2:
-            last_unwrapped -= wrap
-        return last_unwrapped
+        diff = (num - self.last_value) & self.wrap
+        if diff > wrap // 2 or (diff == wrap // 2 and num < self.last_value):
+            diff -= wrap
+        return diff
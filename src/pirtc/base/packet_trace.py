@@ -0,0 +1,152 @@
+"""
+包到达记录的二进制trace格式。
+
+文件按列存储，每一列是连续的小端数组，按64字节对齐：
+
+    header: magic(8) version(u32) num_columns(u32) num_packets(u64)
+    column: name(24) dtype(8) offset(u64)   x num_columns
+    data:   column 0 | column 1 | ...
+
+读取时每一列直接numpy.memmap，切片不拷贝数据。
+"""
+import os
+import shutil
+import struct
+from dataclasses import dataclass
+
+import numpy as np
+
+MAGIC = b'PIRTCTRC'
+VERSION = 1
+ALIGNMENT = 64
+
+FLAG_MARKER = 0x01
+FLAG_RETRANSMISSION = 0x02
+FLAG_FEC = 0x04
+FLAG_DTX = 0x08
+
+# 列名、类型、缺省值
+COLUMNS = (
+    ('rtp_timestamp', '<u4', 0),
+    ('sequence_number', '<u2', 0),
+    ('arrival_time_ms', '<f8', 0),
+    ('send_time_ms', '<f8', np.nan),
+    ('payload_type', '<u1', 0),
+    ('size', '<u2', 0),
+    ('flags', '<u1', 0),
+)
+
+_HEADER = struct.Struct('<8sIIQ')
+_COLUMN = struct.Struct('<24s8sQ')
+
+
+@dataclass
+class PacketTraceChunk:
+    rtp_timestamp: np.ndarray
+    sequence_number: np.ndarray
+    arrival_time_ms: np.ndarray
+    send_time_ms: np.ndarray
+    payload_type: np.ndarray
+    size: np.ndarray
+    flags: np.ndarray
+
+    def __len__(self):
+        return len(self.rtp_timestamp)
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class PacketTraceWriter:
+    """
+    分块追加写入，每一列先写到临时文件，close时拼成最终的文件。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.num_packets = 0
+        self.spill_files = {name: open(f'{path}.{name}.tmp', 'wb') for name, _, _ in COLUMNS}
+
+    def write(self, **columns):
+        unknown = set(columns) - set(self.spill_files)
+        if unknown:
+            raise Exception(f"unknown trace columns {sorted(unknown)}")
+        num = len(next(iter(columns.values()))) if columns else 0
+        for name, dtype, default in COLUMNS:
+            values = np.asarray(columns[name], dtype=dtype) if name in columns else np.full(num, default, dtype=dtype)
+            if values.shape != (num,):
+                raise Exception(f"column {name} has {values.shape} values, expect {num}")
+            self.spill_files[name].write(values.tobytes())
+        self.num_packets += num
+
+    def close(self):
+        if not self.spill_files:
+            return
+        for f in self.spill_files.values():
+            f.close()
+
+        offset = _align(_HEADER.size + _COLUMN.size * len(COLUMNS))
+        offsets = []
+        for name, dtype, _ in COLUMNS:
+            offsets.append(offset)
+            offset = _align(offset + self.num_packets * np.dtype(dtype).itemsize)
+
+        with open(self.path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, len(COLUMNS), self.num_packets))
+            for (name, dtype, _), column_offset in zip(COLUMNS, offsets):
+                f.write(_COLUMN.pack(name.encode(), dtype.encode(), column_offset))
+            for (name, _, _), column_offset in zip(COLUMNS, offsets):
+                f.write(b'\0' * (column_offset - f.tell()))
+                with open(self.spill_files[name].name, 'rb') as spill:
+                    shutil.copyfileobj(spill, f)
+                os.remove(spill.name)
+        self.spill_files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class PacketTraceReader:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, num_columns, self.num_packets = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != MAGIC:
+                raise Exception(f"{path} is not a packet trace")
+            if version != VERSION:
+                raise Exception(f"not support trace version {version}")
+            layout = [_COLUMN.unpack(f.read(_COLUMN.size)) for _ in range(num_columns)]
+
+        self.columns = {}
+        for name, dtype, offset in layout:
+            name = name.rstrip(b'\0').decode()
+            dtype = dtype.rstrip(b'\0').decode()
+            if self.num_packets == 0:
+                self.columns[name] = np.zeros(0, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(self.num_packets,))
+
+    def __len__(self):
+        return self.num_packets
+
+    def __getitem__(self, s: slice) -> PacketTraceChunk:
+        return PacketTraceChunk(**{name: self.columns[name][s] for name, _, _ in COLUMNS})
+
+    def iter_chunks(self, chunk_size: int = 65536):
+        for begin in range(0, self.num_packets, chunk_size):
+            yield self[begin:begin + chunk_size]
+
+
+def received_bitrate_bps(arrival_time_ms, size, window_ms: int = 500) -> np.ndarray:
+    """
+    每个包到达时，过去window_ms内收到的码率，作为AimdRateControl.update的吞吐量输入。
+    arrival_time_ms需要单调不减。
+    """
+    arrival_time_ms = np.asarray(arrival_time_ms, dtype=np.float64)
+    bytes_sum = np.concatenate(([0], np.cumsum(np.asarray(size, dtype=np.int64))))
+    begin = np.searchsorted(arrival_time_ms, arrival_time_ms - window_ms, side='right')
+    window_bytes = bytes_sum[1:] - bytes_sum[begin]
+    return window_bytes * 8000 / window_ms
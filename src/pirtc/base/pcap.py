@@ -0,0 +1,170 @@
+"""
+pcap文件读取与RTP解析，按固定大小的块读文件，内存占用与文件大小无关。
+"""
+import struct
+from dataclasses import dataclass
+
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+
+IP_PROTO_UDP = 17
+
+_RTP_HEADER = struct.Struct('>BBHII')
+_UINT16 = struct.Struct('>H')
+
+
+@dataclass
+class RtpPacket:
+    arrival_time_ms: float
+    ssrc: int
+    payload_type: int
+    sequence_number: int
+    timestamp: int
+    marker: bool
+    payload_size: int
+    header_size: int = 12
+
+
+def iter_pcap_records(path: str, chunk_size: int = 1 << 20):
+    """
+    输出(linktype, arrival_time_ms, frame)，frame是读缓冲区上的memoryview，不拷贝数据。
+    """
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        if len(header) < 24:
+            raise Exception(f"{path} is not a pcap file")
+        for endian in ('<', '>'):
+            magic, = struct.unpack(endian + 'I', header[:4])
+            if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+                break
+        else:
+            raise Exception(f"{path} is not a pcap file")
+        linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0fffffff
+        sub_second_ms = 1e-6 if magic == PCAP_MAGIC_NS else 1e-3
+        record_header = struct.Struct(endian + 'IIII')
+
+        buf = b''
+        pos = 0
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buf = buf[pos:] + chunk
+            pos = 0
+            view = memoryview(buf)
+            while pos + 16 <= len(buf):
+                ts_sec, ts_sub, incl_len, _ = record_header.unpack_from(buf, pos)
+                if pos + 16 + incl_len > len(buf):
+                    break
+                yield linktype, ts_sec * 1000 + ts_sub * sub_second_ms, view[pos + 16:pos + 16 + incl_len]
+                pos += 16 + incl_len
+
+
+def parse_udp(linktype: int, frame):
+    """
+    返回(src_port, dst_port, payload)，不是UDP包或者是IP分片时返回None
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        if len(frame) < 14:
+            return None
+        offset = 14
+        ethertype = int.from_bytes(frame[12:14], 'big')
+        while ethertype in ETHERTYPE_VLAN and len(frame) >= offset + 4:
+            ethertype = int.from_bytes(frame[offset + 2:offset + 4], 'big')
+            offset += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(frame) < 16:
+            return None
+        offset = 16
+        ethertype = int.from_bytes(frame[14:16], 'big')
+    elif linktype == LINKTYPE_NULL:
+        if len(frame) < 4:
+            return None
+        offset = 4
+        family = int.from_bytes(frame[0:4], 'little')
+        ethertype = ETHERTYPE_IPV4 if family == 2 else ETHERTYPE_IPV6
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        if len(frame) < 1:
+            return None
+        offset = 0
+        ethertype = ETHERTYPE_IPV4 if frame[0] >> 4 == 4 else ETHERTYPE_IPV6
+    else:
+        raise Exception(f"not support link type {linktype}")
+
+    if ethertype == ETHERTYPE_IPV4:
+        if len(frame) < offset + 20:
+            return None
+        ihl = (frame[offset] & 0x0f) * 4
+        flags_fragment = int.from_bytes(frame[offset + 6:offset + 8], 'big')
+        if frame[offset + 9] != IP_PROTO_UDP or flags_fragment & 0x3fff:
+            return None
+        offset += ihl
+    elif ethertype == ETHERTYPE_IPV6:
+        # 不处理扩展头
+        if len(frame) < offset + 40 or frame[offset + 6] != IP_PROTO_UDP:
+            return None
+        offset += 40
+    else:
+        return None
+
+    if len(frame) < offset + 8:
+        return None
+    src_port = int.from_bytes(frame[offset:offset + 2], 'big')
+    dst_port = int.from_bytes(frame[offset + 2:offset + 4], 'big')
+    return src_port, dst_port, frame[offset + 8:]
+
+
+def parse_rtp(payload, arrival_time_ms: float = 0):
+    """
+    解析RTP头，RTCP或者非RTP数据返回None。payload可以是bytes或者memoryview，只读取头部，不复制数据
+    """
+    if len(payload) < 12 or payload[0] >> 6 != 2:
+        return None
+    first_byte, second_byte, sequence_number, timestamp, ssrc = _RTP_HEADER.unpack_from(payload)
+    payload_type = second_byte & 0x7f
+    if 64 <= payload_type < 96:
+        # RTCP(200~207)与RTP复用端口时，去掉marker后落在这个区间
+        return None
+    csrc_count = first_byte & 0x0f
+    header_size = 12 + 4 * csrc_count
+    if first_byte & 0x10:
+        if len(payload) < header_size + 4:
+            return None
+        header_size += 4 + 4 * _UINT16.unpack_from(payload, header_size + 2)[0]
+    payload_size = len(payload) - header_size
+    if first_byte & 0x20 and payload_size > 0:
+        payload_size -= payload[-1]
+    if payload_size < 0:
+        return None
+    return RtpPacket(arrival_time_ms=arrival_time_ms,
+                     ssrc=ssrc,
+                     payload_type=payload_type,
+                     sequence_number=sequence_number,
+                     timestamp=timestamp,
+                     marker=bool(second_byte & 0x80),
+                     payload_size=payload_size,
+                     header_size=header_size)
+
+
+def build_rtp(ssrc: int,
+              payload_type: int,
+              sequence_number: int,
+              timestamp: int,
+              payload: bytes = b'',
+              marker: bool = False) -> bytes:
+    """
+    生成不带CSRC和扩展头的RTP包
+    """
+    return _RTP_HEADER.pack(0x80, (0x80 if marker else 0) | payload_type, sequence_number & 0xffff,
+                            timestamp & 0xffffffff, ssrc) + payload
@@ -0,0 +1,69 @@
+"""
+预先分配的接收缓冲区。
+
+一整块bytearray切成num_slots个slot_size大小的槽，socket直接recv_into空闲的槽，
+包的payload是槽的memoryview，解析、缓存、解码都不复制数据。包被丢弃或者解码之后归还槽，
+高包率下收包不需要为每个包分配payload。槽用完时acquire返回None，由调用者自己分配。
+"""
+
+
+class ArenaSlot:
+    __slots__ = ('arena', 'index', 'view', 'in_use')
+
+    def __init__(self, arena, index: int, view: memoryview):
+        self.arena = arena
+        self.index = index
+        # 整个槽的memoryview，收包时写入
+        self.view = view
+        self.in_use = False
+
+    def release(self):
+        self.arena.release(self)
+
+
+class ReceiveArena:
+    def __init__(self, num_slots: int = 4096, slot_size: int = 2048):
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.buffer = bytearray(num_slots * slot_size)
+        view = memoryview(self.buffer)
+        self.slots = [ArenaSlot(self, i, view[i * slot_size:(i + 1) * slot_size]) for i in range(num_slots)]
+        # 栈，最近归还的槽先被使用，缓存更友好
+        self.free_slots = self.slots[::-1]
+        # 存放了包的acquire次数，以及槽用完、由调用者自己分配的次数
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self):
+        if not self.free_slots:
+            self.misses += 1
+            return None
+        self.hits += 1
+        slot = self.free_slots.pop()
+        slot.in_use = True
+        return slot
+
+    def cancel(self, slot):
+        """
+        acquire之后没有收到数据(socket已经读空)，撤销这次acquire，不计入hits/misses。
+        slot是acquire的返回值，可以是None
+        """
+        if slot is None:
+            self.misses -= 1
+            return
+        self.release(slot)
+        self.hits -= 1
+
+    def release(self, slot: ArenaSlot):
+        if slot.arena is not self:
+            raise Exception("slot does not belong to this arena")
+        if not slot.in_use:
+            raise Exception(f"arena slot {slot.index} released twice")
+        slot.in_use = False
+        self.free_slots.append(slot)
+
+    def num_free_slots(self):
+        return len(self.free_slots)
+
+    def num_used_slots(self):
+        return self.num_slots - len(self.free_slots)
@@ -0,0 +1,355 @@
+"""
+按流水线阶段统计耗时和内存分配的轻量profiler。
+
+cProfile对每个Python函数调用都计时，neteq中大量很小的函数被严重放大，热点不可信。
+这里只在指定的组件方法外面加计时器(在实例上替换方法，和Instrumentation.wrap_methods一样)：
+
+    profiler = StageProfiler()
+    profiler.instrument(neteq.packet_buffer, 'packet_buffer', ['insert_packet', 'get_next_packet'])
+    with profiler.stage('replay'):
+        replay_neteq(neteq, reader)
+    profiler.write_folded('neteq.folded')   # flamegraph.pl / speedscope可以直接读取
+    print(profiler.report())
+
+调用关系记录成一棵树，同一个方法在不同调用路径下分开统计。每个节点记录调用次数、包含子调用的耗时，
+自身耗时 = 总耗时 - 子节点耗时。计时器本身的开销用calibrate测量，报告中从各个节点扣除。
+扣除之后仍有偏差(计时器打乱了缓存和分支预测，很小的方法被放大得更多)，report传入不剖析时的耗时，
+会输出各阶段自身耗时之和比它多出多少，用来判断结果的可信程度。
+
+缺省只计时。memory='tracemalloc'时只统计内存、不计时(需要先tracemalloc.start())：
+每次调用被子调用切成若干段，每段只执行这个节点自己的代码，段内内存峰值相对段开始时的增量记为这个节点分配的字节数。
+这个值可以逐层相加、不会为负；段内分配后又释放、再分配的内存只计一次，所以是实际分配量的下界。
+另外记录调用结束时仍然占用的字节数(净增量，释放了调用之前分配的内存时为负)。
+profiler自己在每次调用中产生的对象同样用calibrate测量并扣除。统计内存时分配变慢，需要两者时分两次回放。
+"""
+import tracemalloc
+from contextlib import contextmanager
+from time import perf_counter_ns
+
+CALIBRATION_CALLS = 100000
+MEMORY_COUNTERS = (None, 'tracemalloc')
+
+
+class StageNode:
+    __slots__ = ('name', 'parent', 'children', 'calls', 'total_ns', 'child_ns', 'allocated', 'retained')
+
+    def __init__(self, name: str, parent=None):
+        self.name = name
+        self.parent = parent
+        self.children = {}
+        self.calls = 0
+        self.total_ns = 0
+        # 直接子节点的总耗时
+        self.child_ns = 0
+        # 自身代码分配的字节数(各段峰值增量之和)，以及包含子调用的净增量
+        self.allocated = 0
+        self.retained = 0
+
+    def child(self, name: str):
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = StageNode(name, self)
+        return node
+
+    def stage(self):
+        # 名字是stage.method，阶段是第一部分
+        return self.name.split('.', 1)[0]
+
+    def path(self):
+        names = []
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        return names[::-1]
+
+    def walk(self):
+        yield self
+        for child in self.children.values():
+            yield from child.walk()
+
+    def outermost(self):
+        # 祖先中没有同一个阶段的节点，按阶段汇总总耗时和调用次数时只计这些节点
+        stage = self.stage()
+        ancestor = self.parent
+        while ancestor.parent is not None:
+            if ancestor.stage() == stage:
+                return False
+            ancestor = ancestor.parent
+        return True
+
+
+class StageProfiler:
+    def __init__(self, memory: str = None):
+        """
+        memory: None只计时，tracemalloc只统计内存
+        """
+        if memory not in MEMORY_COUNTERS:
+            raise Exception(f"unknown memory counter: {memory}")
+        self.memory = memory
+        self.root = StageNode('root')
+        self.stack = [self.root]
+        # 统计内存时每层调用当前段开始时的内存，以及调用开始时的内存，与stack对应
+        self.segment_start = [0]
+        self.entry_memory = [0]
+        # 计时器的开销：计入被测节点自身的部分，以及计入调用者的部分
+        self.inner_overhead_ns = 0
+        self.outer_overhead_ns = 0
+        # 统计内存时每次调用profiler自己产生的字节数：计入被测节点的部分，以及计入调用者的部分
+        self.inner_overhead_bytes = 0
+        self.outer_overhead_bytes = 0
+        # 同样测量净增量中profiler的部分：每次自身调用，以及每次后代调用
+        self.inner_retained_bytes = 0
+        self.outer_retained_bytes = 0
+
+    def wrap(self, name: str, func):
+        if self.memory is not None:
+            return self._wrap_memory(name, func)
+        stack = self.stack
+
+        def wrapper(*args, **kwargs):
+            parent = stack[-1]
+            node = parent.children.get(name)
+            if node is None:
+                node = parent.child(name)
+            stack.append(node)
+            start = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter_ns() - start
+                stack.pop()
+                node.calls += 1
+                node.total_ns += elapsed
+                parent.child_ns += elapsed
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def _wrap_memory(self, name: str, func):
+        enter = self._enter_memory
+        leave = self._leave_memory
+
+        def wrapper(*args, **kwargs):
+            enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                leave()
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def _enter_memory(self, name: str):
+        parent = self.stack[-1]
+        node = parent.child(name)
+        self.stack.append(node)
+        # 读数放在最后：之前产生的对象算在调用者的段中
+        current, peak = tracemalloc.get_traced_memory()
+        parent.allocated += peak - self.segment_start[-1]
+        self.segment_start.append(current)
+        # 存负值得到另一个int对象，否则第一次子调用结束替换段开始时，旧的int还被这里引用，多出32字节
+        self.entry_memory.append(-current)
+        tracemalloc.reset_peak()
+
+    def _leave_memory(self):
+        # 读数放在最前：之后产生的对象算在调用者的新一段中
+        current, peak = tracemalloc.get_traced_memory()
+        node = self.stack.pop()
+        node.calls += 1
+        node.allocated += peak - self.segment_start.pop()
+        node.retained += current + self.entry_memory.pop()
+        self.segment_start[-1] = current
+        tracemalloc.reset_peak()
+
+    def instrument(self, obj, stage: str, methods):
+        """
+        把obj上的方法替换成计时的版本，节点名为stage.method，只影响这个实例
+        """
+        for method in methods:
+            setattr(obj, method, self.wrap(f'{stage}.{method}', getattr(obj, method)))
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        把一段代码作为一个节点统计，通常用来包住整个回放，没有被instrument的代码都算在它的自身耗时中
+        """
+        if self.memory is not None:
+            self._enter_memory(name)
+            try:
+                yield self.stack[-1]
+            finally:
+                self._leave_memory()
+            return
+
+        parent = self.stack[-1]
+        node = parent.child(name)
+        self.stack.append(node)
+        start = perf_counter_ns()
+        try:
+            yield node
+        finally:
+            elapsed = perf_counter_ns() - start
+            self.stack.pop()
+            node.calls += 1
+            node.total_ns += elapsed
+            parent.child_ns += elapsed
+
+    def calibrate(self, calls: int = CALIBRATION_CALLS):
+        """
+        测量一次被统计的空调用的开销，报告时从各个节点扣除。计时取多次中最小的，内存开销是确定的
+        """
+        if self.memory is not None:
+            return self._calibrate_memory(calls)
+
+        profiler = StageProfiler()
+
+        def noop():
+            return None
+        wrapped = profiler.wrap('noop', noop)
+
+        best_inner = best_outer = None
+        for _ in range(5):
+            profiler.root = StageNode('root')
+            profiler.stack[:] = [profiler.root]
+            start = perf_counter_ns()
+            for _ in range(calls):
+                noop()
+            bare_ns = perf_counter_ns() - start
+            start = perf_counter_ns()
+            for _ in range(calls):
+                wrapped()
+            wrapped_ns = perf_counter_ns() - start
+            node = profiler.root.children['noop']
+            inner = max(node.total_ns - bare_ns, 0) / calls
+            outer = max(wrapped_ns - bare_ns, 0) / calls
+            best_inner = inner if best_inner is None else min(best_inner, inner)
+            best_outer = outer if best_outer is None else min(best_outer, outer)
+        self.inner_overhead_ns = best_inner
+        self.outer_overhead_ns = best_outer
+        return best_inner, best_outer
+
+    def _calibrate_memory(self, calls):
+        if not tracemalloc.is_tracing():
+            raise Exception("tracemalloc is not tracing")
+        profiler = StageProfiler(self.memory)
+
+        def noop():
+            return None
+        wrapped = profiler.wrap('noop', noop)
+
+        def loop():
+            for _ in range(calls):
+                wrapped()
+        wrapped_loop = profiler.wrap('loop', loop)
+        # 先跑一次，让字典、列表等增长到稳定的大小
+        wrapped_loop()
+        profiler.root = StageNode('root')
+        profiler.stack[:] = [profiler.root]
+        wrapped_loop()
+        loop_node = profiler.root.children['loop']
+        noop_node = loop_node.children['noop']
+        self.inner_overhead_bytes = noop_node.allocated / calls
+        self.outer_overhead_bytes = loop_node.allocated / calls
+        self.inner_retained_bytes = noop_node.retained / calls
+        self.outer_retained_bytes = loop_node.retained / calls
+        return self.inner_overhead_bytes, self.outer_overhead_bytes
+
+    def total_ns(self, node: StageNode):
+        # 扣除自身计时器的开销
+        if node.parent is None:
+            return node.child_ns
+        return max(node.total_ns - node.calls * self.inner_overhead_ns, 0)
+
+    def self_ns(self, node: StageNode):
+        # 扣除子节点的耗时以及调用子节点时计时器的开销
+        child_ns = sum(self.total_ns(c) for c in node.children.values())
+        child_calls = sum(c.calls for c in node.children.values())
+        overhead_ns = child_calls * (self.outer_overhead_ns - self.inner_overhead_ns)
+        return max(self.total_ns(node) - child_ns - overhead_ns, 0)
+
+    def self_allocated(self, node: StageNode):
+        # 扣除自身以及调用子节点时profiler产生的对象
+        child_calls = sum(c.calls for c in node.children.values())
+        overhead = node.calls * self.inner_overhead_bytes + child_calls * self.outer_overhead_bytes
+        return max(node.allocated - overhead, 0)
+
+    def retained(self, node: StageNode):
+        descendant_calls = sum(n.calls for n in node.walk()) - node.calls
+        return node.retained - node.calls * self.inner_retained_bytes - descendant_calls * self.outer_retained_bytes
+
+    def total_allocated(self, node: StageNode):
+        return sum(self.self_allocated(n) for n in node.walk())
+
+    def num_calls(self):
+        return sum(node.calls for node in self.root.walk())
+
+    def folded_stacks(self, value: str = 'time'):
+        """
+        collapsed stack格式，每行"a;b;c 值"，time为自身耗时(us)，memory为自身分配的字节数
+        """
+        lines = []
+        for node in self.root.walk():
+            if node.parent is None:
+                continue
+            amount = self.self_ns(node) // 1000 if value == 'time' else self.self_allocated(node)
+            if amount > 0:
+                lines.append(f'{";".join(node.path())} {int(amount)}')
+        return lines
+
+    def write_folded(self, path: str, value: str = 'time'):
+        with open(path, 'w') as f:
+            for line in self.folded_stacks(value):
+                f.write(line + '\n')
+
+    def stage_stats(self):
+        """
+        按阶段汇总：{stage: {calls, total_ns, self_ns, allocated, retained}}。
+        阶段嵌套在同一个阶段中时(比如packet_buffer.insert_packet调用partial_flush)，
+        调用次数、总耗时和净增量只计外层，自身耗时和分配的字节数各层相加
+        """
+        stats = {}
+        for node in self.root.walk():
+            if node.parent is None:
+                continue
+            s = stats.setdefault(node.stage(), {'calls': 0, 'total_ns': 0, 'self_ns': 0, 'allocated': 0,
+                                                'retained': 0})
+            s['self_ns'] += self.self_ns(node)
+            s['allocated'] += self.self_allocated(node)
+            if node.outermost():
+                s['calls'] += node.calls
+                s['total_ns'] += self.total_ns(node)
+                s['retained'] += self.retained(node)
+        return stats
+
+    def report(self, unprofiled_ns: int = None):
+        """
+        unprofiled_ns: 同样的回放不剖析时的耗时，给出时输出剩余的偏差
+        """
+        if self.memory is not None:
+            return self._memory_report()
+        wall_ns = self.total_ns(self.root)
+        stats = self.stage_stats()
+        lines = [f'wall {wall_ns / 1e6:.1f}ms, {self.num_calls()} timed calls, '
+                 f'timer overhead {self.outer_overhead_ns:.0f}ns/call (subtracted)']
+        if unprofiled_ns:
+            self_ns = sum(s['self_ns'] for s in stats.values())
+            bias_ns = self_ns - unprofiled_ns
+            lines.append(f'self total {self_ns / 1e6:.1f}ms, unprofiled {unprofiled_ns / 1e6:.1f}ms, '
+                         f'bias {bias_ns / 1e6:+.1f}ms ({bias_ns / unprofiled_ns:+.1%})')
+        lines.append(f'{"stage":<20} {"calls":>10} {"total":>10} {"self":>10} {"self%":>7} {"ops/sec":>12}')
+        for stage, s in sorted(stats.items(), key=lambda item: -item[1]['self_ns']):
+            ops = s['calls'] / (s['total_ns'] / 1e9) if s['total_ns'] > 0 else float('inf')
+            lines.append(f'{stage:<20} {s["calls"]:>10} {s["total_ns"] / 1e6:>8.1f}ms {s["self_ns"] / 1e6:>8.1f}ms '
+                         f'{s["self_ns"] / wall_ns if wall_ns else 0:>7.1%} {ops:>12.0f}')
+        return '\n'.join(lines)
+
+    def _memory_report(self):
+        total = self.total_allocated(self.root)
+        lines = [f'allocated {total / 1e6:.1f}MB, {self.num_calls()} calls, '
+                 f'profiler overhead {self.inner_overhead_bytes + self.outer_overhead_bytes:.0f}B/call (subtracted)',
+                 f'{"stage":<20} {"calls":>10} {"allocated":>12} {"alloc%":>7} {"bytes/call":>11} {"retained":>12}']
+        stats = self.stage_stats()
+        for stage, s in sorted(stats.items(), key=lambda item: -item[1]['allocated']):
+            lines.append(f'{stage:<20} {s["calls"]:>10} {s["allocated"] / 1e6:>10.2f}MB '
+                         f'{s["allocated"] / total if total else 0:>7.1%} '
+                         f'{s["allocated"] / s["calls"] if s["calls"] else 0:>11.1f} {s["retained"] / 1e3:>10.1f}KB')
+        return '\n'.join(lines)
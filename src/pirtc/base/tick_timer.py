@@ -1,3 +1,4 @@
+import heapq
 
 
 class TickTimer:
@@ -16,10 +17,15 @@ class TickTimer:
 
 
 class StopWatch:
+    __slots__ = ('tick_timer', 'start_tick')
+
     def __init__(self, tick_timer: TickTimer):
         self.tick_timer = tick_timer
         self.start_tick = tick_timer.get_ticks()
 
+    def restart(self):
+        self.start_tick = self.tick_timer.get_ticks()
+
     def elapsed_ticks(self):
         return self.tick_timer.get_ticks() - self.start_tick
 
@@ -36,6 +42,60 @@ class CountDown:
     def finished(self):
         return self.stop_watch.elapsed_ticks() >= self.ticks_to_count
 
+    def finish_tick(self):
+        # 倒计时结束时的tick
+        return self.stop_watch.start_tick + self.ticks_to_count
+
+
+class EventScheduler:
+    """
+    离散事件调度，时钟直接跳到下一个事件所在的tick，而不是逐个tick推进。
+    StopWatch/CountDown只依赖tick的差值，跳跃推进不影响结果。
+
+    同一个tick的事件按priority(小的先执行)、再按加入的顺序执行。
+    回调中可以继续加入事件，也可以自己推进tick_timer，调度器只会向前推进时钟。
+    """
+    def __init__(self, tick_timer: TickTimer):
+        self.tick_timer = tick_timer
+        self.events = []
+        self.seq = 0
+
+    def schedule_at(self, tick: int, callback, priority: int = 0):
+        if tick < self.tick_timer.get_ticks():
+            raise Exception(f"can not schedule event in the past: {tick}")
+        heapq.heappush(self.events, (tick, priority, self.seq, callback))
+        self.seq += 1
+
+    def schedule_after(self, ticks: int, callback, priority: int = 0):
+        self.schedule_at(self.tick_timer.get_ticks() + ticks, callback, priority)
+
+    def schedule_countdown(self, count_down: CountDown, callback, priority: int = 0):
+        self.schedule_at(max(count_down.finish_tick(), self.tick_timer.get_ticks()), callback, priority)
+
+    def next_event_tick(self):
+        return self.events[0][0] if self.events else None
+
+    def empty(self):
+        return not self.events
+
+    def advance_to(self, tick: int):
+        if tick > self.tick_timer.get_ticks():
+            self.tick_timer.increment(tick - self.tick_timer.get_ticks())
+
+    def run_until(self, tick: int):
+        # 执行tick之前(包含)的事件，时钟停在tick
+        while self.events and self.events[0][0] <= tick:
+            event_tick, _, _, callback = heapq.heappop(self.events)
+            self.advance_to(event_tick)
+            callback()
+        self.advance_to(tick)
+
+    def run(self):
+        while self.events:
+            event_tick, _, _, callback = heapq.heappop(self.events)
+            self.advance_to(event_tick)
+            callback()
+
 
 if __name__ == "__main__":
     tt = TickTimer(10)
@@ -0,0 +1,29 @@
+from collections import deque
+
+
+class AcknowledgedBitrateEstimator:
+    """
+    按到达时间统计最近window_ms内对端确认收到的数据量，得到吞吐率。第一个窗口填满之前没有结果。
+    """
+    def __init__(self, window_ms: int = 500):
+        self.window_ms = window_ms
+        self.packets = deque()
+        self.bytes_in_window = 0
+        self.first_arrival_time_ms = None
+        self.last_arrival_time_ms = None
+
+    def incoming_packet(self, arrival_time_ms, size):
+        if self.first_arrival_time_ms is None:
+            self.first_arrival_time_ms = arrival_time_ms
+        if self.last_arrival_time_ms is None or arrival_time_ms > self.last_arrival_time_ms:
+            self.last_arrival_time_ms = arrival_time_ms
+        self.packets.append((arrival_time_ms, size))
+        self.bytes_in_window += size
+        while self.packets and self.packets[0][0] <= self.last_arrival_time_ms - self.window_ms:
+            self.bytes_in_window -= self.packets.popleft()[1]
+
+    def bitrate_bps(self):
+        if self.first_arrival_time_ms is None or \
+                self.last_arrival_time_ms - self.first_arrival_time_ms < self.window_ms:
+            return None
+        return int(self.bytes_in_window * 8 * 1000 / self.window_ms)
@@ -1,5 +1,4 @@
 import math
-from idlelib.run import Executive
 
 from .link_capacity_estimator import LinkCapacityEstimator
 
@@ -117,10 +116,11 @@ class AimdRateControl:
     def get_near_max_increase_rate_bps_per_second(self) -> int:
         # 这里假设视频帧30fps
         frame_interval = 1000 / 30
-        frame_size = self.current_bitrate * frame_interval
-        # 假设每个帧1200字节
-        packet_bytes = 1200
-        packet_per_frame = math.ceil(frame_size / packet_bytes)
+        # 每帧的比特数
+        frame_size = self.current_bitrate * frame_interval / 1000
+        # 假设每个包1200字节
+        packet_bits = 1200 * 8
+        packet_per_frame = math.ceil(frame_size / packet_bits)
         avg_pkt_size = frame_size / packet_per_frame
 
         response_time = self.rtt + 100
@@ -232,7 +232,7 @@ class AimdRateControl:
 
         new_bitrate = bitrate
         new_bitrate = max(new_bitrate, self.min_conf_bitrate)
-        return bitrate
+        return new_bitrate
 
     def _multiplicative_rate_increase(self, ts: int, last_ts: int, current_bitrate):
         alpha = 1.08
@@ -243,7 +243,7 @@ class AimdRateControl:
         return increase
 
     def _additive_rate_increase(self, ts: int, last_ts):
-        time_period_seconds = ts - last_ts
+        time_period_seconds = (ts - last_ts) / 1000
         increase = self.get_near_max_increase_rate_bps_per_second() * time_period_seconds
         return increase
 
@@ -0,0 +1,227 @@
+"""
+多路GCC发送端共享一个瓶颈链路的仿真。
+
+每个时间步是一个feedback间隔：
+1. 每路按当前目标码率均匀发包；
+2. 所有包按发送时间合并，进入FIFO瓶颈队列(容量、缓冲区大小、单向传播延迟、随机丢包)；
+3. 接收端每个feedback间隔把收到的包汇总成一个feedback，经过反向传播延迟送回发送端，
+   发送端的DelayBasedBwe处理之后得到新的目标码率。
+
+队列一整步用前缀和计算离开时间，只有缓冲区溢出的步才逐包计算。
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from .delay_based_bwe import DelayBasedBwe
+
+
+@dataclass
+class BottleneckConfig:
+    capacity_bps: int = 50000000
+    # 队列最多缓存的字节数，超过之后尾部丢弃
+    buffer_bytes: int = 1000000
+    # 单向传播延迟，反向的feedback也使用这个延迟
+    propagation_delay_ms: float = 25
+    # 链路上的随机丢包率
+    loss_rate: float = 0.0
+
+
+class BottleneckLink:
+    def __init__(self, config: BottleneckConfig, seed: int = 0):
+        self.config = config
+        self.rng = np.random.default_rng(seed)
+        # 队列中最后一个包发送完成的时间
+        self.busy_until_ms = 0.0
+
+    def transmit(self, send_time_ms, size):
+        """
+        send_time_ms需要升序，返回(到达时间, 排队延迟)，被丢弃的包两者都为nan
+        """
+        send_time_ms = np.asarray(send_time_ms, dtype=np.float64)
+        size = np.asarray(size)
+        service_ms = size * 8000 / self.config.capacity_bps
+        if len(send_time_ms) == 0:
+            return np.empty(0), np.empty(0)
+
+        # finish[i] = max(send[i], finish[i-1]) + service[i]，展开成前缀和加前缀最大值
+        cum_service_ms = np.cumsum(service_ms)
+        finish_ms = cum_service_ms + np.maximum(
+            self.busy_until_ms, np.maximum.accumulate(send_time_ms - (cum_service_ms - service_ms)))
+        prev_finish_ms = np.concatenate(([self.busy_until_ms], finish_ms[:-1]))
+        backlog_bytes = np.maximum(prev_finish_ms - send_time_ms, 0) * self.config.capacity_bps / 8000
+        if np.any(backlog_bytes + size > self.config.buffer_bytes):
+            finish_ms = self._transmit_with_drop(send_time_ms, service_ms, size)
+        else:
+            self.busy_until_ms = float(finish_ms[-1])
+
+        queue_delay_ms = finish_ms - service_ms - send_time_ms
+        arrival_time_ms = finish_ms + self.config.propagation_delay_ms
+        if self.config.loss_rate > 0:
+            arrival_time_ms[self.rng.random(len(arrival_time_ms)) < self.config.loss_rate] = np.nan
+        return arrival_time_ms, queue_delay_ms
+
+    def _transmit_with_drop(self, send_time_ms, service_ms, size):
+        finish_ms = np.full(len(send_time_ms), np.nan)
+        busy_until_ms = self.busy_until_ms
+        bytes_per_ms = self.config.capacity_bps / 8000
+        for i, (send_ms, service, packet_size) in enumerate(zip(send_time_ms.tolist(), service_ms.tolist(),
+                                                               size.tolist())):
+            if max(busy_until_ms - send_ms, 0) * bytes_per_ms + packet_size > self.config.buffer_bytes:
+                continue
+            busy_until_ms = max(busy_until_ms, send_ms) + service
+            finish_ms[i] = busy_until_ms
+        self.busy_until_ms = busy_until_ms
+        return finish_ms
+
+
+@dataclass
+class SimulationResult:
+    # 每个统计间隔结束的时间
+    time_ms: np.ndarray
+    # 统计间隔结束时每路的目标码率，num_intervals x num_flows
+    target_bps: np.ndarray
+    # 统计间隔内每路接收端的吞吐率
+    throughput_bps: np.ndarray
+    # 统计间隔内的平均排队延迟和最大排队延迟
+    queue_delay_ms: np.ndarray
+    max_queue_delay_ms: np.ndarray
+    # 统计间隔内的丢包率(缓冲区溢出和随机丢包)
+    loss_rate: np.ndarray
+    # 已经开始发送的流的吞吐率的Jain公平性指数
+    fairness: np.ndarray
+
+
+def jain_fairness(values):
+    values = np.asarray(values, dtype=np.float64)
+    square_sum = np.sum(values * values)
+    if len(values) == 0 or square_sum == 0:
+        return 1.0
+    return float(np.sum(values) ** 2 / (len(values) * square_sum))
+
+
+class MultiFlowSimulator:
+    def __init__(self,
+                 num_flows: int,
+                 link_config: BottleneckConfig = None,
+                 start_bitrate_bps: int = 300000,
+                 feedback_interval_ms: float = 50,
+                 packet_size: int = 1200,
+                 start_time_ms=None,
+                 seed: int = 0):
+        """
+        start_time_ms是每路开始发送的时间，缺省全部从0开始
+        """
+        self.link_config = link_config if link_config is not None else BottleneckConfig()
+        self.link = BottleneckLink(self.link_config, seed)
+        self.num_flows = num_flows
+        self.feedback_interval_ms = feedback_interval_ms
+        self.packet_size = packet_size
+        self.flows = [DelayBasedBwe(start_bitrate_bps) for _ in range(num_flows)]
+        for bwe in self.flows:
+            bwe.set_rtt(2 * self.link_config.propagation_delay_ms)
+
+        rng = np.random.default_rng(seed)
+        # 每路在一步内的发包相位，避免所有流同时发包
+        self.phase = rng.random(num_flows)
+        self.start_time_ms = np.zeros(num_flows) if start_time_ms is None else \
+            np.asarray(start_time_ms, dtype=np.float64)
+        self.target_bps = np.full(num_flows, float(start_bitrate_bps))
+        self.budget_bytes = np.zeros(num_flows)
+        self.now_ms = 0.0
+
+        # 已经到达接收端、feedback还没有送回发送端的包
+        self.pending = {name: np.empty(0) for name in ['flow', 'send', 'arrival', 'size', 'deliver']}
+        self._reset_interval_stats()
+
+    def _reset_interval_stats(self):
+        self.received_bytes = np.zeros(self.num_flows)
+        self.queue_delay_sum_ms = 0.0
+        self.max_queue_delay_ms = 0.0
+        self.num_queued = 0
+        self.num_sent = 0
+        self.num_lost = 0
+
+    def step(self):
+        """
+        推进一个feedback间隔
+        """
+        interval_ms = self.feedback_interval_ms
+        active = self.start_time_ms <= self.now_ms
+        self.budget_bytes += np.where(active, self.target_bps * interval_ms / 8000, 0)
+        count = (self.budget_bytes // self.packet_size).astype(np.int64)
+        self.budget_bytes -= count * self.packet_size
+
+        # 每路在这一步内均匀发送count个包
+        flow = np.repeat(np.arange(self.num_flows), count)
+        index = np.arange(len(flow)) - np.repeat(np.cumsum(count) - count, count)
+        send_time_ms = self.now_ms + (index + self.phase[flow]) * interval_ms / count[flow]
+        order = np.argsort(send_time_ms, kind='stable')
+        flow = flow[order]
+        send_time_ms = send_time_ms[order]
+        size = np.full(len(flow), self.packet_size)
+        arrival_time_ms, queue_delay_ms = self.link.transmit(send_time_ms, size)
+
+        received = ~np.isnan(arrival_time_ms)
+        self.num_sent += len(flow)
+        self.num_lost += int(len(flow) - np.count_nonzero(received))
+        self.received_bytes += np.bincount(flow[received], weights=size[received], minlength=self.num_flows)
+        queued = queue_delay_ms[~np.isnan(queue_delay_ms)]
+        if len(queued):
+            self.num_queued += len(queued)
+            self.queue_delay_sum_ms += float(queued.sum())
+            self.max_queue_delay_ms = max(self.max_queue_delay_ms, float(queued.max()))
+
+        # 接收端按到达时间每个间隔发一次feedback
+        deliver_ms = (np.floor(arrival_time_ms[received] / interval_ms) + 1) * interval_ms + \
+            self.link_config.propagation_delay_ms
+        new = {'flow': flow[received], 'send': send_time_ms[received], 'arrival': arrival_time_ms[received],
+               'size': size[received], 'deliver': deliver_ms}
+        pending = {name: np.concatenate((self.pending[name], new[name])) for name in self.pending}
+
+        self.now_ms += interval_ms
+        due = pending['deliver'] <= self.now_ms
+        self.pending = {name: values[~due] for name, values in pending.items()}
+        self._deliver_feedback({name: values[due] for name, values in pending.items()})
+
+    def _deliver_feedback(self, feedback):
+        if len(feedback['flow']) == 0:
+            return
+        order = np.lexsort((feedback['arrival'], feedback['deliver'], feedback['flow']))
+        flow = feedback['flow'][order].astype(np.int64)
+        deliver_ms = feedback['deliver'][order]
+        send_time_ms = feedback['send'][order].tolist()
+        arrival_time_ms = feedback['arrival'][order].tolist()
+        size = feedback['size'][order].astype(np.int64).tolist()
+
+        # 每个(流, feedback时间)是一个feedback
+        bounds = np.flatnonzero((np.diff(flow) != 0) | (np.diff(deliver_ms) != 0)) + 1
+        begins = np.r_[0, bounds].tolist()
+        ends = np.r_[bounds, len(flow)].tolist()
+        for begin, end in zip(begins, ends):
+            f = int(flow[begin])
+            self.target_bps[f] = self.flows[f].incoming_feedback(
+                send_time_ms[begin:end], arrival_time_ms[begin:end], size[begin:end], float(deliver_ms[begin]))
+
+    def run(self, duration_ms: float, report_interval_ms: float = 1000) -> SimulationResult:
+        rows = {name: [] for name in ['time_ms', 'target_bps', 'throughput_bps', 'queue_delay_ms',
+                                      'max_queue_delay_ms', 'loss_rate', 'fairness']}
+        end_ms = self.now_ms + duration_ms
+        next_report_ms = self.now_ms + report_interval_ms
+        interval_start_ms = self.now_ms
+        while self.now_ms < end_ms:
+            self.step()
+            if self.now_ms >= next_report_ms or self.now_ms >= end_ms:
+                elapsed_ms = self.now_ms - interval_start_ms
+                throughput_bps = self.received_bytes * 8000 / elapsed_ms
+                rows['time_ms'].append(self.now_ms)
+                rows['target_bps'].append(self.target_bps.copy())
+                rows['throughput_bps'].append(throughput_bps)
+                rows['queue_delay_ms'].append(self.queue_delay_sum_ms / self.num_queued if self.num_queued else 0.0)
+                rows['max_queue_delay_ms'].append(self.max_queue_delay_ms)
+                rows['loss_rate'].append(self.num_lost / self.num_sent if self.num_sent else 0.0)
+                rows['fairness'].append(jain_fairness(throughput_bps[self.start_time_ms < self.now_ms]))
+                self._reset_interval_stats()
+                interval_start_ms = self.now_ms
+                next_report_ms += report_interval_ms
+        return SimulationResult(**{name: np.asarray(values) for name, values in rows.items()})
@@ -0,0 +1,215 @@
+"""
+发送端基于延迟的带宽估计：
+
+    transport feedback -> InterArrival(按发送时间分组) -> TrendlineEstimator(延迟梯度)
+        -> OveruseDetector(自适应阈值) -> AimdRateControl.update
+
+feedback按批处理，可以直接回放包含发送时间、到达时间和包大小的大日志。
+"""
+import math
+
+import numpy as np
+
+from .acknowledged_bitrate_estimator import AcknowledgedBitrateEstimator
+from .aimd_control import AimdRateControl
+from .inter_arrival import InterArrival
+from .overuse_detector import OveruseDetector
+from .trendline_estimator import TrendlineEstimator
+
+# 超过2s没有收到包，重新开始分组和梯度估计
+STREAM_TIMEOUT_MS = 2000
+
+
+class DelayBasedBwe:
+    def __init__(self,
+                 start_bitrate_bps: int = 300000,
+                 min_bitrate_bps: int = 5000):
+        self.inter_arrival = InterArrival()
+        self.trendline = TrendlineEstimator()
+        self.detector = OveruseDetector()
+        self.rate_control = AimdRateControl()
+        self.rate_control.set_min_bitrate(min_bitrate_bps)
+        self.rate_control.set_start_bitrate(start_bitrate_bps)
+        self.acknowledged_bitrate = AcknowledgedBitrateEstimator()
+        self.last_seen_packet_ms = None
+
+    def incoming_feedback(self, send_time_ms, arrival_time_ms, size, feedback_time_ms=None) -> int:
+        """
+        处理一个transport feedback中的所有包，包需要按到达时间排序，到达时间为nan的是丢失的包。
+        feedback_time_ms是收到feedback的本地时间，缺省使用最后一个包的到达时间。返回目标码率。
+        """
+        now_ms = feedback_time_ms
+        for send_ms, arrival_ms, packet_size in zip(send_time_ms, arrival_time_ms, size):
+            if math.isnan(arrival_ms):
+                continue
+            if feedback_time_ms is None:
+                now_ms = arrival_ms if now_ms is None else max(now_ms, arrival_ms)
+            self.acknowledged_bitrate.incoming_packet(arrival_ms, packet_size)
+            self.incoming_packet_feedback(send_ms, arrival_ms, packet_size, now_ms)
+        if now_ms is None:
+            # 整个feedback都是丢包
+            return self.rate_control.latest_estimate()
+        return self.maybe_update_estimate(now_ms)
+
+    def incoming_packet_feedback(self, send_time_ms, arrival_time_ms, size, now_ms):
+        if self.last_seen_packet_ms is not None and now_ms - self.last_seen_packet_ms > STREAM_TIMEOUT_MS:
+            self.inter_arrival.reset()
+            self.trendline.reset()
+        self.last_seen_packet_ms = now_ms
+
+        deltas = self.inter_arrival.compute_deltas(send_time_ms, arrival_time_ms, now_ms, size)
+        if deltas is None:
+            return
+        send_delta_ms, arrival_delta_ms, _ = deltas
+        trend = self.trendline.update(arrival_delta_ms, send_delta_ms, arrival_time_ms)
+        self.detector.detect(trend, send_delta_ms, self.trendline.num_of_deltas, arrival_time_ms)
+
+    def incoming_feedback_batch(self, feedback_time_ms, report_end, send_time_ms, arrival_time_ms, size):
+        """
+        批量处理多个feedback，第i个feedback包含[report_end[i-1], report_end[i])的包，本地收到的时间是feedback_time_ms[i]。
+        先逐包分组，再用TrendlineEstimator.update_batch一次算出所有组的斜率，结果和逐个调用incoming_feedback一致。
+        返回每个feedback之后的(目标码率, 带宽使用状态)数组。
+        """
+        feedback_time_ms = np.asarray(feedback_time_ms, dtype=np.float64).tolist()
+        report_end = np.asarray(report_end, dtype=np.int64).tolist()
+        send_time_ms = np.asarray(send_time_ms, dtype=np.float64).tolist()
+        arrival_time_ms = np.asarray(arrival_time_ms, dtype=np.float64).tolist()
+        size = np.asarray(size).tolist()
+
+        # 逐包分组，stream超时重置的位置把组分成多段，段之间trendline要重置
+        segments = [([], [], [])]
+        groups_per_report = []
+        acked_per_report = []
+        num_groups = 0
+        begin = 0
+        for now_ms, end in zip(feedback_time_ms, report_end):
+            for i in range(begin, end):
+                arrival_ms = arrival_time_ms[i]
+                if math.isnan(arrival_ms):
+                    continue
+                self.acknowledged_bitrate.incoming_packet(arrival_ms, size[i])
+                if self.last_seen_packet_ms is not None and now_ms - self.last_seen_packet_ms > STREAM_TIMEOUT_MS:
+                    self.inter_arrival.reset()
+                    segments.append(([], [], []))
+                self.last_seen_packet_ms = now_ms
+                deltas = self.inter_arrival.compute_deltas(send_time_ms[i], arrival_ms, now_ms, size[i])
+                if deltas is not None:
+                    segments[-1][0].append(deltas[0])
+                    segments[-1][1].append(deltas[1])
+                    segments[-1][2].append(arrival_ms)
+                    num_groups += 1
+            begin = end
+            groups_per_report.append(num_groups)
+            acked_per_report.append(self.acknowledged_bitrate.bitrate_bps())
+
+        initial_state = self.detector.state()
+        group_states = []
+        for i, (send_deltas, arrival_deltas, arrival_times) in enumerate(segments):
+            if i > 0:
+                self.trendline.reset()
+            trends, num_of_deltas = self.trendline.update_batch(arrival_deltas, send_deltas, arrival_times)
+            for trend, send_delta_ms, num, arrival_ms in zip(trends.tolist(), send_deltas,
+                                                            num_of_deltas.tolist(), arrival_times):
+                group_states.append(self.detector.detect(trend, send_delta_ms, num, arrival_ms))
+
+        # AimdRateControl的码率是浮点数，和incoming_feedback的返回值保持一致
+        targets = np.empty(len(feedback_time_ms), dtype=np.float64)
+        states = np.empty(len(feedback_time_ms), dtype=np.int8)
+        for i, (now_ms, num, acked_bitrate) in enumerate(zip(feedback_time_ms, groups_per_report, acked_per_report)):
+            state = group_states[num - 1] if num > 0 else initial_state
+            targets[i] = self.update_estimate(now_ms, state, acked_bitrate)
+            states[i] = state
+        return targets, states
+
+    def maybe_update_estimate(self, now_ms) -> int:
+        return self.update_estimate(now_ms, self.detector.state(), self.acknowledged_bitrate.bitrate_bps())
+
+    def update_estimate(self, now_ms, state, acked_bitrate) -> int:
+        if state == AimdRateControl.BW_USAGE_OVERUSING:
+            # overuse时距离上次降低足够久才再次降低
+            if acked_bitrate and self.rate_control.time_to_reduce_further(now_ms, acked_bitrate):
+                self.rate_control.update(state, acked_bitrate, now_ms)
+            elif not acked_bitrate and self.rate_control.valid_estimate() and \
+                    self.rate_control.initial_time_to_reduce_further(now_ms):
+                # 还没有吞吐率时直接减半
+                self.rate_control.set_estimate(self.rate_control.latest_estimate() // 2, now_ms)
+        else:
+            self.rate_control.update(state, acked_bitrate or 0, now_ms)
+        return self.rate_control.latest_estimate()
+
+    def set_rtt(self, rtt_ms):
+        self.rate_control.set_rtt(rtt_ms)
+
+    def latest_estimate(self) -> int:
+        return self.rate_control.latest_estimate()
+
+
+def iter_feedback_batches(chunks, interval_ms: float = 50):
+    """
+    chunks按到达时间顺序输出(send_time_ms, arrival_time_ms, size)数组，按到达时间每interval_ms切成一个feedback。
+    每块输出其中完整的feedback：(feedback_time_ms, report_end, send_time_ms, arrival_time_ms, size)，
+    最后一个feedback可能还有包在下一块中，留到下一块一起输出。
+    丢失的包(到达时间为nan)没有位置信息，直接跳过。
+    """
+    first_arrival_ms = None
+    carry = None
+    for send_time_ms, arrival_time_ms, size in chunks:
+        received = ~np.isnan(arrival_time_ms)
+        columns = [np.asarray(send_time_ms)[received], np.asarray(arrival_time_ms)[received],
+                   np.asarray(size)[received]]
+        if carry is not None:
+            columns = [np.concatenate([c, n]) for c, n in zip(carry, columns)]
+        if len(columns[1]) == 0:
+            carry = columns
+            continue
+        if first_arrival_ms is None:
+            first_arrival_ms = columns[1][0]
+
+        report = ((columns[1] - first_arrival_ms) // interval_ms).astype(np.int64)
+        complete = int(np.searchsorted(report, report[-1], side='left'))
+        if complete > 0:
+            report_end = np.r_[np.flatnonzero(np.diff(report[:complete])) + 1, complete]
+            feedback_time_ms = first_arrival_ms + (report[report_end - 1] + 1) * interval_ms
+            yield feedback_time_ms, report_end, columns[0][:complete], columns[1][:complete], columns[2][:complete]
+        carry = [c[complete:] for c in columns]
+
+    if carry is not None and len(carry[1]) > 0:
+        report = int((carry[1][0] - first_arrival_ms) // interval_ms)
+        yield np.array([first_arrival_ms + (report + 1) * interval_ms]), np.array([len(carry[1])]), \
+            carry[0], carry[1], carry[2]
+
+
+def iter_feedback_reports(chunks, interval_ms: float = 50):
+    """
+    逐个输出feedback：(feedback_time_ms, send_time_ms, arrival_time_ms, size)
+    """
+    for feedback_time_ms, report_end, send_time_ms, arrival_time_ms, size in iter_feedback_batches(chunks, interval_ms):
+        begin = 0
+        for now_ms, end in zip(feedback_time_ms.tolist(), report_end.tolist()):
+            yield now_ms, send_time_ms[begin:end], arrival_time_ms[begin:end], size[begin:end]
+            begin = end
+
+
+def replay_feedback(bwe: DelayBasedBwe, chunks, interval_ms: float = 50):
+    """
+    回放feedback日志，返回每个feedback的(feedback_time_ms, target_bitrate_bps, bw_usage_state)数组
+    """
+    times = []
+    targets = []
+    states = []
+    for batch in iter_feedback_batches(chunks, interval_ms):
+        batch_targets, batch_states = bwe.incoming_feedback_batch(*batch)
+        times.append(np.asarray(batch[0], dtype=np.float64))
+        targets.append(batch_targets)
+        states.append(batch_states)
+    if not times:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int8)
+    return np.concatenate(times), np.concatenate(targets), np.concatenate(states)
+
+
+def replay_packet_trace(bwe: DelayBasedBwe, reader, interval_ms: float = 50, chunk_size: int = 65536):
+    """
+    用packet trace(需要有send_time_ms列)回放，trace需要按到达时间排序
+    """
+    chunks = ((chunk.send_time_ms, chunk.arrival_time_ms, chunk.size) for chunk in reader.iter_chunks(chunk_size))
+    return replay_feedback(bwe, chunks, interval_ms)
@@ -0,0 +1,99 @@
+from dataclasses import dataclass
+
+# 发送时间在5ms以内的包算作一组
+SEND_TIME_GROUP_LENGTH_MS = 5
+# 突发：到达间隔小于5ms并且到达比发送更密集的包，归到同一组，突发最长100ms
+BURST_DELTA_THRESHOLD_MS = 5
+MAX_BURST_DURATION_MS = 100
+# 到达时间和本地时间的差值跳变超过3s，认为对端时钟发生了跳变
+ARRIVAL_TIME_OFFSET_THRESHOLD_MS = 3000
+# 连续乱序这么多组之后重置
+REORDERED_RESET_THRESHOLD = 3
+
+
+@dataclass
+class PacketGroup:
+    size: int = 0
+    first_send_time_ms: float = None
+    send_time_ms: float = None
+    first_arrival_ms: float = None
+    complete_time_ms: float = None
+    last_system_time_ms: float = None
+
+    def is_first_packet(self):
+        return self.complete_time_ms is None
+
+
+class InterArrival:
+    """
+    把包按发送时间分组，计算相邻两组的发送间隔和到达间隔。
+    组的到达时间是组内最后一个包的到达时间，发送时间是组内最后一个包的发送时间。
+    """
+    def __init__(self):
+        self.current_group = PacketGroup()
+        self.prev_group = PacketGroup()
+        self.num_consecutive_reordered_packets = 0
+
+    def reset(self):
+        self.current_group = PacketGroup()
+        self.prev_group = PacketGroup()
+        self.num_consecutive_reordered_packets = 0
+
+    def compute_deltas(self, send_time_ms, arrival_time_ms, system_time_ms, packet_size):
+        """
+        返回(send_delta_ms, arrival_delta_ms, size_delta)，一组结束时才有结果，否则返回None
+        """
+        deltas = None
+        if self.current_group.is_first_packet():
+            self.current_group.first_send_time_ms = send_time_ms
+            self.current_group.send_time_ms = send_time_ms
+            self.current_group.first_arrival_ms = arrival_time_ms
+        elif self.current_group.first_send_time_ms > send_time_ms:
+            # 比当前组更早发送的乱序包，丢弃
+            return None
+        elif self.new_timestamp_group(arrival_time_ms, send_time_ms):
+            # 新的一组开始，上一组已经完整
+            if not self.prev_group.is_first_packet():
+                send_delta_ms = self.current_group.send_time_ms - self.prev_group.send_time_ms
+                arrival_delta_ms = self.current_group.complete_time_ms - self.prev_group.complete_time_ms
+                system_time_delta_ms = self.current_group.last_system_time_ms - self.prev_group.last_system_time_ms
+                if arrival_delta_ms - system_time_delta_ms >= ARRIVAL_TIME_OFFSET_THRESHOLD_MS:
+                    self.reset()
+                    return None
+                if arrival_delta_ms < 0:
+                    # 到达时间回退，可能是接收端时钟有问题
+                    self.num_consecutive_reordered_packets += 1
+                    if self.num_consecutive_reordered_packets >= REORDERED_RESET_THRESHOLD:
+                        self.reset()
+                    return None
+                self.num_consecutive_reordered_packets = 0
+                deltas = (send_delta_ms, arrival_delta_ms, self.current_group.size - self.prev_group.size)
+
+            self.prev_group = self.current_group
+            self.current_group = PacketGroup(first_send_time_ms=send_time_ms,
+                                             send_time_ms=send_time_ms,
+                                             first_arrival_ms=arrival_time_ms)
+        else:
+            self.current_group.send_time_ms = max(self.current_group.send_time_ms, send_time_ms)
+
+        self.current_group.size += packet_size
+        self.current_group.complete_time_ms = arrival_time_ms
+        self.current_group.last_system_time_ms = system_time_ms
+        return deltas
+
+    def new_timestamp_group(self, arrival_time_ms, send_time_ms):
+        if self.current_group.is_first_packet():
+            return False
+        if self.belongs_to_burst(arrival_time_ms, send_time_ms):
+            return False
+        return send_time_ms - self.current_group.first_send_time_ms > SEND_TIME_GROUP_LENGTH_MS
+
+    def belongs_to_burst(self, arrival_time_ms, send_time_ms):
+        send_delta_ms = send_time_ms - self.current_group.send_time_ms
+        if send_delta_ms == 0:
+            return True
+        arrival_delta_ms = arrival_time_ms - self.current_group.complete_time_ms
+        propagation_delta_ms = arrival_delta_ms - send_delta_ms
+        return propagation_delta_ms < 0 and \
+            arrival_delta_ms <= BURST_DELTA_THRESHOLD_MS and \
+            arrival_time_ms - self.current_group.first_arrival_ms < MAX_BURST_DURATION_MS
@@ -0,0 +1,81 @@
+from .aimd_control import AimdRateControl
+
+# 斜率乘上delta个数(最多60)和增益之后再和阈值比较
+MIN_NUM_DELTAS = 60
+THRESHOLD_GAIN = 4.0
+# 持续overuse超过10ms才认为是overuse
+OVERUSING_TIME_THRESHOLD_MS = 10
+# 阈值的自适应参数：梯度超过阈值时慢慢增大，低于阈值时较快减小
+K_UP = 0.0087
+K_DOWN = 0.039
+# 梯度超过阈值太多时不更新阈值，避免被突发的延迟拉高
+MAX_ADAPT_OFFSET_MS = 15
+MAX_TIME_DELTA_MS = 100
+INITIAL_THRESHOLD = 12.5
+MIN_THRESHOLD = 6
+MAX_THRESHOLD = 600
+
+
+class OveruseDetector:
+    """
+    自适应阈值的过载检测，输入trendline的斜率，输出BW_USAGE_*状态
+    """
+    def __init__(self, threshold_gain: float = THRESHOLD_GAIN):
+        self.threshold_gain = threshold_gain
+        self.threshold = INITIAL_THRESHOLD
+        self.last_update_ms = None
+        self.prev_trend = 0
+        self.prev_modified_trend = 0
+        self.time_over_using = -1
+        self.overuse_counter = 0
+        self.hypothesis = AimdRateControl.BW_USAGE_NORMAL
+
+    def state(self):
+        return self.hypothesis
+
+    def detect(self, trend, send_delta_ms, num_of_deltas, now_ms):
+        if num_of_deltas < 2:
+            self.hypothesis = AimdRateControl.BW_USAGE_NORMAL
+            return self.hypothesis
+
+        modified_trend = min(num_of_deltas, MIN_NUM_DELTAS) * trend * self.threshold_gain
+        self.prev_modified_trend = modified_trend
+        if modified_trend > self.threshold:
+            if self.time_over_using == -1:
+                # 只有一个点时，认为已经overuse了一半的间隔
+                self.time_over_using = send_delta_ms / 2
+            else:
+                self.time_over_using += send_delta_ms
+            self.overuse_counter += 1
+            if self.time_over_using > OVERUSING_TIME_THRESHOLD_MS and self.overuse_counter > 1:
+                # 梯度还在增大才认为是overuse
+                if trend >= self.prev_trend:
+                    self.time_over_using = 0
+                    self.overuse_counter = 0
+                    self.hypothesis = AimdRateControl.BW_USAGE_OVERUSING
+        elif modified_trend < -self.threshold:
+            self.time_over_using = -1
+            self.overuse_counter = 0
+            self.hypothesis = AimdRateControl.BW_USAGE_UNDERUSING
+        else:
+            self.time_over_using = -1
+            self.overuse_counter = 0
+            self.hypothesis = AimdRateControl.BW_USAGE_NORMAL
+
+        self.prev_trend = trend
+        self.update_threshold(modified_trend, now_ms)
+        return self.hypothesis
+
+    def update_threshold(self, modified_trend, now_ms):
+        if self.last_update_ms is None:
+            self.last_update_ms = now_ms
+
+        if abs(modified_trend) > self.threshold + MAX_ADAPT_OFFSET_MS:
+            self.last_update_ms = now_ms
+            return
+
+        k = K_DOWN if abs(modified_trend) < self.threshold else K_UP
+        time_delta_ms = min(now_ms - self.last_update_ms, MAX_TIME_DELTA_MS)
+        self.threshold += k * (abs(modified_trend) - self.threshold) * time_delta_ms
+        self.threshold = min(max(self.threshold, MIN_THRESHOLD), MAX_THRESHOLD)
+        self.last_update_ms = now_ms
@@ -0,0 +1,178 @@
+import math
+from collections import deque
+
+import numpy as np
+
+# 线性回归窗口内的组数
+TRENDLINE_WINDOW_SIZE = 20
+# 累积延迟的平滑系数
+TRENDLINE_SMOOTHING_COEFF = 0.9
+# 最多统计的delta个数
+DELTA_COUNTER_MAX = 1000
+# 批量平滑时每块的最大放大倍数(1/coef^block)，限制展开后的精度损失
+SMOOTHING_MAX_GAIN = 1e6
+# 滚动求和时每块的窗口数，每块重新选取原点，避免前缀和过大
+ROLLING_BLOCK_SIZE = 1024
+
+
+class TrendlineEstimator:
+    """
+    延迟梯度估计：累积每组的(到达间隔 - 发送间隔)得到排队延迟的变化，平滑之后，
+    对最近window_size组的(到达时间, 平滑延迟)做最小二乘直线拟合，斜率>0说明排队在增长。
+
+    update逐组处理，用于实时场景；update_batch一次处理整个数组，用于回放，两者输出一致并且可以混用。
+    """
+    def __init__(self,
+                 window_size: int = TRENDLINE_WINDOW_SIZE,
+                 smoothing_coef: float = TRENDLINE_SMOOTHING_COEFF):
+        self.window_size = window_size
+        self.smoothing_coef = smoothing_coef
+        self.reset()
+
+    def reset(self):
+        self.num_of_deltas = 0
+        self.first_arrival_time_ms = None
+        self.accumulated_delay = 0
+        self.smoothed_delay = 0
+        # (相对到达时间, 平滑延迟)
+        self.delay_hist = deque()
+        self.trend = 0
+
+    def update(self, recv_delta_ms, send_delta_ms, arrival_time_ms):
+        """
+        输入一组的到达间隔、发送间隔和到达时间，返回当前的斜率
+        """
+        delta_ms = recv_delta_ms - send_delta_ms
+        self.num_of_deltas = min(self.num_of_deltas + 1, DELTA_COUNTER_MAX)
+        if self.first_arrival_time_ms is None:
+            self.first_arrival_time_ms = arrival_time_ms
+
+        self.accumulated_delay += delta_ms
+        self.smoothed_delay = self.smoothing_coef * self.smoothed_delay + \
+            (1 - self.smoothing_coef) * self.accumulated_delay
+
+        self.delay_hist.append((arrival_time_ms - self.first_arrival_time_ms, self.smoothed_delay))
+        if len(self.delay_hist) > self.window_size:
+            self.delay_hist.popleft()
+
+        # 窗口没满之前沿用上一次的斜率
+        if len(self.delay_hist) == self.window_size:
+            slope = linear_fit_slope(self.delay_hist)
+            if slope is not None:
+                self.trend = slope
+        return self.trend
+
+    def update_batch(self, recv_delta_ms, send_delta_ms, arrival_time_ms):
+        """
+        update的批量版本，输入每组的数组，返回(每组之后的斜率, 每组之后的num_of_deltas)两个数组。
+        平滑按块展开成前缀和，滑动窗口的最小二乘用滚动和计算，整体O(n)。
+        """
+        recv_delta_ms = np.asarray(recv_delta_ms, dtype=np.float64)
+        send_delta_ms = np.asarray(send_delta_ms, dtype=np.float64)
+        arrival_time_ms = np.asarray(arrival_time_ms, dtype=np.float64)
+        n = len(arrival_time_ms)
+        num_of_deltas = np.minimum(self.num_of_deltas + np.arange(1, n + 1), DELTA_COUNTER_MAX)
+        if n == 0:
+            return np.empty(0, dtype=np.float64), num_of_deltas
+        if self.first_arrival_time_ms is None:
+            self.first_arrival_time_ms = float(arrival_time_ms[0])
+
+        # 和逐个累加的顺序一致
+        accumulated = np.cumsum(np.concatenate(([self.accumulated_delay], recv_delta_ms - send_delta_ms)))[1:]
+        smoothed = exponential_smoothing(accumulated, self.smoothing_coef, self.smoothed_delay)
+
+        # 带上上一批留在窗口中的点
+        num_hist = len(self.delay_hist)
+        x = np.concatenate(([p[0] for p in self.delay_hist], arrival_time_ms - self.first_arrival_time_ms))
+        y = np.concatenate(([p[1] for p in self.delay_hist], smoothed))
+        slopes = rolling_linear_fit_slope(x, y, self.window_size)
+
+        # 第i组对应以x[num_hist + i]结尾的窗口，窗口没满或者无法拟合时为nan
+        trend = np.full(n, np.nan)
+        first_full = max(0, self.window_size - 1 - num_hist)
+        if first_full < n:
+            trend[first_full:] = slopes[num_hist + first_full - self.window_size + 1:]
+        # nan沿用前一个斜率
+        last_valid = np.where(np.isnan(trend), -1, np.arange(n))
+        np.maximum.accumulate(last_valid, out=last_valid)
+        trend = np.where(last_valid >= 0, trend[last_valid], self.trend)
+
+        self.num_of_deltas = int(num_of_deltas[-1])
+        self.accumulated_delay = float(accumulated[-1])
+        self.smoothed_delay = float(smoothed[-1])
+        self.delay_hist = deque(zip(x[-self.window_size:].tolist(), y[-self.window_size:].tolist()))
+        self.trend = float(trend[-1])
+        return trend, num_of_deltas
+
+
+def linear_fit_slope(points):
+    n = len(points)
+    xs, ys = zip(*points)
+    x_avg = sum(xs) / n
+    y_avg = sum(ys) / n
+    numerator = 0
+    denominator = 0
+    for x, y in points:
+        dx = x - x_avg
+        numerator += dx * (y - y_avg)
+        denominator += dx * dx
+    if denominator == 0:
+        return None
+    return numerator / denominator
+
+
+def exponential_smoothing(values, coef, initial):
+    """
+    y[i] = coef * y[i-1] + (1 - coef) * values[i]，y[-1] = initial。
+    一个块内 y[k] = coef^(k+1) * (y[-1] + (1 - coef) * sum(values[j] / coef^(j+1)))，可以用cumsum计算。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if coef == 0:
+        return values.copy()
+    if coef >= 1:
+        return np.full(n, float(initial))
+
+    block_size = int(min(max(1, math.log(SMOOTHING_MAX_GAIN) / -math.log(coef)), 1024))
+    powers = coef ** np.arange(1, block_size + 1)
+    out = np.empty(n, dtype=np.float64)
+    prev = initial
+    for begin in range(0, n, block_size):
+        block = values[begin:begin + block_size]
+        p = powers[:len(block)]
+        out[begin:begin + len(block)] = p * (prev + (1 - coef) * np.cumsum(block / p))
+        prev = out[begin + len(block) - 1]
+    return out
+
+
+def rolling_linear_fit_slope(x, y, window):
+    """
+    每个长度为window的滑动窗口的最小二乘斜率，共len(x) - window + 1个，无法拟合(x都相同)时为nan。
+    窗口内的和用前缀和相减得到，斜率 = (n*Sxy - Sx*Sy) / (n*Sxx - Sx*Sx)。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    num_windows = len(x) - window + 1
+    if num_windows <= 0:
+        return np.empty(0, dtype=np.float64)
+
+    out = np.empty(num_windows, dtype=np.float64)
+    for begin in range(0, num_windows, ROLLING_BLOCK_SIZE):
+        end = min(num_windows, begin + ROLLING_BLOCK_SIZE)
+        # 斜率和原点无关，每块以第一个点为原点
+        bx = x[begin:end + window - 1] - x[begin]
+        by = y[begin:end + window - 1] - y[begin]
+        sx = _window_sums(bx, window)
+        sy = _window_sums(by, window)
+        sxx = _window_sums(bx * bx, window)
+        sxy = _window_sums(bx * by, window)
+        numerator = window * sxy - sx * sy
+        denominator = window * sxx - sx * sx
+        valid = denominator > 1e-9 * window * sxx
+        out[begin:end] = np.where(valid, numerator / np.where(valid, denominator, 1), np.nan)
+    return out
+
+
+def _window_sums(values, window):
+    prefix = np.concatenate(([0.0], np.cumsum(values)))
+    return prefix[window:] - prefix[:-window]
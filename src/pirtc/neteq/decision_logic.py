@@ -1,13 +1,228 @@
+from dataclasses import dataclass
 
-class DecisionLogic:
+from pirtc.base.instrumentation import Instrumentation
+from pirtc.base.tick_timer import TickTimer, CountDown
+from pirtc.neteq.delay_manager import DelayManager, DelayManagerConfig
+from pirtc.neteq.packet_arrival_history import PacketArrivalHistory
+
+# 两次加速/减速之间至少间隔的tick数
+MIN_TIMESCALE_INTERVAL = 5
+# 低于target level多少之后开始减速
+DECELERATION_TARGET_LEVEL_OFFSET_MS = 85
+# 连续expand这么多次之后，不再等待丢失的包
+MAX_WAIT_FOR_PACKET = 10
+# 时间戳跳变超过这么多个输出帧，直接merge到新的包
+REINIT_AFTER_EXPANDS = 100
+PACKET_ARRIVAL_HISTORY_WINDOW_MS = 2000
+
+
+@dataclass
+class NetEqStatus:
+    # 下一个要解码的时间戳，即sync buffer的末尾
+    target_timestamp: int = 0
+    # packet buffer中最早的时间戳，None表示没有包
+    next_packet_timestamp: int = None
+    # 上一次的操作
+    last_mode: str = 'NORMAL'
+    # packet buffer和sync buffer中的数据量
+    packet_buffer_samples: int = 0
+    sync_buffer_samples: int = 0
+    # 上次解码之后expand生成的数据量
+    generated_noise_samples: int = 0
+
+
+class BufferLevelFilter:
+    """
+    buffer level的指数平滑，target level越高平滑越强。
+    加速/减速改变的数据量直接从平滑后的值中扣除，不需要等平滑收敛。
+    """
     def __init__(self):
-        pass
+        self.level_factor = 253
+        self.filtered_current_level = 0
 
     def reset(self):
-        pass
+        self.level_factor = 253
+        self.filtered_current_level = 0
+
+    def update(self, buffer_size_samples, time_stretched_samples):
+        # level_factor为Q8
+        filtered = (self.level_factor * self.filtered_current_level +
+                    (256 - self.level_factor) * buffer_size_samples) / 256
+        self.filtered_current_level = max(0, filtered - time_stretched_samples)
+
+    def decay(self, num_updates):
+        # 相当于调用num_updates次update(0, 0)
+        for _ in range(num_updates):
+            if not self.filtered_current_level:
+                break
+            self.filtered_current_level = self.level_factor * self.filtered_current_level / 256
+
+    def set_target_buffer_level(self, target_buffer_level_packets):
+        if target_buffer_level_packets <= 1:
+            self.level_factor = 251
+        elif target_buffer_level_packets <= 3:
+            self.level_factor = 252
+        elif target_buffer_level_packets <= 7:
+            self.level_factor = 253
+        else:
+            self.level_factor = 254
+
+
+class DecisionLogic:
+    """
+    根据packet buffer和sync buffer的状态，决定每个输出帧做什么操作：
+
+    - NORMAL: 正常解码播放
+    - EXPAND: 没有可以解码的包，生成补偿数据
+    - MERGE: expand之后拿到了后续的包，和expand的数据拼接
+    - ACCELERATE: 缓存高于target level，加速播放
+    - PREEMPTIVE_EXPAND: 缓存低于target level，减速播放
+    """
+    def __init__(self,
+                 config: DelayManagerConfig,
+                 tick_timer: TickTimer,
+                 instrumentation: Instrumentation = None):
+        self.tick_timer = tick_timer
+        self.delay_manager = DelayManager(config, tick_timer, instrumentation)
+        self.packet_arrival_history = PacketArrivalHistory(PACKET_ARRIVAL_HISTORY_WINDOW_MS)
+        self.buffer_level_filter = BufferLevelFilter()
+        self.sample_rate_hz = 8000
+        self.output_size_samples = 80
+        self.packet_length_samples = 0
+        self.timescale_countdown = None
+        self.num_consecutive_expands = 0
+        # 上一次加速(>0)/减速(<0)改变的数据量，还没有计入buffer level filter
+        self.time_stretched_samples = 0
+
+    def reset(self):
+        self.delay_manager.reset()
+        self.packet_arrival_history.reset()
+        self.buffer_level_filter.reset()
+        self.packet_length_samples = 0
+        self.timescale_countdown = None
+        self.num_consecutive_expands = 0
+        self.time_stretched_samples = 0
 
     def soft_reset(self):
-        pass
+        self.packet_length_samples = 0
+        self.timescale_countdown = CountDown(self.tick_timer, MIN_TIMESCALE_INTERVAL)
+        self.num_consecutive_expands = 0
+        self.time_stretched_samples = 0
 
     def set_sample_rate(self, fs_hz, output_size_sample):
-        pass
+        self.sample_rate_hz = fs_hz
+        self.output_size_samples = output_size_sample
+        self.packet_arrival_history.set_sample_rate(fs_hz // 1000)
+
+    def packet_arrived(self, rtp_timestamp, arrival_time_ms, packet_length_samples, update_delay=True):
+        """
+        收到一个包，更新延迟估计，返回新的target delay
+        """
+        if packet_length_samples > 0 and packet_length_samples != self.packet_length_samples:
+            self.packet_length_samples = packet_length_samples
+            self.delay_manager.set_packet_audio_length(packet_length_samples * 1000 // self.sample_rate_hz)
+
+        if not update_delay:
+            return self.delay_manager.get_target_delay_ms()
+
+        self.packet_arrival_history.insert(rtp_timestamp, arrival_time_ms)
+        # 至少两个包才有相对延迟
+        if self.packet_arrival_history.size() >= 2:
+            arrival_delay_ms = self.packet_arrival_history.get_delay_ms(rtp_timestamp, arrival_time_ms)
+            reordered = not self.packet_arrival_history.is_newest_rtp_timestamp(rtp_timestamp)
+            self.delay_manager.update(arrival_delay_ms, reordered)
+        return self.delay_manager.get_target_delay_ms()
+
+    def target_level_samples(self):
+        return int(self.delay_manager.get_target_delay_ms() * self.sample_rate_hz / 1000)
+
+    def expand_decision(self, operation):
+        if operation == 'EXPAND':
+            self.num_consecutive_expands += 1
+        else:
+            self.num_consecutive_expands = 0
+
+    def get_decision(self, status: NetEqStatus):
+        # target level按包数计算，同时把上一次加速/减速的数据量计入buffer level
+        self.buffer_level_filter.set_target_buffer_level(
+            self.target_level_samples() / (self.packet_length_samples or self.output_size_samples))
+        self.buffer_level_filter.update(status.packet_buffer_samples + status.sync_buffer_samples,
+                                        self.time_stretched_samples)
+        self.time_stretched_samples = 0
+
+        if status.next_packet_timestamp is None:
+            return self.no_packet(status)
+
+        if status.next_packet_timestamp == status.target_timestamp:
+            return self.expected_packet_available(status)
+        return self.future_packet_available(status)
+
+    def skip_no_packet(self, num_decisions):
+        """
+        packet buffer和sync buffer都为空时，连续num_decisions次决策的结果都是EXPAND，
+        直接批量更新状态，结果与逐次调用get_decision/expand_decision相同。
+        """
+        if num_decisions <= 0:
+            return
+        self.buffer_level_filter.set_target_buffer_level(
+            self.target_level_samples() / (self.packet_length_samples or self.output_size_samples))
+        self.buffer_level_filter.update(0, self.time_stretched_samples)
+        self.buffer_level_filter.decay(num_decisions - 1)
+        self.time_stretched_samples = 0
+        self.num_consecutive_expands += num_decisions
+
+    def no_packet(self, status: NetEqStatus):
+        return 'EXPAND'
+
+    def expected_packet_available(self, status: NetEqStatus):
+        # expand之后先正常播放，不做时间拉伸
+        if status.last_mode != 'EXPAND':
+            target_level_samples = self.target_level_samples()
+            samples_per_ms = self.sample_rate_hz // 1000
+            low_limit = max(target_level_samples * 3 // 4,
+                            target_level_samples - DECELERATION_TARGET_LEVEL_OFFSET_MS * samples_per_ms)
+            high_limit = max(target_level_samples, low_limit + 20 * samples_per_ms)
+            buffer_level_samples = self.buffer_level_filter.filtered_current_level
+            if self.timescale_allowed():
+                if buffer_level_samples >= high_limit:
+                    return 'ACCELERATE'
+                if buffer_level_samples < low_limit:
+                    return 'PREEMPTIVE_EXPAND'
+        return 'NORMAL'
+
+    def future_packet_available(self, status: NetEqStatus):
+        # 中间有包还没到，继续expand等待，除非已经等了足够久或者缓存已经够了
+        timestamp_leap = status.next_packet_timestamp - status.target_timestamp
+        if status.last_mode == 'EXPAND' and \
+                not self.reinit_after_expands(timestamp_leap) and \
+                not self.max_wait_for_packet() and \
+                self.packet_too_early(status, timestamp_leap) and \
+                self.under_target_level():
+            return 'EXPAND'
+
+        # 只有expand之后才merge
+        if status.last_mode == 'EXPAND':
+            return 'MERGE'
+        return 'EXPAND'
+
+    def time_stretched(self, samples):
+        """
+        加速删除samples(>0)或者减速插入-samples的数据之后调用
+        """
+        self.time_stretched_samples = samples
+        self.timescale_countdown = CountDown(self.tick_timer, MIN_TIMESCALE_INTERVAL)
+
+    def timescale_allowed(self):
+        return self.timescale_countdown is None or self.timescale_countdown.finished()
+
+    def under_target_level(self):
+        return self.buffer_level_filter.filtered_current_level < self.target_level_samples()
+
+    def reinit_after_expands(self, timestamp_leap):
+        return timestamp_leap >= self.output_size_samples * REINIT_AFTER_EXPANDS
+
+    def packet_too_early(self, status: NetEqStatus, timestamp_leap):
+        return timestamp_leap > status.generated_noise_samples
+
+    def max_wait_for_packet(self):
+        return self.num_consecutive_expands >= MAX_WAIT_FOR_PACKET
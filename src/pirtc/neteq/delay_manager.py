@@ -1,6 +1,7 @@
 from dataclasses import dataclass
 from copy import deepcopy
 
+from pirtc.base.instrumentation import Instrumentation
 from pirtc.base.tick_timer import TickTimer
 from pirtc.neteq.underrun_optimizer import UnderRunOptimizer
 from pirtc.neteq.reorder_optimizer import ReorderOptimizer
@@ -9,6 +10,12 @@ from pirtc.neteq.reorder_optimizer import ReorderOptimizer
 START_DELAY_MS = 80
 MAX_BASE_MINIMUM_DELAY_MS = 10000
 
+# 决定target_level_ms的因素，按update中的计算顺序
+TARGET_LEVEL_REASONS = ('start_delay', 'underrun', 'reorder', 'minimum_delay', 'maximum_delay', 'buffer_limit')
+# 批量回放(delay_manager_replay、MultiDelayManager)中用TARGET_LEVEL_REASONS的下标表示因素
+(REASON_START_DELAY, REASON_UNDERRUN, REASON_REORDER,
+ REASON_MINIMUM_DELAY, REASON_MAXIMUM_DELAY, REASON_BUFFER_LIMIT) = range(len(TARGET_LEVEL_REASONS))
+
 
 @dataclass
 class DelayManagerConfig:
@@ -24,11 +31,21 @@ class DelayManagerConfig:
     max_packets_in_buffer: int = 20
     base_minimum_delay_ms: int = 0
 
+    # 直方图实现：python/numpy/fenwick，bucket很多时使用fenwick
+    histogram_type: str = 'python'
+    # 延迟直方图的bucket数和每个bucket的时长，决定target delay的精度和上限
+    delay_buckets: int = 100
+    bucket_size_ms: int = 20
+
 
 class DelayManager:
     def __init__(self,
                  config: DelayManagerConfig,
-                 tick_timer: TickTimer):
+                 tick_timer: TickTimer,
+                 instrumentation: Instrumentation = None):
+        """
+        instrumentation不为None时，统计每个因素决定target的次数，因素变化时产生事件，并对update计时
+        """
         self.config = deepcopy(config)
         # 外部可以动态调整的最小延迟
         self.base_minimum_delay_ms = config.base_minimum_delay_ms
@@ -39,6 +56,8 @@ class DelayManager:
         self.maximum_delay_ms = 0
         self.packet_len_ms = 0
         self.target_level_ms = START_DELAY_MS
+        # 最后一次update中决定target_level_ms的因素
+        self.target_level_reason = 'start_delay'
         self.unlimited_target_delay_ms = 0
 
         self.max_packets_in_buffer = config.max_packets_in_buffer
@@ -46,10 +65,21 @@ class DelayManager:
                                                     int((1 << 30) * config.quantile),
                                                     int((1 << 15) * config.forget_factor),
                                                     config.start_forget_weight,
-                                                    config.resample_interval_ms)
+                                                    config.resample_interval_ms,
+                                                    config.histogram_type,
+                                                    config.delay_buckets,
+                                                    config.bucket_size_ms)
         self.reorder_optimizer = ReorderOptimizer(int((1 << 15) * config.reorder_forget_factor),
                                                   config.ms_per_loss_percent,
-                                                  config.start_forget_weight) if config.use_reorder_optimizer else None
+                                                  config.start_forget_weight,
+                                                  config.histogram_type,
+                                                  config.delay_buckets,
+                                                  config.bucket_size_ms) if config.use_reorder_optimizer else None
+
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            self._reason_counters = {r: f'delay_manager.target.{r}' for r in TARGET_LEVEL_REASONS}
+            instrumentation.wrap_methods(self, 'delay_manager', ['update'])
 
     def update(self,
                arrival_delay_ms: int,
@@ -57,31 +87,58 @@ class DelayManager:
         # 没有开启乱序或者非乱序，就走underrun，underrun不使用乱序包估计
         if not self.reorder_optimizer or not reordered:
             self.underrun_optimizer.update(arrival_delay_ms)
-        self.target_level_ms = self.underrun_optimizer.get_optimal_delay_ms() or START_DELAY_MS
+        self.target_level_ms = self.underrun_optimizer.get_optimal_delay_ms()
+        reason = 'underrun'
+        if not self.target_level_ms:
+            self.target_level_ms = START_DELAY_MS
+            reason = 'start_delay'
 
         if self.reorder_optimizer:
             self.reorder_optimizer.update(arrival_delay_ms, reordered, self.target_level_ms)
-            self.target_level_ms = max(self.target_level_ms, self.reorder_optimizer.get_optimal_delay_ms())
+            reorder_delay_ms = self.reorder_optimizer.get_optimal_delay_ms()
+            if reorder_delay_ms > self.target_level_ms:
+                self.target_level_ms = reorder_delay_ms
+                reason = 'reorder'
 
         self.unlimited_target_delay_ms = self.target_level_ms
-        self.target_level_ms = max(self.target_level_ms, self.effective_minimum_delay_ms)
-        if self.maximum_delay_ms > 0:
-            self.target_level_ms = min(self.target_level_ms, self.maximum_delay_ms)
+        if self.effective_minimum_delay_ms > self.target_level_ms:
+            self.target_level_ms = self.effective_minimum_delay_ms
+            reason = 'minimum_delay'
+        if 0 < self.maximum_delay_ms < self.target_level_ms:
+            self.target_level_ms = self.maximum_delay_ms
+            reason = 'maximum_delay'
 
         if self.packet_len_ms > 0:
             # 延迟只能到最大缓存数据的75%，避免溢出
-            self.target_level_ms = min(self.target_level_ms, 3 * self.max_packets_in_buffer * self.packet_len_ms / 4)
+            buffer_limit_ms = 3 * self.max_packets_in_buffer * self.packet_len_ms / 4
+            if buffer_limit_ms < self.target_level_ms:
+                self.target_level_ms = buffer_limit_ms
+                reason = 'buffer_limit'
+
+        if self.instrumentation is not None:
+            self.instrumentation.count(self._reason_counters[reason])
+            if reason != self.target_level_reason:
+                self.instrumentation.event('delay_manager.target_reason_changed',
+                                           reason=reason,
+                                           previous_reason=self.target_level_reason,
+                                           target_level_ms=self.target_level_ms,
+                                           unlimited_target_delay_ms=self.unlimited_target_delay_ms)
+        self.target_level_reason = reason
 
     def reset(self):
         self.packet_len_ms = 0
         self.underrun_optimizer.reset()
         self.target_level_ms = START_DELAY_MS
+        self.target_level_reason = 'start_delay'
         if self.reorder_optimizer:
             self.reorder_optimizer.reset()
 
     def get_target_delay_ms(self):
         return self.target_level_ms
 
+    def get_target_level_reason(self):
+        return self.target_level_reason
+
     def get_unlimited_target_delay_ms(self):
         return self.unlimited_target_delay_ms
 
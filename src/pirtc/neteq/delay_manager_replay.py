@@ -0,0 +1,255 @@
+"""
+DelayManager批量回放。
+
+逐包逻辑与DelayManager.update完全一致，但是状态都展开成标量和数组，
+由一个kernel函数循环处理整个trace。kernel以纯python运行，输入和状态都使用list，
+比逐个访问numpy标量更快。
+
+kernel不经过DelayManager.update，设置了instrumentation时，回放结束后按每个包的因素批量计数、
+产生因素变化的事件，整次回放计时一次(delay_manager.replay)，不记录逐包的update耗时。
+"""
+from time import perf_counter_ns
+
+import numpy as np
+
+from pirtc.base.tick_timer import StopWatch
+from pirtc.neteq.delay_manager import (DelayManager, START_DELAY_MS, TARGET_LEVEL_REASONS, REASON_START_DELAY,
+                                       REASON_UNDERRUN, REASON_REORDER, REASON_MINIMUM_DELAY, REASON_MAXIMUM_DELAY,
+                                       REASON_BUFFER_LIMIT)
+
+INT64_MAX = (1 << 63) - 1
+
+
+def _hist_add(buckets, forget_factor, index):
+    num_buckets = len(buckets)
+    vector_sum = 0
+    for i in range(num_buckets):
+        buckets[i] = (buckets[i] * forget_factor) >> 15
+        vector_sum += buckets[i]
+
+    buckets[index] += (32768 - forget_factor) << 15
+    vector_sum += (32768 - forget_factor) << 15
+
+    vector_sum -= 1 << 30
+    if vector_sum != 0:
+        flip_sign = -1 if vector_sum > 0 else 1
+        for i in range(num_buckets):
+            correction = flip_sign * min(abs(vector_sum), buckets[i])
+            buckets[i] += correction
+            vector_sum += correction
+            if vector_sum == 0:
+                break
+
+
+def _next_forget_factor(forget_factor, base_forget_factor, use_start_weight, start_forget_weight, add_cnt):
+    if use_start_weight:
+        if forget_factor != base_forget_factor:
+            new_forget_factor = int((1 << 15) * (1 - start_forget_weight / (add_cnt + 1)))
+            forget_factor = max(0, min(base_forget_factor, new_forget_factor))
+    else:
+        forget_factor += (base_forget_factor - forget_factor + 3) >> 2
+    return forget_factor
+
+
+def _hist_quantile(buckets, probability):
+    inverse_probability = (1 << 30) - probability
+    index = 0
+    bucket_sum = (1 << 30) - buckets[0]
+    while bucket_sum > inverse_probability and index < len(buckets) - 1:
+        index += 1
+        bucket_sum -= buckets[index]
+    return index
+
+
+def _minimize_cost(buckets, base_delay_ms, ms_per_loss_percent, bucket_size_ms):
+    loss_probability = 1 << 30
+    min_cost = INT64_MAX
+    min_buckets = 0
+    for i in range(len(buckets)):
+        loss_probability -= buckets[i]
+        delay_ms = max(0, i * bucket_size_ms - base_delay_ms) << 30
+        cost = delay_ms + 100 * ms_per_loss_percent * loss_probability
+        if cost < min_cost:
+            min_cost = cost
+            min_buckets = i
+        if loss_probability == 0:
+            break
+    return min_buckets
+
+
+def _replay_kernel(delays, reordered, ticks, out, out_unlimited, out_reason, ms_per_tick, start_delay_ms,
+                   u_buckets, u_bucket_size_ms, u_forget_factor, u_base_forget_factor,
+                   u_use_start_weight, u_start_weight, u_add_cnt, u_quantile,
+                   u_resample_interval_ms, u_has_stopwatch, u_stopwatch_start,
+                   u_max_delay_in_interval, u_optimal_delay_ms,
+                   r_enabled, r_buckets, r_bucket_size_ms, r_forget_factor, r_base_forget_factor,
+                   r_use_start_weight, r_start_weight, r_add_cnt, r_ms_per_loss_percent,
+                   r_optimal_delay_ms,
+                   effective_minimum_delay_ms, maximum_delay_ms, packet_len_ms, max_packets_in_buffer):
+    unlimited_target_delay_ms = 0
+    for n in range(len(delays)):
+        delay = delays[n]
+        tick = ticks[n]
+
+        # UnderRunOptimizer.update
+        if not r_enabled or not reordered[n]:
+            hist_update = delay
+            if u_resample_interval_ms > 0:
+                if not u_has_stopwatch:
+                    u_has_stopwatch = True
+                    u_stopwatch_start = tick
+                if (tick - u_stopwatch_start) * ms_per_tick > u_resample_interval_ms:
+                    hist_update = u_max_delay_in_interval
+                    u_stopwatch_start = tick
+                    u_max_delay_in_interval = 0
+                u_max_delay_in_interval = max(u_max_delay_in_interval, delay)
+
+            if hist_update != 0:
+                index = int(hist_update // u_bucket_size_ms)
+                if index < len(u_buckets):
+                    _hist_add(u_buckets, u_forget_factor, index)
+                    u_add_cnt += 1
+                    u_forget_factor = _next_forget_factor(u_forget_factor, u_base_forget_factor,
+                                                          u_use_start_weight, u_start_weight, u_add_cnt)
+                u_optimal_delay_ms = (1 + _hist_quantile(u_buckets, u_quantile)) * u_bucket_size_ms
+
+        if u_optimal_delay_ms != 0:
+            target_level_ms = u_optimal_delay_ms
+            reason = REASON_UNDERRUN
+        else:
+            target_level_ms = start_delay_ms
+            reason = REASON_START_DELAY
+
+        # ReorderOptimizer.update
+        if r_enabled:
+            index = int(delay // r_bucket_size_ms) if reordered[n] else 0
+            if index < len(r_buckets):
+                _hist_add(r_buckets, r_forget_factor, index)
+                r_add_cnt += 1
+                r_forget_factor = _next_forget_factor(r_forget_factor, r_base_forget_factor,
+                                                      r_use_start_weight, r_start_weight, r_add_cnt)
+            bucket_index = _minimize_cost(r_buckets, target_level_ms, r_ms_per_loss_percent, r_bucket_size_ms)
+            r_optimal_delay_ms = (1 + bucket_index) * r_bucket_size_ms
+            if r_optimal_delay_ms > target_level_ms:
+                target_level_ms = r_optimal_delay_ms
+                reason = REASON_REORDER
+
+        # 与DelayManager.update相同的比较顺序，相等时不换因素
+        unlimited_target_delay_ms = target_level_ms
+        limited_target_ms = float(target_level_ms)
+        if effective_minimum_delay_ms > limited_target_ms:
+            limited_target_ms = effective_minimum_delay_ms
+            reason = REASON_MINIMUM_DELAY
+        if 0 < maximum_delay_ms < limited_target_ms:
+            limited_target_ms = maximum_delay_ms
+            reason = REASON_MAXIMUM_DELAY
+        if packet_len_ms > 0:
+            buffer_limit_ms = 3 * max_packets_in_buffer * packet_len_ms / 4
+            if buffer_limit_ms < limited_target_ms:
+                limited_target_ms = buffer_limit_ms
+                reason = REASON_BUFFER_LIMIT
+        out[n] = limited_target_ms
+        out_unlimited[n] = unlimited_target_delay_ms
+        out_reason[n] = reason
+
+    return (u_forget_factor, u_add_cnt, u_has_stopwatch, u_stopwatch_start,
+            u_max_delay_in_interval, u_optimal_delay_ms,
+            r_forget_factor, r_add_cnt, r_optimal_delay_ms, unlimited_target_delay_ms)
+
+
+def _as_number(v):
+    v = float(v)
+    return int(v) if v.is_integer() else v
+
+
+def replay_delay_manager(delay_manager: DelayManager,
+                         arrival_delays_ms,
+                         reordered,
+                         ticks) -> np.ndarray:
+    """
+    相当于对每个包先把tick timer设置到ticks[i]，再调用delay_manager.update(arrival_delays_ms[i], reordered[i])，
+    返回每个包之后的target_level_ms。回放从delay_manager当前状态开始，结束后状态(包括target_level_reason)
+    写回delay_manager，tick timer停在最后一个tick，可以与逐包调用交替使用。
+    """
+    start = perf_counter_ns()
+    delays = np.asarray(arrival_delays_ms, dtype=np.float64)
+    reordered = np.asarray(reordered, dtype=np.bool_)
+    ticks = np.asarray(ticks, dtype=np.int64)
+    if not (len(delays) == len(reordered) == len(ticks)):
+        raise Exception("arrival delays, reordered flags and ticks must have the same length")
+    if len(delays) == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    uo = delay_manager.underrun_optimizer
+    ro = delay_manager.reorder_optimizer
+    tick_timer = uo.tick_timer
+    r_hist = ro.hist if ro else None
+    u_use_start_weight = uo.hist.start_forget_weight is not None and uo.hist.start_forget_weight >= 0
+    r_use_start_weight = r_hist is not None and r_hist.start_forget_weight is not None and r_hist.start_forget_weight >= 0
+
+    out = [0.0] * len(delays)
+    out_unlimited = [0.0] * len(delays)
+    out_reason = [0] * len(delays)
+    u_buckets = [int(b) for b in uo.hist.buckets]
+    r_buckets = [int(b) for b in r_hist.buckets] if r_hist else [0]
+
+    state = _replay_kernel(
+        delays.tolist(), reordered.tolist(), ticks.tolist(), out, out_unlimited, out_reason, tick_timer.get_ms_per_tick(), START_DELAY_MS,
+        u_buckets, uo.bucket_size_ms, uo.hist.forget_factor, uo.hist.base_forget_factor,
+        u_use_start_weight, float(uo.hist.start_forget_weight or 0), uo.hist.add_cnt, uo.hist_quantile,
+        uo.resample_interval_ms or 0, uo.resample_stopwatch is not None,
+        uo.resample_stopwatch.start_tick if uo.resample_stopwatch else 0,
+        float(uo.max_delay_in_interval_ms), uo.optimal_delay_ms or 0,
+        ro is not None, r_buckets, ro.bucket_size_ms if ro else 1,
+        r_hist.forget_factor if r_hist else 0, r_hist.base_forget_factor if r_hist else 0,
+        r_use_start_weight, float(r_hist.start_forget_weight or 0) if r_hist else 0.0,
+        r_hist.add_cnt if r_hist else 0, ro.ms_per_loss_percent if ro else 0,
+        (ro.optimal_delay_ms or 0) if ro else 0,
+        float(delay_manager.effective_minimum_delay_ms), float(delay_manager.maximum_delay_ms),
+        float(delay_manager.packet_len_ms), delay_manager.max_packets_in_buffer)
+    (u_forget_factor, u_add_cnt, u_has_stopwatch, u_stopwatch_start, u_max_delay_in_interval,
+     u_optimal_delay_ms, r_forget_factor, r_add_cnt, r_optimal_delay_ms, unlimited_target_delay_ms) = state
+
+    # 状态写回
+    tick_timer.increment(int(ticks[-1]) - tick_timer.get_ticks())
+    uo.hist.set_buckets(u_buckets)
+    uo.hist.forget_factor = int(u_forget_factor)
+    uo.hist.add_cnt = int(u_add_cnt)
+    if u_has_stopwatch:
+        uo.resample_stopwatch = StopWatch(tick_timer)
+        uo.resample_stopwatch.start_tick = int(u_stopwatch_start)
+    uo.max_delay_in_interval_ms = _as_number(u_max_delay_in_interval)
+    uo.optimal_delay_ms = int(u_optimal_delay_ms)
+    if ro:
+        r_hist.set_buckets(r_buckets)
+        r_hist.forget_factor = int(r_forget_factor)
+        r_hist.add_cnt = int(r_add_cnt)
+        ro.optimal_delay_ms = int(r_optimal_delay_ms)
+    delay_manager.unlimited_target_delay_ms = int(unlimited_target_delay_ms)
+    delay_manager.target_level_ms = _as_number(out[-1])
+    previous_reason = delay_manager.target_level_reason
+    delay_manager.target_level_reason = TARGET_LEVEL_REASONS[int(out_reason[-1])]
+
+    out = np.asarray(out, dtype=np.float64)
+    if delay_manager.instrumentation is not None:
+        _record_instrumentation(delay_manager.instrumentation, previous_reason, out,
+                                np.asarray(out_unlimited, dtype=np.float64), np.asarray(out_reason, dtype=np.int64),
+                                perf_counter_ns() - start)
+    return out
+
+
+def _record_instrumentation(instrumentation, previous_reason, targets, unlimited, reasons, elapsed_ns):
+    # 与逐包update相同的计数和事件
+    counts = np.bincount(reasons, minlength=len(TARGET_LEVEL_REASONS))
+    for reason, count in zip(TARGET_LEVEL_REASONS, counts.tolist()):
+        if count:
+            instrumentation.count(f'delay_manager.target.{reason}', count)
+    previous = np.r_[TARGET_LEVEL_REASONS.index(previous_reason), reasons[:-1]]
+    for i in np.flatnonzero(reasons != previous).tolist():
+        instrumentation.event('delay_manager.target_reason_changed',
+                              reason=TARGET_LEVEL_REASONS[reasons[i]],
+                              previous_reason=TARGET_LEVEL_REASONS[previous[i]],
+                              target_level_ms=_as_number(targets[i]),
+                              unlimited_target_delay_ms=_as_number(unlimited[i]))
+    if instrumentation.timing:
+        instrumentation.timing_histogram('delay_manager.replay').add(elapsed_ns)
@@ -0,0 +1,162 @@
+"""
+DelayManagerConfig参数扫描。
+
+每个任务是(一个trace, 一组config)，在进程池中用MultiDelayManager同时回放这一组config。
+trace保存为.npy结构化数组，worker用mmap打开，不经过pickle传输，多个进程共享page cache。
+"""
+import itertools
+import random
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace, asdict
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from pirtc.base.tick_timer import TickTimer
+from pirtc.neteq.delay_manager import DelayManagerConfig
+from pirtc.neteq.multi_delay_manager import MultiDelayManager
+
+DELAY_TRACE_DTYPE = np.dtype([
+    ('tick', np.int64),
+    ('arrival_delay_ms', np.float64),
+    ('reordered', np.bool_),
+])
+
+SWEEP_PARAMS = ('quantile', 'forget_factor', 'start_forget_weight', 'resample_interval_ms',
+                'reorder_forget_factor', 'ms_per_loss_percent', 'delay_buckets', 'bucket_size_ms')
+
+# 统计target delay分布用的直方图，1ms一个bin
+TARGET_HIST_BINS = 10001
+CHUNK_PACKETS = 4096
+
+
+def save_delay_trace(path: str, ticks, arrival_delays_ms, reordered):
+    trace = np.zeros(len(ticks), dtype=DELAY_TRACE_DTYPE)
+    trace['tick'] = ticks
+    trace['arrival_delay_ms'] = arrival_delays_ms
+    trace['reordered'] = reordered
+    np.save(path, trace)
+
+
+def load_delay_trace(path: str) -> np.ndarray:
+    return np.load(path, mmap_mode='r')
+
+
+def grid_configs(base: DelayManagerConfig, **params: Sequence) -> List[DelayManagerConfig]:
+    """
+    grid_configs(base, quantile=[0.9, 0.95], forget_factor=[0.97, 0.983])
+    """
+    names = list(params.keys())
+    return [replace(base, **dict(zip(names, values))) for values in itertools.product(*params.values())]
+
+
+def random_configs(base: DelayManagerConfig, num: int, seed: int = 0, **params) -> List[DelayManagerConfig]:
+    """
+    参数为(low, high)时均匀采样（都是int时采样整数），为list时随机选择。
+    """
+    rnd = random.Random(seed)
+
+    def sample(spec):
+        if isinstance(spec, tuple):
+            low, high = spec
+            if isinstance(low, int) and isinstance(high, int):
+                return rnd.randint(low, high)
+            return rnd.uniform(low, high)
+        return rnd.choice(spec)
+
+    return [replace(base, **{k: sample(v) for k, v in params.items()}) for _ in range(num)]
+
+
+def replay_configs(trace: np.ndarray, configs: List[DelayManagerConfig]) -> List[Dict]:
+    """
+    在一个trace上同时回放一组config，返回每个config的统计。
+    late loss: 包的到达延迟超过它到达时生效的target delay。
+    """
+    n = len(configs)
+    tick_timer = TickTimer()
+    manager = MultiDelayManager(configs, tick_timer)
+    target_sum = np.zeros(n, dtype=np.float64)
+    late_packets = np.zeros(n, dtype=np.int64)
+    target_hist = np.zeros(n * TARGET_HIST_BINS, dtype=np.int64)
+    bin_offset = np.arange(n) * TARGET_HIST_BINS
+
+    for begin in range(0, len(trace), CHUNK_PACKETS):
+        chunk = np.asarray(trace[begin:begin + CHUNK_PACKETS])
+        targets = np.zeros((len(chunk), n), dtype=np.float64)
+        for i in range(len(chunk)):
+            delay = chunk['arrival_delay_ms'][i]
+            late_packets += delay > manager.target_level_ms
+            tick_timer.increment(int(chunk['tick'][i]) - tick_timer.get_ticks())
+            manager.update(delay, chunk['reordered'][i])
+            targets[i] = manager.target_level_ms
+        target_sum += targets.sum(axis=0)
+        bins = np.minimum(targets.astype(np.int64), TARGET_HIST_BINS - 1) + bin_offset
+        target_hist += np.bincount(bins.ravel(), minlength=n * TARGET_HIST_BINS)
+
+    num_packets = max(len(trace), 1)
+    cdf = np.cumsum(target_hist.reshape(n, TARGET_HIST_BINS), axis=1)
+    p95 = (cdf < 0.95 * len(trace)).sum(axis=1)
+    return [{
+        'packets': len(trace),
+        'mean_target_delay_ms': target_sum[k] / num_packets,
+        'p95_target_delay_ms': int(p95[k]),
+        'late_loss_rate': late_packets[k] / num_packets,
+    } for k in range(n)]
+
+
+_traces = {}
+
+
+def _run_job(trace_path: str, config_ids: List[int], configs: List[DelayManagerConfig]) -> List[Dict]:
+    # 每个worker进程只mmap一次
+    if trace_path not in _traces:
+        _traces[trace_path] = load_delay_trace(trace_path)
+    rows = replay_configs(_traces[trace_path], configs)
+    for config_id, row in zip(config_ids, rows):
+        row['config_id'] = config_id
+        row['trace'] = trace_path
+    return rows
+
+
+def sweep(configs: List[DelayManagerConfig],
+          trace_paths: List[str],
+          max_workers: int = None,
+          configs_per_job: int = 256) -> pd.DataFrame:
+    """
+    返回每个(config, trace)的统计，以及config的参数。
+    """
+    jobs = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for trace_path in trace_paths:
+            for begin in range(0, len(configs), configs_per_job):
+                config_ids = list(range(begin, min(begin + configs_per_job, len(configs))))
+                jobs.append(executor.submit(_run_job, trace_path, config_ids, [configs[i] for i in config_ids]))
+        rows = [row for job in jobs for row in job.result()]
+
+    result = pd.DataFrame(rows)
+    params = pd.DataFrame([{k: asdict(c)[k] for k in SWEEP_PARAMS} for c in configs])
+    params['config_id'] = range(len(configs))
+    return result.merge(params, on='config_id')
+
+
+def summarize(result: pd.DataFrame) -> pd.DataFrame:
+    """
+    按config汇总所有trace：均值和late loss按包数加权，p95取各trace的平均。
+    """
+    weighted = result.assign(target_sum=result['mean_target_delay_ms'] * result['packets'],
+                             late_sum=result['late_loss_rate'] * result['packets'])
+    summary = weighted.groupby(['config_id', *SWEEP_PARAMS], dropna=False).agg(
+        packets=('packets', 'sum'),
+        target_sum=('target_sum', 'sum'),
+        late_sum=('late_sum', 'sum'),
+        p95_target_delay_ms=('p95_target_delay_ms', 'mean'),
+    ).reset_index()
+    summary['mean_target_delay_ms'] = summary['target_sum'] / summary['packets']
+    summary['late_loss_rate'] = summary['late_sum'] / summary['packets']
+    return summary.drop(columns=['target_sum', 'late_sum']).sort_values('config_id').reset_index(drop=True)
+
+
+def write_summary(result: pd.DataFrame, path: str):
+    summarize(result).to_csv(path, index=False)
+
@@ -1,6 +1,13 @@
 """
 Powered by tkorays. All rights reserved.
 """
+from itertools import islice
+
+import numpy as np
+
+# FenwickHistogram的scale低于这个值时重新归一化
+FENWICK_MIN_SCALE = 1e-60
+
 
 class Histogram:
     def __init__(self, num_buckets, forget_factor, start_forget_weight):
@@ -10,6 +17,10 @@ class Histogram:
         self.start_forget_weight = start_forget_weight
         self.buckets = [0 for i in range(self.num_buckets)]
         self.add_cnt = 0
+        # 大于这个值(Q30)的bucket由heavy_buckets列出，None时不统计
+        self.heavy_threshold = None
+        self._cumulative = None
+        self._heavy = []
 
     def reset(self):
         tmp_prob = 0x4002
@@ -18,6 +29,7 @@ class Histogram:
             self.buckets[i] = tmp_prob << 16
         self.forget_factor = 0
         self.add_cnt = 0
+        self._update_derived()
 
     def add(self, index):
         vector_sum = 0
@@ -32,17 +44,24 @@ class Histogram:
 
         # bucket中所有数据的和应该为1，运算会存在一点偏差(1~2)，将偏差分配到有数据的bucket上面
         vector_sum -= 1 << 30
+        increased = [index]
         if vector_sum != 0:
             flip_sign = -1 if vector_sum > 0 else 1
             for i in range(self.num_buckets):
                 correction = flip_sign * min(abs(vector_sum), self.buckets[i])
                 self.buckets[i] += correction
                 vector_sum += correction
+                if correction > 0:
+                    increased.append(i)
                 if abs(vector_sum) == 0:
                     break
 
         self.add_cnt += 1
-        if self.start_forget_weight >= 0:
+        self._update_derived(increased)
+        self.update_forget_factor()
+
+    def update_forget_factor(self):
+        if self.start_forget_weight is not None and self.start_forget_weight >= 0:
             if self.forget_factor != self.base_forget_factor:
                 forget_factor = int((1 << 15) * (1 - self.start_forget_weight / (self.add_cnt + 1)))
                 self.forget_factor = max(0, min(self.base_forget_factor, forget_factor))
@@ -55,8 +74,253 @@ class Histogram:
         index = 0
         bucket_sum = 1 << 30
         bucket_sum -= self.buckets[index]
-        while bucket_sum > inverse_probability and index < self.num_buckets:
+        while bucket_sum > inverse_probability and index < self.num_buckets - 1:
             index += 1
             bucket_sum -= self.buckets[index]
         return index
 
+    def cumulative(self, index) -> int:
+        """
+        Q30的累积概率，bucket[0..index]的和
+        """
+        return sum(islice(self.buckets, index + 1))
+
+    def cumulative_buckets(self) -> np.ndarray:
+        """
+        Q30的累积概率，第i个元素是bucket[0..i]的和
+        """
+        return np.cumsum(np.asarray(self.buckets, dtype=np.int64))
+
+    def set_heavy_threshold(self, threshold):
+        self.heavy_threshold = threshold
+        self._update_derived()
+
+    def heavy_buckets(self):
+        """
+        概率大于heavy_threshold的bucket下标，不保证顺序
+        """
+        return self._heavy
+
+    def set_buckets(self, buckets):
+        # 直接覆盖bucket的值，例如批量回放之后写回状态
+        self.buckets[:] = [int(b) for b in buckets]
+        self._update_derived()
+
+    def _update_derived(self, increased=None):
+        """
+        add/reset/set_buckets之后更新heavy_buckets。
+        increased: add中增加了的bucket，遗忘只会让bucket变小，只有这些bucket可能新超过heavy_threshold
+        """
+        if self.heavy_threshold is None:
+            return
+        threshold = self.heavy_threshold
+        buckets = self.buckets
+        if increased is None:
+            self._heavy = [i for i, b in enumerate(buckets) if b > threshold]
+        else:
+            heavy = [i for i in self._heavy if buckets[i] > threshold]
+            for i in increased:
+                if buckets[i] > threshold and i not in heavy:
+                    heavy.append(i)
+            self._heavy = heavy
+
+
+class NumpyHistogram(Histogram):
+    """
+    基于numpy int64数组的直方图，定点运算结果与Histogram完全一致。
+    Q30的bucket乘上Q15的遗忘系数最大为2^45，int64不会溢出。
+    """
+    def __init__(self, num_buckets, forget_factor, start_forget_weight):
+        super().__init__(num_buckets, forget_factor, start_forget_weight)
+        self.buckets = np.zeros(self.num_buckets, dtype=np.int64)
+        self._update_derived()
+
+    def reset(self):
+        self.buckets = np.right_shift(0x4002, np.arange(1, self.num_buckets + 1, dtype=np.int64)) << 16
+        self.forget_factor = 0
+        self.add_cnt = 0
+        self._update_derived()
+
+    def add(self, index):
+        buckets = self.buckets
+        buckets *= self.forget_factor
+        buckets >>= 15
+        buckets[index] += (32768 - self.forget_factor) << 15
+
+        vector_sum = int(buckets.sum()) - (1 << 30)
+        increased = [index]
+        if vector_sum != 0:
+            # 和Histogram一样按顺序修正：第i个bucket最多修正min(剩余偏差, bucket[i])
+            remain = abs(vector_sum) - (np.cumsum(buckets) - buckets)
+            correction = np.minimum(np.maximum(remain, 0), buckets)
+            if vector_sum > 0:
+                buckets -= correction
+            else:
+                buckets += correction
+                increased.extend(np.flatnonzero(correction).tolist())
+
+        self.add_cnt += 1
+        self._update_derived(increased)
+        self.update_forget_factor()
+
+    def quantile(self, probability) -> int:
+        # 第一个累积概率不小于probability的bucket
+        index = int(np.searchsorted(self._cumulative, probability, side='left'))
+        return min(index, self.num_buckets - 1)
+
+    def cumulative(self, index) -> int:
+        return int(self._cumulative[index])
+
+    def cumulative_buckets(self) -> np.ndarray:
+        return self._cumulative
+
+    def _update_derived(self, increased=None):
+        # 每次add所有bucket都会变化，在add中直接累加到已有的数组，查询时不需要再转换
+        if self._cumulative is None:
+            self._cumulative = np.zeros(self.num_buckets, dtype=np.int64)
+        np.cumsum(self.buckets, out=self._cumulative)
+        super()._update_derived(increased)
+
+
+class FenwickHistogram(Histogram):
+    """
+    用Fenwick树维护前缀和的直方图，add和quantile都是O(log buckets)，适合很细的bucket。
+
+    add对所有bucket做同样的缩放，所以不逐个乘遗忘系数，而是记录一个全局的scale：
+    bucket的概率 = weights[i] * scale。新数据的权重除以scale后加到树上，
+    scale过小时把scale乘回weights并重建树（均摊O(1)），同时归一化使总和为1。
+    cumulative也是O(log buckets)。超过heavy_threshold的bucket只可能是add过的，add时记录，查询时去掉已经遗忘到阈值以下的，
+    所以ReorderOptimizer每个包的开销和bucket数无关。
+    使用浮点运算，结果与Q30定点的Histogram只有舍入上的差异，不保证bit-exact。
+    """
+    def __init__(self, num_buckets, forget_factor, start_forget_weight):
+        self.num_buckets = num_buckets
+        self.forget_factor = 0
+        self.base_forget_factor = forget_factor
+        self.start_forget_weight = start_forget_weight
+        self.add_cnt = 0
+        self.heavy_threshold = None
+        self._cumulative = None
+        self._heavy = []
+        self.weights = [0.0] * num_buckets
+        self.tree = [0.0] * (num_buckets + 1)
+        self.scale = 1.0
+        self.top_bit = 1 << (num_buckets.bit_length() - 1)
+
+    @property
+    def buckets(self):
+        # Q30表示的各bucket概率
+        return [int(w * self.scale * (1 << 30)) for w in self.weights]
+
+    def reset(self):
+        tmp_prob = 0x4002
+        for i in range(self.num_buckets):
+            tmp_prob = tmp_prob >> 1
+            self.weights[i] = (tmp_prob << 16) / (1 << 30)
+        self.scale = 1.0
+        self._build_tree()
+        self.forget_factor = 0
+        self.add_cnt = 0
+        self._cumulative = None
+        self._update_derived()
+
+    def add(self, index):
+        if self.forget_factor == 0:
+            # 老的数据全部遗忘
+            self.weights = [0.0] * self.num_buckets
+            self.scale = 1.0
+            self._build_tree()
+            self._heavy = []
+        else:
+            if self.scale < FENWICK_MIN_SCALE:
+                self._renormalize()
+            self.scale *= self.forget_factor / 32768
+        self._tree_add(index, (32768 - self.forget_factor) / 32768 / self.scale)
+        if self.heavy_threshold is not None and index not in self._heavy and \
+                self.weights[index] * self.scale * (1 << 30) > self.heavy_threshold:
+            self._heavy.append(index)
+        self.add_cnt += 1
+        self._cumulative = None
+        self.update_forget_factor()
+
+    def quantile(self, probability) -> int:
+        # 找到前缀和小于probability的最长前缀，下一个bucket就是结果
+        target = probability / (1 << 30) / self.scale
+        index = 0
+        bit = self.top_bit
+        while bit:
+            node = index + bit
+            if node <= self.num_buckets and self.tree[node] < target:
+                index = node
+                target -= self.tree[node]
+            bit >>= 1
+        return min(index, self.num_buckets - 1)
+
+    def cumulative_buckets(self) -> np.ndarray:
+        if self._cumulative is None:
+            # 和buckets一样先截断成Q30再累加
+            buckets = (np.asarray(self.weights) * self.scale * (1 << 30)).astype(np.int64)
+            self._cumulative = np.cumsum(buckets)
+        return self._cumulative
+
+    def cumulative(self, index) -> int:
+        total = 0.0
+        node = index + 1
+        while node > 0:
+            total += self.tree[node]
+            node -= node & -node
+        return int(total * self.scale * (1 << 30))
+
+    def heavy_buckets(self):
+        # 遗忘只会让bucket变小，低于阈值的以后只有再add才会重新超过
+        threshold = self.heavy_threshold / self.scale / (1 << 30)
+        weights = self.weights
+        self._heavy = [i for i in self._heavy if weights[i] > threshold]
+        return self._heavy
+
+    def set_buckets(self, buckets):
+        self.weights = [int(b) / (1 << 30) for b in buckets]
+        self.scale = 1.0
+        self._build_tree()
+        self._cumulative = None
+        self._update_derived()
+
+    def _update_derived(self, increased=None):
+        if self.heavy_threshold is None:
+            return
+        threshold = self.heavy_threshold / self.scale / (1 << 30)
+        self._heavy = [i for i, w in enumerate(self.weights) if w > threshold]
+
+    def _tree_add(self, index, value):
+        self.weights[index] += value
+        node = index + 1
+        while node <= self.num_buckets:
+            self.tree[node] += value
+            node += node & -node
+
+    def _renormalize(self):
+        total = sum(self.weights) * self.scale
+        norm = self.scale / total if total > 0 else 0.0
+        self.weights = [w * norm for w in self.weights]
+        self.scale = 1.0
+        self._build_tree()
+
+    def _build_tree(self):
+        self.tree = [0.0] + self.weights
+        for node in range(1, self.num_buckets + 1):
+            parent = node + (node & -node)
+            if parent <= self.num_buckets:
+                self.tree[parent] += self.tree[node]
+
+
+HISTOGRAM_TYPES = {
+    'python': Histogram,
+    'numpy': NumpyHistogram,
+    'fenwick': FenwickHistogram,
+}
+
+
+def create_histogram(hist_type: str, num_buckets, forget_factor, start_forget_weight) -> Histogram:
+    if hist_type not in HISTOGRAM_TYPES:
+        raise Exception(f"not support histogram type {hist_type}")
+    return HISTOGRAM_TYPES[hist_type](num_buckets, forget_factor, start_forget_weight)
@@ -0,0 +1,226 @@
+"""
+同时运行N路DelayManager。
+
+所有状态按struct-of-arrays保存：直方图是N x delay_buckets的int64矩阵，遗忘系数、
+resample计时、target level等都是长度为N的数组。每次update推进所有收到包的流，
+结果与N个独立的DelayManager逐包调用完全一致。
+"""
+from typing import List
+
+import numpy as np
+
+from pirtc.base.tick_timer import TickTimer
+from pirtc.neteq.delay_manager import (DelayManagerConfig, START_DELAY_MS, TARGET_LEVEL_REASONS, REASON_START_DELAY,
+                                       REASON_UNDERRUN, REASON_REORDER, REASON_MINIMUM_DELAY, REASON_MAXIMUM_DELAY,
+                                       REASON_BUFFER_LIMIT)
+
+
+def _hist_add_rows(buckets, rows, forget_factor, index):
+    b = buckets[rows]
+    b *= forget_factor[:, None]
+    b >>= 15
+    b[np.arange(len(rows)), index] += (32768 - forget_factor) << 15
+
+    # 每一行按顺序修正偏差，与Histogram.add一致
+    vector_sum = b.sum(axis=1) - (1 << 30)
+    remain = np.abs(vector_sum)[:, None] - (np.cumsum(b, axis=1) - b)
+    correction = np.minimum(np.maximum(remain, 0), b)
+    b -= np.sign(vector_sum)[:, None] * correction
+    buckets[rows] = b
+
+
+def _next_forget_factor(forget_factor, base_forget_factor, use_start_weight, start_forget_weight, add_cnt):
+    start_weight_factor = np.trunc((1 << 15) * (1 - start_forget_weight / (add_cnt + 1))).astype(np.int64)
+    start_weight_factor = np.where(forget_factor != base_forget_factor,
+                                   np.clip(start_weight_factor, 0, base_forget_factor),
+                                   forget_factor)
+    converge_factor = forget_factor + ((base_forget_factor - forget_factor + 3) >> 2)
+    return np.where(use_start_weight, start_weight_factor, converge_factor)
+
+
+def _hist_quantile_rows(buckets, probability):
+    # 每一行第一个累积概率不小于probability的bucket
+    index = (np.cumsum(buckets, axis=1) < probability[:, None]).sum(axis=1)
+    return np.minimum(index, buckets.shape[1] - 1)
+
+
+def _minimize_cost_rows(buckets, base_delay_ms, ms_per_loss_percent, bucket_size_ms):
+    # loss概率变为0之后，后面的bucket代价只会更大，所以直接取整行的argmin
+    loss_probability = (1 << 30) - np.cumsum(buckets, axis=1)
+    delay_ms = np.maximum(0, np.arange(buckets.shape[1]) * bucket_size_ms - base_delay_ms[:, None]) << 30
+    cost = delay_ms + 100 * ms_per_loss_percent[:, None] * loss_probability
+    return np.argmin(cost, axis=1)
+
+
+class _HistogramBank:
+    """
+    N个Histogram的状态
+    """
+    def __init__(self, num_streams, num_buckets, forget_factor, start_forget_weight):
+        self.buckets = np.zeros((num_streams, num_buckets), dtype=np.int64)
+        self.forget_factor = np.zeros(num_streams, dtype=np.int64)
+        self.base_forget_factor = np.asarray(forget_factor, dtype=np.int64)
+        self.use_start_weight = np.array([w is not None and w >= 0 for w in start_forget_weight], dtype=np.bool_)
+        self.start_forget_weight = np.array([w if w is not None else 0 for w in start_forget_weight], dtype=np.float64)
+        self.add_cnt = np.zeros(num_streams, dtype=np.int64)
+
+    def add(self, rows, index):
+        if len(rows) == 0:
+            return
+        _hist_add_rows(self.buckets, rows, self.forget_factor[rows], index)
+        self.add_cnt[rows] += 1
+        self.forget_factor[rows] = _next_forget_factor(self.forget_factor[rows], self.base_forget_factor[rows],
+                                                       self.use_start_weight[rows], self.start_forget_weight[rows],
+                                                       self.add_cnt[rows])
+
+    def reset(self, rows):
+        self.buckets[rows] = np.right_shift(0x4002, np.arange(1, self.buckets.shape[1] + 1, dtype=np.int64)) << 16
+        self.forget_factor[rows] = 0
+        self.add_cnt[rows] = 0
+
+
+class MultiDelayManager:
+    def __init__(self,
+                 configs: List[DelayManagerConfig],
+                 tick_timer: TickTimer):
+        self.configs = list(configs)
+        self.tick_timer = tick_timer
+        self.num_streams = n = len(self.configs)
+
+        def column(name, dtype):
+            return np.array([getattr(c, name) for c in self.configs], dtype=dtype)
+
+        # 所有流的bucket配置需要相同
+        self.num_buckets = self.configs[0].delay_buckets
+        self.bucket_size_ms = self.configs[0].bucket_size_ms
+        if any(c.delay_buckets != self.num_buckets or c.bucket_size_ms != self.bucket_size_ms for c in self.configs):
+            raise Exception("all streams must use the same delay buckets")
+
+        # UnderRunOptimizer
+        self.hist_quantile = np.array([int((1 << 30) * c.quantile) for c in self.configs], dtype=np.int64)
+        self.resample_interval_ms = np.array([c.resample_interval_ms or 0 for c in self.configs], dtype=np.int64)
+        self.underrun_hist = _HistogramBank(n, self.num_buckets,
+                                            [int((1 << 15) * c.forget_factor) for c in self.configs],
+                                            [c.start_forget_weight for c in self.configs])
+        self.has_resample_stopwatch = np.zeros(n, dtype=np.bool_)
+        self.resample_start_tick = np.zeros(n, dtype=np.int64)
+        self.max_delay_in_interval_ms = np.zeros(n, dtype=np.float64)
+        self.underrun_optimal_delay_ms = np.zeros(n, dtype=np.int64)
+
+        # ReorderOptimizer
+        self.use_reorder_optimizer = column('use_reorder_optimizer', np.bool_)
+        self.ms_per_loss_percent = column('ms_per_loss_percent', np.int64)
+        self.reorder_hist = _HistogramBank(n, self.num_buckets,
+                                           [int((1 << 15) * c.reorder_forget_factor) for c in self.configs],
+                                           [c.start_forget_weight for c in self.configs])
+        self.reorder_optimal_delay_ms = np.zeros(n, dtype=np.int64)
+
+        # DelayManager
+        self.max_packets_in_buffer = column('max_packets_in_buffer', np.int64)
+        self.effective_minimum_delay_ms = column('base_minimum_delay_ms', np.float64)
+        self.maximum_delay_ms = np.zeros(n, dtype=np.float64)
+        self.packet_len_ms = np.zeros(n, dtype=np.float64)
+        self.target_level_ms = np.full(n, START_DELAY_MS, dtype=np.float64)
+        self.unlimited_target_delay_ms = np.zeros(n, dtype=np.int64)
+        # 决定target_level_ms的因素，TARGET_LEVEL_REASONS的下标
+        self.target_level_reason = np.full(n, REASON_START_DELAY, dtype=np.int8)
+
+    def update(self, arrival_delay_ms, reordered, mask=None):
+        """
+        当前tick所有流的一次更新，mask为False的流本次没有收到包，状态不变。
+        """
+        delays = np.asarray(arrival_delay_ms, dtype=np.float64)
+        reordered = np.asarray(reordered, dtype=np.bool_)
+        mask = np.ones(self.num_streams, dtype=np.bool_) if mask is None else np.asarray(mask, dtype=np.bool_)
+        delays = np.where(mask, delays, 0)
+        tick = self.tick_timer.get_ticks()
+
+        # UnderRunOptimizer.update，乱序包不参与underrun估计
+        underrun = mask & ~(self.use_reorder_optimizer & reordered)
+        hist_update = np.where(underrun, delays, 0)
+        resample = underrun & (self.resample_interval_ms > 0)
+        new_stopwatch = resample & ~self.has_resample_stopwatch
+        self.resample_start_tick[new_stopwatch] = tick
+        self.has_resample_stopwatch |= new_stopwatch
+        expired = resample & ((tick - self.resample_start_tick) * self.tick_timer.get_ms_per_tick()
+                              > self.resample_interval_ms)
+        hist_update[expired] = self.max_delay_in_interval_ms[expired]
+        self.resample_start_tick[expired] = tick
+        self.max_delay_in_interval_ms[expired] = 0
+        self.max_delay_in_interval_ms[resample] = np.maximum(self.max_delay_in_interval_ms[resample], delays[resample])
+
+        active = underrun & (hist_update != 0)
+        index = (hist_update // self.bucket_size_ms).astype(np.int64)
+        rows = np.flatnonzero(active & (index < self.num_buckets))
+        self.underrun_hist.add(rows, index[rows])
+        rows = np.flatnonzero(active)
+        self.underrun_optimal_delay_ms[rows] = (1 + _hist_quantile_rows(self.underrun_hist.buckets[rows],
+                                                                        self.hist_quantile[rows])) \
+            * self.bucket_size_ms
+
+        target = np.where(self.underrun_optimal_delay_ms != 0, self.underrun_optimal_delay_ms, START_DELAY_MS)
+        reason = np.where(self.underrun_optimal_delay_ms != 0, REASON_UNDERRUN, REASON_START_DELAY).astype(np.int8)
+
+        # ReorderOptimizer.update
+        reorder = mask & self.use_reorder_optimizer
+        index = np.where(reordered, delays // self.bucket_size_ms, 0).astype(np.int64)
+        rows = np.flatnonzero(reorder & (index < self.num_buckets))
+        self.reorder_hist.add(rows, index[rows])
+        rows = np.flatnonzero(reorder)
+        bucket_index = _minimize_cost_rows(self.reorder_hist.buckets[rows], target[rows],
+                                           self.ms_per_loss_percent[rows], self.bucket_size_ms)
+        self.reorder_optimal_delay_ms[rows] = (1 + bucket_index) * self.bucket_size_ms
+        reorder_rows = rows[self.reorder_optimal_delay_ms[rows] > target[rows]]
+        target[reorder_rows] = self.reorder_optimal_delay_ms[reorder_rows]
+        reason[reorder_rows] = REASON_REORDER
+
+        # 最小/最大延迟，以及不超过packet buffer的75%，与DelayManager.update相同，相等时不换因素
+        self.unlimited_target_delay_ms[mask] = target[mask]
+        limited = target.astype(np.float64)
+        clamp = self.effective_minimum_delay_ms > limited
+        limited[clamp] = self.effective_minimum_delay_ms[clamp]
+        reason[clamp] = REASON_MINIMUM_DELAY
+        clamp = (self.maximum_delay_ms > 0) & (self.maximum_delay_ms < limited)
+        limited[clamp] = self.maximum_delay_ms[clamp]
+        reason[clamp] = REASON_MAXIMUM_DELAY
+        buffer_limit_ms = 3 * self.max_packets_in_buffer * self.packet_len_ms / 4
+        clamp = (self.packet_len_ms > 0) & (buffer_limit_ms < limited)
+        limited[clamp] = buffer_limit_ms[clamp]
+        reason[clamp] = REASON_BUFFER_LIMIT
+        self.target_level_ms[mask] = limited[mask]
+        self.target_level_reason[mask] = reason[mask]
+
+    def replay(self, arrival_delays_ms, reordered, valid, ticks) -> np.ndarray:
+        """
+        输入T x N的矩阵，第t行表示ticks[t]时各个流收到的包，valid为False表示没有收到包。
+        返回T x N的target level，没有收到包的流保持上一次的值。
+        """
+        arrival_delays_ms = np.asarray(arrival_delays_ms, dtype=np.float64)
+        reordered = np.asarray(reordered, dtype=np.bool_)
+        valid = np.asarray(valid, dtype=np.bool_)
+        out = np.zeros(arrival_delays_ms.shape, dtype=np.float64)
+        for t in range(arrival_delays_ms.shape[0]):
+            self.tick_timer.increment(int(ticks[t]) - self.tick_timer.get_ticks())
+            self.update(arrival_delays_ms[t], reordered[t], valid[t])
+            out[t] = self.target_level_ms
+        return out
+
+    def reset(self, rows=None):
+        rows = np.arange(self.num_streams) if rows is None else np.asarray(rows)
+        self.packet_len_ms[rows] = 0
+        self.underrun_hist.reset(rows)
+        self.has_resample_stopwatch[rows] = False
+        self.max_delay_in_interval_ms[rows] = 0
+        self.target_level_ms[rows] = START_DELAY_MS
+        self.target_level_reason[rows] = REASON_START_DELAY
+        self.reorder_hist.reset(rows)
+        self.reorder_optimal_delay_ms[rows] = 0
+
+    def get_target_delay_ms(self):
+        return self.target_level_ms
+
+    def get_unlimited_target_delay_ms(self):
+        return self.unlimited_target_delay_ms
+
+    def get_target_level_reasons(self):
+        return [TARGET_LEVEL_REASONS[r] for r in self.target_level_reason.tolist()]
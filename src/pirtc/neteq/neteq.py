@@ -0,0 +1,259 @@
+"""
+NetEQ的收包和出音频流程，把PacketBuffer、DecisionLogic(DelayManager、PacketArrivalHistory)和TickTimer串起来。
+
+只仿真数据量，不处理真实的音频：sync buffer只记录已经解码还没有播放的样本数，
+expand/merge/加速/减速只改变样本数和时间轴，用来评估抖动缓冲的策略和整条链路的性能。
+
+    neteq = NetEq(NetEqConfig(sample_rate_hz=16000))
+    neteq.insert_packet(packet, arrival_time_ms)
+    frame = neteq.get_audio()  # 每10ms调用一次
+"""
+from dataclasses import dataclass, field, replace
+
+from pirtc.base.instrumentation import Instrumentation
+from pirtc.base.number_unwrapper import NumberUnwrapper
+from pirtc.base.tick_timer import TickTimer
+from pirtc.neteq.decision_logic import DecisionLogic, NetEqStatus
+from pirtc.neteq.delay_manager import DelayManagerConfig
+from pirtc.neteq.packet import Packet, PacketPool
+from pirtc.neteq.packet_buffer import PacketBuffer, PRIMARY_PRIORITY
+
+OPERATIONS = ('NORMAL', 'EXPAND', 'MERGE', 'ACCELERATE', 'PREEMPTIVE_EXPAND')
+# 没有做基音检测，加速/减速每次固定删除/插入这么长的数据
+TIME_STRETCH_MS = 5
+# 加速/减速至少需要的数据量
+TIME_STRETCH_REQUIRED_MS = 30
+
+
+@dataclass
+class NetEqConfig:
+    sample_rate_hz: int = 16000
+    max_packets_in_buffer: int = 200
+    delay_manager: DelayManagerConfig = field(default_factory=DelayManagerConfig)
+
+
+@dataclass
+class AudioFrame:
+    samples_per_channel: int
+    sample_rate_hz: int
+    # 产生这一帧的操作，还没有收到过包时为None
+    operation: str = None
+
+
+@dataclass
+class NetEqStatistics:
+    packets_inserted: int = 0
+    # 过期被丢弃的包
+    packets_discarded: int = 0
+    buffer_flushes: int = 0
+    expanded_samples: int = 0
+    accelerated_samples: int = 0
+    preemptive_samples: int = 0
+    operations: dict = field(default_factory=lambda: {op: 0 for op in OPERATIONS})
+
+
+class NetEq:
+    def __init__(self,
+                 config: NetEqConfig = None,
+                 tick_timer: TickTimer = None,
+                 packet_pool: PacketPool = None,
+                 instrumentation: Instrumentation = None):
+        """
+        packet_pool不为None时，丢弃和解码完的包回收到池中，可以多个NetEq共用一个池
+        instrumentation不为None时，PacketBuffer和DelayManager的事件、计时都记录到其中
+        """
+        self.config = config or NetEqConfig()
+        self.tick_timer = tick_timer or TickTimer()
+        self.packet_buffer = PacketBuffer(self.config.max_packets_in_buffer, self.tick_timer, packet_pool,
+                                          instrumentation)
+        self.decision_logic = DecisionLogic(replace(self.config.delay_manager,
+                                                    max_packets_in_buffer=self.config.max_packets_in_buffer),
+                                            self.tick_timer,
+                                            instrumentation)
+        self.timestamp_unwrapper = NumberUnwrapper(32)
+        self.stats = NetEqStatistics()
+        self.sample_rate_hz = 0
+        self.output_size_samples = 0
+        self.set_sample_rate(self.config.sample_rate_hz)
+
+        self.first_packet = True
+        self.last_mode = 'NORMAL'
+        # 下一个要解码的时间戳（unwrap之后），expand不会推进
+        self.end_timestamp = 0
+        # 已经解码/生成还没有播放的样本数
+        self.sync_buffer_samples = 0
+        # 上一次解码之后expand生成的样本数
+        self.generated_noise_samples = 0
+        self.decoded_length = 2 * self.output_size_samples
+
+        if instrumentation is not None:
+            instrumentation.wrap_methods(self, 'neteq', ['insert_packet', 'get_audio'])
+
+    def set_sample_rate(self, sample_rate_hz: int):
+        self.sample_rate_hz = sample_rate_hz
+        self.output_size_samples = sample_rate_hz * self.tick_timer.get_ms_per_tick() // 1000
+        self.decision_logic.set_sample_rate(sample_rate_hz, self.output_size_samples)
+
+    def insert_packet(self, packet: Packet, arrival_time_ms=None):
+        """
+        packet.timestamp为RTP时间戳，插入后会被替换成unwrap之后的值。
+        arrival_time_ms缺省使用tick timer的时间。
+        """
+        if packet.payload is None and packet.frame is None:
+            return 'INVALID_PACKET'
+        if arrival_time_ms is None:
+            arrival_time_ms = self.tick_timer.get_ticks() * self.tick_timer.get_ms_per_tick()
+
+        rtp_timestamp = packet.timestamp
+        packet.timestamp = self.timestamp_unwrapper.unwrap(rtp_timestamp)
+        if self.first_packet:
+            # 时间轴从第一个包开始
+            self.first_packet = False
+            self.end_timestamp = packet.timestamp
+
+        # DTX包和冗余包不参与延迟估计。插入之后包可能已经被丢弃回收，先取出需要的信息
+        packet_length = packet.frame.duration() if packet.frame else 0
+        is_dtx = packet.frame is not None and packet.frame.is_dtx_packet()
+        update_delay = not is_dtx and packet.priority == PRIMARY_PRIORITY
+
+        ret = self.packet_buffer.insert_packet(packet, self.decoded_length, self.sample_rate_hz,
+                                               self.decision_logic.delay_manager.get_target_delay_ms(), None)
+        self.stats.packets_inserted += 1
+        if ret == 'PARTIAL_FLUSH':
+            self.stats.buffer_flushes += 1
+
+        self.decision_logic.packet_arrived(rtp_timestamp, arrival_time_ms, packet_length, update_delay)
+        return ret
+
+    def get_audio(self) -> AudioFrame:
+        self.tick_timer.increment()
+        if self.first_packet:
+            # 还没有收到过包，输出静音
+            return AudioFrame(self.output_size_samples, self.sample_rate_hz)
+
+        # 丢弃已经错过播放时间的包
+        num_packets = self.packet_buffer.num_packets_in_buffer()
+        self.packet_buffer.discard_all_old_packets(self.end_timestamp)
+        self.stats.packets_discarded += num_packets - self.packet_buffer.num_packets_in_buffer()
+
+        next_timestamp = self.packet_buffer.next_timestamp()
+        status = NetEqStatus(self.end_timestamp,
+                             None if next_timestamp == 'BUFFER_EMPTY' else next_timestamp,
+                             self.last_mode,
+                             self.packet_buffer.num_samples_in_buffer(),
+                             self.sync_buffer_samples,
+                             self.generated_noise_samples)
+        operation = self.decision_logic.get_decision(status)
+        if self.sync_buffer_samples >= self.output_size_samples and \
+                operation not in ('MERGE', 'ACCELERATE', 'PREEMPTIVE_EXPAND'):
+            # sync buffer中的数据已经够输出一帧
+            operation = 'NORMAL'
+        elif operation == 'EXPAND':
+            self.expand(self.output_size_samples - self.sync_buffer_samples)
+        elif operation in ('ACCELERATE', 'PREEMPTIVE_EXPAND'):
+            operation = self.time_stretch(operation)
+        else:
+            self.decode(self.output_size_samples, operation == 'MERGE')
+
+        if self.sync_buffer_samples < self.output_size_samples:
+            # 解码的数据不够一帧，剩余部分补偿
+            self.expand(self.output_size_samples - self.sync_buffer_samples)
+        self.sync_buffer_samples -= self.output_size_samples
+
+        self.last_mode = operation
+        self.decision_logic.expand_decision(operation)
+        self.stats.operations[operation] += 1
+        return AudioFrame(self.output_size_samples, self.sample_rate_hz, operation)
+
+    def skip_idle(self, num_ticks):
+        """
+        packet buffer为空时推进num_ticks个tick，结果与调用num_ticks次get_audio相同。
+        sync buffer中还有数据时逐帧输出，之后每一帧都是EXPAND，批量更新状态。
+        """
+        if not self.packet_buffer.empty():
+            raise Exception("packet buffer is not empty")
+        while num_ticks > 0 and not self.first_packet and self.sync_buffer_samples > 0:
+            self.get_audio()
+            num_ticks -= 1
+        if num_ticks <= 0:
+            return
+
+        self.tick_timer.increment(num_ticks)
+        if self.first_packet:
+            return
+        self.decision_logic.skip_no_packet(num_ticks)
+        num_samples = num_ticks * self.output_size_samples
+        self.generated_noise_samples += num_samples
+        self.stats.expanded_samples += num_samples
+        self.stats.operations['EXPAND'] += num_ticks
+        self.last_mode = 'EXPAND'
+
+    def decode(self, required_samples, merge=False):
+        """
+        从packet buffer中取出时间戳连续的包解码，直到sync buffer中的数据不少于required_samples。
+        merge时expand已经覆盖了中间丢失的部分，时间轴直接跳到下一个包。
+        """
+        while self.sync_buffer_samples < required_samples:
+            packet = self.packet_buffer.peak_next_packet()
+            if packet is None:
+                break
+            if packet.timestamp != self.end_timestamp:
+                if not merge:
+                    break
+                self.end_timestamp = packet.timestamp
+            merge = False
+            self.packet_buffer.get_next_packet()
+
+            result = packet.frame.decode(None) if packet.frame else None
+            self.packet_buffer.recycle(packet)
+            num_samples = result[0] if result and result[0] > 0 else self.decoded_length
+            self.decoded_length = num_samples
+            self.end_timestamp += num_samples
+            self.sync_buffer_samples += num_samples
+            self.generated_noise_samples = 0
+
+    def expand(self, num_samples):
+        self.sync_buffer_samples += num_samples
+        self.generated_noise_samples += num_samples
+        self.stats.expanded_samples += num_samples
+
+    def time_stretch(self, operation):
+        required_samples = TIME_STRETCH_REQUIRED_MS * self.sample_rate_hz // 1000
+        self.decode(required_samples)
+        if self.sync_buffer_samples < required_samples:
+            # 数据不够，不做时间拉伸
+            return 'NORMAL'
+
+        stretch_samples = TIME_STRETCH_MS * self.sample_rate_hz // 1000
+        if operation == 'ACCELERATE':
+            self.sync_buffer_samples -= stretch_samples
+            self.stats.accelerated_samples += stretch_samples
+            self.decision_logic.time_stretched(stretch_samples)
+        else:
+            self.sync_buffer_samples += stretch_samples
+            self.stats.preemptive_samples += stretch_samples
+            self.decision_logic.time_stretched(-stretch_samples)
+        return operation
+
+    def flush(self):
+        self.packet_buffer.flush()
+        self.decision_logic.soft_reset()
+        self.first_packet = True
+        self.last_mode = 'NORMAL'
+        self.sync_buffer_samples = 0
+        self.generated_noise_samples = 0
+        self.timestamp_unwrapper = NumberUnwrapper(32)
+
+    def get_target_delay_ms(self):
+        return self.decision_logic.delay_manager.get_target_delay_ms()
+
+    def current_delay_ms(self):
+        # packet buffer和sync buffer中的数据总量
+        samples = self.packet_buffer.num_samples_in_buffer() + self.sync_buffer_samples
+        return samples * 1000 / self.sample_rate_hz
+
+    def set_minimum_delay(self, delay_ms):
+        return self.decision_logic.delay_manager.set_minimum_delay(delay_ms)
+
+    def set_maximum_delay(self, delay_ms):
+        return self.decision_logic.delay_manager.set_maximum_delay(delay_ms)
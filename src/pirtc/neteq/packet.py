@@ -1,8 +1,12 @@
 from pirtc.base.tick_timer import StopWatch
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
-@dataclass
+# 比较优先级时codec_level放在高位，red_level放在低位，组成一个整数
+RED_LEVEL_BITS = 16
+
+
+@dataclass(frozen=True, slots=True)
 class PacketPriority:
     # 包类型
     # 媒体包：<0, 0>
@@ -12,33 +16,114 @@ class PacketPriority:
     # FEC包重传：<1, 1>
     codec_level: int = 0
     red_level: int = 0
+    key: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # red_level超出低位的范围会和codec_level重叠，比较结果错误
+        if not 0 <= self.red_level < 1 << RED_LEVEL_BITS:
+            raise Exception(f"red_level out of range: {self.red_level}")
+        object.__setattr__(self, 'key', (self.codec_level << RED_LEVEL_BITS) | self.red_level)
 
     def __lt__(self, other):
-        return self.red_level < other.red_level if self.codec_level == other.codec_level \
-            else self.codec_level < other.codec_level
+        return self.key < other.key
 
     def __gt__(self, other):
-        return self.red_level > other.red_level if self.codec_level == other.codec_level \
-            else self.codec_level > other.codec_level
+        return self.key > other.key
 
     def __eq__(self, other):
-        return self.codec_level == other.codec_level and self.red_level == other.red_level
+        if not isinstance(other, PacketPriority):
+            return NotImplemented
+        return self.key == other.key
 
     def __le__(self, other):
-        return not self.__gt__(other)
+        return self.key <= other.key
 
     def __ge__(self, other):
-        return not self.__lt__(other)
+        return self.key >= other.key
+
+
+# 不可变，所有主包共用一个实例
+PRIMARY_PRIORITY = PacketPriority(0, 0)
 
 
 class Packet:
+    __slots__ = ('timestamp', 'sequence_number', 'payload_type', 'payload', 'priority', 'waiting_time', 'frame',
+                 'arena_slot', 'pooled')
+
     def __init__(self):
         self.timestamp = 0
         self.sequence_number = 0
         self.payload_type = 0
+        # payload可以是指向接收缓冲区的memoryview，此时arena_slot是它所在的槽
         self.payload = None
-        self.priority = PacketPriority()
-        self.waiting_time: StopWatch
+        self.priority = PRIMARY_PRIORITY
+        self.waiting_time: StopWatch = None
         self.frame = None
+        self.arena_slot = None
+        # 是否在PacketPool的空闲列表中
+        self.pooled = False
+
+
+def release_payload(packet: Packet):
+    """
+    包被丢弃或者解码之后调用，归还payload所在的接收缓冲区。之后payload的内容会被新包覆盖，所以一并清空引用。
+    """
+    if packet.arena_slot is None:
+        return
+    packet.arena_slot.release()
+    packet.arena_slot = None
+    packet.payload = None
+    if packet.frame is not None:
+        packet.frame.payload = None
+
+
+class PacketPool:
+    """
+    Packet对象池。收包时acquire，PacketBuffer丢弃包或者包解码之后release回池中，
+    Packet连同它的waiting_time(StopWatch)一起复用，高包率时不产生分配和GC压力。
+    空闲列表最多保留max_size个，多出的交给GC。
+    """
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.free_packets = []
+        # acquire时池中有空闲对象/需要新建
+        self.hits = 0
+        self.misses = 0
+        self.released = 0
+        # release时池已满而丢弃
+        self.dropped = 0
+
+    def acquire(self) -> Packet:
+        if self.free_packets:
+            self.hits += 1
+            packet = self.free_packets.pop()
+            packet.pooled = False
+            return packet
+        self.misses += 1
+        return Packet()
 
+    def release(self, packet: Packet):
+        if packet.pooled:
+            raise Exception("packet released to pool twice")
+        release_payload(packet)
+        self.released += 1
+        if len(self.free_packets) >= self.max_size:
+            self.dropped += 1
+            return
+        packet.timestamp = 0
+        packet.sequence_number = 0
+        packet.payload_type = 0
+        packet.payload = None
+        packet.priority = PRIMARY_PRIORITY
+        packet.frame = None
+        packet.pooled = True
+        self.free_packets.append(packet)
 
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'released': self.released,
+            'dropped': self.dropped,
+            'free': len(self.free_packets),
+        }
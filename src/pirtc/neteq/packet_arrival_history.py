@@ -1,9 +1,10 @@
+from collections import deque
 from dataclasses import dataclass
 
 from pirtc.base.number_unwrapper import NumberUnwrapper
 
 
-@dataclass
+@dataclass(slots=True)
 class PacketArrival:
     rtp_timestamp_ms: int = 0
     arrival_time_ms: int = 0
@@ -15,49 +16,60 @@ class PacketArrival:
         return self.arrival_time_ms - self.rtp_timestamp_ms >= other.arrival_time_ms - other.rtp_timestamp_ms
 
     def __eq__(self, other):
-        return self.rtp_timestamp_ms ==  other.rtp_timestamp_ms and self.arrival_time_ms == self.arrival_time_ms
+        return self.rtp_timestamp_ms == other.rtp_timestamp_ms and self.arrival_time_ms == other.arrival_time_ms
 
     def str(self):
         return f'{self.rtp_timestamp_ms}_{self.arrival_time_ms}'
 
 class PacketArrivalHistory:
+    """
+    history按插入顺序保存窗口内的包，min/max用单调队列维护：
+    队首就是窗口内相对延迟(arrival - rtp)最小/最大的包，相同延迟时保留最新的包。
+    insert/get_delay_ms/get_max_delay_ms均摊O(1)。
+    """
     def __init__(self, window_size_ms: int):
-        self.history = []
-        self.min_packet_arrival = None
-        self.max_packet_arrival = None
+        self.history = deque()
+        self.min_arrivals = deque()
+        self.max_arrivals = deque()
         self.sample_rate_hz = 0
         self.window_size_ms = window_size_ms
         self.newest_rtp_timestamp = None
         self.timestamp_unwrapper = NumberUnwrapper(32)
 
+    @property
+    def min_packet_arrival(self):
+        return self.min_arrivals[0] if self.min_arrivals else None
+
+    @property
+    def max_packet_arrival(self):
+        return self.max_arrivals[0] if self.max_arrivals else None
+
     def insert(self, rtp_timestamp: int, arrival_time_ms: int):
         unwrapped_rtp_timestamp = self.timestamp_unwrapper.unwrap(rtp_timestamp)
-        if not self.newest_rtp_timestamp:
+        if self.newest_rtp_timestamp is None:
             self.newest_rtp_timestamp = unwrapped_rtp_timestamp
         if unwrapped_rtp_timestamp > self.newest_rtp_timestamp:
             self.newest_rtp_timestamp = unwrapped_rtp_timestamp
 
-        self.history.append(PacketArrival(unwrapped_rtp_timestamp / self.sample_rate_hz, arrival_time_ms))
+        unwrapped_rtp_timestamp_ms = unwrapped_rtp_timestamp / self.sample_rate_hz
+        self.history.append(PacketArrival(unwrapped_rtp_timestamp_ms, arrival_time_ms))
         self.maybe_update_cached_arrivals(self.history[-1])
 
-        while len(self.history) > 0:
-            if self.history[0].rtp_timestamp_ms + self.window_size_ms < unwrapped_rtp_timestamp / self.sample_rate_hz:
-                if self.history[0] == self.min_packet_arrival:
-                    self.min_packet_arrival = None
-                if self.history[0] == self.max_packet_arrival:
-                    self.max_packet_arrival = None
-                self.history.pop(0)
-            else:
-                break
-        if not self.min_packet_arrival or not self.max_packet_arrival:
-            for p in self.history:
-                self.maybe_update_cached_arrivals(p)
+        # 按插入顺序淘汰窗口外的包，被淘汰的包如果在单调队列中，一定在队首
+        while self.history[0].rtp_timestamp_ms + self.window_size_ms < unwrapped_rtp_timestamp_ms:
+            p = self.history.popleft()
+            if self.min_arrivals[0] is p:
+                self.min_arrivals.popleft()
+            if self.max_arrivals[0] is p:
+                self.max_arrivals.popleft()
 
     def maybe_update_cached_arrivals(self, p: PacketArrival):
-        if not self.min_packet_arrival or p <= self.min_packet_arrival:
-            self.min_packet_arrival = p
-        if not self.max_packet_arrival or p >= self.max_packet_arrival:
-            self.max_packet_arrival = p
+        while self.min_arrivals and p <= self.min_arrivals[-1]:
+            self.min_arrivals.pop()
+        self.min_arrivals.append(p)
+        while self.max_arrivals and p >= self.max_arrivals[-1]:
+            self.max_arrivals.pop()
+        self.max_arrivals.append(p)
 
     def get_delay_ms(self, rtp_timestamp: int, time_ms: int) -> int:
         unwrapped_rtp_timestamp_ms = self.timestamp_unwrapper.peek_unwrap(rtp_timestamp) / self.sample_rate_hz
@@ -69,14 +81,14 @@ class PacketArrivalHistory:
         return self.get_packet_arrival_delay_ms(self.max_packet_arrival)
 
     def is_newest_rtp_timestamp(self, rtp_timestamp: int):
-        if not self.newest_rtp_timestamp:
+        if self.newest_rtp_timestamp is None:
             return False
         return self.timestamp_unwrapper.peek_unwrap(rtp_timestamp) == self.newest_rtp_timestamp
 
     def reset(self):
         self.history.clear()
-        self.min_packet_arrival = None
-        self.max_packet_arrival = None
+        self.min_arrivals.clear()
+        self.max_arrivals.clear()
         self.timestamp_unwrapper = NumberUnwrapper(32)
         self.newest_rtp_timestamp = None
 
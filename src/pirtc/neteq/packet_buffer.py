@@ -1,6 +1,12 @@
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass
 
-from pirtc.neteq.packet import Packet, PacketPriority
+from pirtc.base.instrumentation import Instrumentation
+from pirtc.base.tick_timer import StopWatch
+from pirtc.neteq.packet import Packet, PacketPool, PRIMARY_PRIORITY, release_payload
+
+# 队首已经出队的空位超过这个数量，并且超过一半时，压缩一次
+COMPACT_THRESHOLD = 32
 
 
 @dataclass
@@ -11,22 +17,53 @@ class PacketBufferSmartFlushingConfig:
     target_level_multiplier: int = 3
 
 
+def _packet_timestamp(p: Packet):
+    return p.timestamp
+
+
 class PacketBuffer:
+    """
+    包按时间戳升序保存在buffer[head:]中，每个时间戳只保留优先级最高的包。
+    时间戳需要是unwrap之后的值。
+
+    - 插入：通常是追加到末尾。乱序包二分查找位置是O(log n)，但是list.insert要搬移后面的元素，是O(n)。
+      搬移只是一次memmove，800个包时每次约0.1us，远小于insert_packet本身的开销(约2us)，
+      见benchmarks/suite.py中的packet_buffer.insert_reordered
+    - 出队：只移动head，不搬移数据，空位积累到一定数量后再压缩
+    - 按时间戳丢弃：二分查找边界后整段删除
+    - 主包时长、DTX包个数在插入/丢弃时增量更新，查询O(1)
+    - 设置了packet_pool时，丢弃的包回收到池中，get_next_packet取出的包由调用者用完后调用recycle
+    - 设置了instrumentation时，记录每次flush和每个被丢弃的包及原因，并对插入/取包计时
+    """
     def __init__(self,
                  max_number_of_packets,
-                 tick_timer):
+                 tick_timer,
+                 packet_pool: PacketPool = None,
+                 instrumentation: Instrumentation = None):
         self.max_number_of_packets = max_number_of_packets
         self.tick_timer = tick_timer
+        self.packet_pool = packet_pool
         self.buffer = []
+        self.head = 0
+        # 主包（<0, 0>）的时长之和，以及时长未知的主包个数，存在时长未知的包时需要遍历计算
+        self.num_primary_samples = 0
+        self.num_primary_unknown_duration = 0
+        self.num_dtx_packets = 0
         self.smart_flush_config = PacketBufferSmartFlushingConfig()
         self.count_dtx_waiting_time = False
 
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            instrumentation.wrap_methods(self, 'packet_buffer', ['insert_packet', 'get_next_packet'])
+
     def flush(self):
-        for p in self.buffer:
-            # TODO: log discard packets
-            pass
+        if self.instrumentation is not None:
+            self.instrumentation.event('packet_buffer.flush', num_packets=self.num_packets_in_buffer())
+        for i in range(self.head, len(self.buffer)):
+            self._discard(self.buffer[i], 'flush')
         self.buffer.clear()
-        # TODO: log flush
+        self.head = 0
+        self._reset_counters()
 
     def partial_flush(self,
                       target_level_ms,
@@ -39,13 +76,20 @@ class PacketBuffer:
         # 避免flush得太低
         target_level_samples = max(target_level_samples,
                                    self.smart_flush_config.target_level_threshold * sample_rate / 1000)
-        while self.get_span_samples(last_decoded_length, sample_rate, True) > target_level_samples or \
-            len(self.buffer) > self.max_number_of_packets / 2:
-            # TODO: log discard
-            self.buffer.pop(0)
+        # 只从队首丢弃，span的末端不变
+        span_end = self._span_end(sample_rate)
+        num_packets = self.num_packets_in_buffer()
+        while not self.empty() and (span_end - self.buffer[self.head].timestamp > target_level_samples or
+                                    self.num_packets_in_buffer() > self.max_number_of_packets / 2):
+            self._discard(self._pop_front(), 'partial_flush')
+        if self.instrumentation is not None:
+            self.instrumentation.event('packet_buffer.partial_flush',
+                                       num_discarded=num_packets - self.num_packets_in_buffer(),
+                                       num_packets=self.num_packets_in_buffer(),
+                                       target_level_ms=target_level_ms)
 
     def empty(self):
-        return len(self.buffer) > 0
+        return self.head == len(self.buffer)
 
     def insert_packet(self,
                       packet: Packet,
@@ -53,54 +97,126 @@ class PacketBuffer:
                       sample_rate,
                       target_level_ms,
                       decoder):
-        pass
+        if packet.payload is None and packet.frame is None:
+            return 'INVALID_PACKET'
+
+        ret = 'OK'
+        # 不是Packet的对象可能没有waiting_time
+        waiting_time = getattr(packet, 'waiting_time', None)
+        if waiting_time is not None:
+            # 池中复用的包沿用原来的StopWatch。RtpReceiver中所有流共用一个PacketPool，
+            # 包上次可能属于另一个流，换成这个buffer的时钟
+            waiting_time.tick_timer = self.tick_timer
+            waiting_time.restart()
+        else:
+            packet.waiting_time = StopWatch(self.tick_timer)
+
+        # 数据量超过target level的N倍，或者包数已满，flush到target level
+        span_threshold = self.smart_flush_config.target_level_multiplier * \
+            max(self.smart_flush_config.target_level_threshold, target_level_ms) * sample_rate / 1000
+        smart_flush = self.get_span_samples(last_decoded_length, sample_rate, True) >= span_threshold
+        if self.num_packets_in_buffer() >= self.max_number_of_packets or smart_flush:
+            self.partial_flush(target_level_ms, sample_rate, last_decoded_length)
+            ret = 'PARTIAL_FLUSH'
+
+        # 大部分情况下新包的时间戳最大，直接追加到末尾
+        if self.empty() or packet.timestamp > self.buffer[-1].timestamp:
+            self.buffer.append(packet)
+            self._count_packet(packet, 1)
+            return ret
+
+        index = bisect_left(self.buffer, packet.timestamp, lo=self.head, key=_packet_timestamp)
+        if index < len(self.buffer) and self.buffer[index].timestamp == packet.timestamp:
+            # 相同时间戳只保留优先级高的包（值越小优先级越高），相同优先级保留先到的包
+            if packet.priority < self.buffer[index].priority:
+                self._count_packet(self.buffer[index], -1)
+                self._count_packet(packet, 1)
+                packet, self.buffer[index] = self.buffer[index], packet
+            # 被替换的旧包或者新包
+            self._discard(packet, 'duplicate')
+            return ret
+
+        self.buffer.insert(index, packet)
+        self._count_packet(packet, 1)
+        return ret
 
     def next_timestamp(self):
         if self.empty():
             return 'BUFFER_EMPTY'
-        return self.buffer[0].timestamp
+        return self.buffer[self.head].timestamp
 
     def next_higher_timestamp(self, timestamp):
-        pass
+        # 不小于timestamp的最小时间戳
+        if self.empty():
+            return 'BUFFER_EMPTY'
+        index = bisect_left(self.buffer, timestamp, lo=self.head, key=_packet_timestamp)
+        if index == len(self.buffer):
+            return 'NOT_FOUND'
+        return self.buffer[index].timestamp
 
     def peak_next_packet(self):
-        return None if self.empty() else self.buffer[0]
+        return None if self.empty() else self.buffer[self.head]
 
     def get_next_packet(self):
         if self.empty():
             return None
-
-        packet = self.buffer[0]
-        self.buffer.pop(0)
-        return packet
+        return self._pop_front()
 
     def discard_next_packet(self):
         if self.empty():
             return
-        # TODO: log discard packet
-        self.buffer.pop(0)
+        self._discard(self._pop_front(), 'discard_next')
 
     def discard_old_packets(self,
                             timestamp_limit,
                             horizon_samples):
-        pass
+        # 丢弃(timestamp_limit - horizon_samples, timestamp_limit)之间的包，horizon_samples为0时丢弃所有早于timestamp_limit的包
+        end = bisect_left(self.buffer, timestamp_limit, lo=self.head, key=_packet_timestamp)
+        if horizon_samples == 0:
+            begin = self.head
+        else:
+            begin = bisect_right(self.buffer, timestamp_limit - horizon_samples, lo=self.head, hi=end,
+                                 key=_packet_timestamp)
+        if begin >= end:
+            return
+        for i in range(begin, end):
+            self._count_packet(self.buffer[i], -1)
+            self._discard(self.buffer[i], 'old')
+        if begin == self.head:
+            self.buffer[begin:end] = [None] * (end - begin)
+            self.head = end
+            self._maybe_compact()
+        else:
+            del self.buffer[begin:end]
 
     def discard_all_old_packets(self,
                                 timestamp_limit):
-        pass
+        self.discard_old_packets(timestamp_limit, 0)
 
     def discard_packet_with_payload_type(self, payload_type):
-        pass
+        remain = [p for p in self.buffer[self.head:] if p.payload_type != payload_type]
+        for p in self.buffer[self.head:]:
+            if p.payload_type == payload_type:
+                self._discard(p, 'payload_type')
+        self.buffer = remain
+        self.head = 0
+        self._reset_counters()
+        for p in self.buffer:
+            self._count_packet(p, 1)
 
     def num_packets_in_buffer(self):
-        return len(self.buffer)
+        return len(self.buffer) - self.head
 
     def num_samples_in_buffer(self):
+        if self.num_primary_unknown_duration == 0:
+            return self.num_primary_samples
+
         num_samples = 0
         last_duration = 0
-        for p in self.buffer:
+        for i in range(self.head, len(self.buffer)):
+            p = self.buffer[i]
             if p.frame:
-                if p.priority != PacketPriority(0, 0):
+                if p.priority != PRIMARY_PRIORITY:
                     continue
                 duration = p.frame.duration()
                 if duration > 0:
@@ -113,26 +229,80 @@ class PacketBuffer:
                          last_decoded_length,
                          sample_rate,
                          count_dtx_waiting_time):
-        if len(self.buffer) == 0:
+        if self.empty():
             return 0
-        span = self.buffer[-1].timestamp - self.buffer[0].timestamp
-        if self.buffer[-1].frame and self.buffer[-1].frame.duration() > 0:
-            duration = self.buffer[-1].frame.duration()
-            if self.count_dtx_waiting_time and self.buffer[-1].frame.is_dtx_packet():
-                waiting_time_samples = self.buffer[-1].waiting_time.elapse_ms() * sample_rate / 1000
-            span += duration
-        return span
+        return self._span_end(sample_rate) - self.buffer[self.head].timestamp
 
     def contain_dtx_or_cng_packets(self):
         # Opus是根据码流的标志，有些编码可能使用带外DTX方式
-        for p in self.buffer:
-            if p.frame and p.frame.is_dtx_packet():
-                return True
-        return False
+        return self.num_dtx_packets > 0
 
     def is_obsolete_timestamp(self,
                               timestamp,
                               timestamp_limit,
                               horizon_samples):
-        pass
+        return timestamp < timestamp_limit and \
+            (horizon_samples == 0 or timestamp > timestamp_limit - horizon_samples)
+
+    def _span_end(self, sample_rate):
+        # 最后一个包的结束位置
+        last = self.buffer[-1]
+        span_end = last.timestamp
+        duration = last.frame.duration() if last.frame else 0
+        if duration > 0:
+            if self.count_dtx_waiting_time and last.frame.is_dtx_packet():
+                # DTX包覆盖的时长至少是它已经等待的时长
+                waiting_time_samples = last.waiting_time.elapsed_ms() * sample_rate / 1000
+                duration = max(duration, waiting_time_samples)
+            span_end += duration
+        return span_end
+
+    def _count_packet(self, p: Packet, sign: int):
+        if not p.frame:
+            return
+        if p.frame.is_dtx_packet():
+            self.num_dtx_packets += sign
+        if p.priority == PRIMARY_PRIORITY:
+            duration = p.frame.duration()
+            if duration > 0:
+                self.num_primary_samples += sign * duration
+            else:
+                self.num_primary_unknown_duration += sign
+
+    def _reset_counters(self):
+        self.num_primary_samples = 0
+        self.num_primary_unknown_duration = 0
+        self.num_dtx_packets = 0
+
+    def recycle(self, packet: Packet):
+        """
+        包不再使用：归还payload占用的接收缓冲区，设置了packet_pool时放回池中
+        """
+        if self.packet_pool is not None:
+            self.packet_pool.release(packet)
+        else:
+            release_payload(packet)
+
+    def _discard(self, packet: Packet, reason: str):
+        # 被丢弃的包直接回收。get_next_packet取出的包由调用者解码后回收
+        if self.instrumentation is not None:
+            self.instrumentation.event('packet_buffer.discard.' + reason,
+                                       timestamp=packet.timestamp,
+                                       sequence_number=packet.sequence_number)
+        self.recycle(packet)
+
+    def _pop_front(self):
+        packet = self.buffer[self.head]
+        self._count_packet(packet, -1)
+        self.buffer[self.head] = None
+        self.head += 1
+        self._maybe_compact()
+        return packet
 
+    def _maybe_compact(self):
+        if self.head == len(self.buffer):
+            self.buffer.clear()
+            self.head = 0
+        elif self.head >= COMPACT_THRESHOLD and self.head * 2 >= len(self.buffer):
+            del self.buffer[:self.head]
+            self.head = 0
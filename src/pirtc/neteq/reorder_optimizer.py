@@ -1,4 +1,4 @@
-from pirtc.neteq.histogram import Histogram
+from pirtc.neteq.histogram import create_histogram
 
 DELAY_BUCKETS = 100
 BUCKET_SIZE_MS = 20
@@ -11,21 +11,29 @@ class ReorderOptimizer:
     def __init__(self,
                  forget_factor: int,
                  ms_per_lost_percent: int,
-                 start_forget_weight: float = None):
-        self.hist = Histogram(DELAY_BUCKETS, forget_factor, start_forget_weight)
+                 start_forget_weight: float = None,
+                 hist_type: str = 'python',
+                 num_buckets: int = DELAY_BUCKETS,
+                 bucket_size_ms: int = BUCKET_SIZE_MS):
+        self.bucket_size_ms = bucket_size_ms
+        self.hist = create_histogram(hist_type, num_buckets, forget_factor, start_forget_weight)
         self.ms_per_loss_percent = ms_per_lost_percent
+        # 超过基础延迟之后每个bucket增加bucket_size_ms的延迟代价，只有概率大于bucket_size_ms/(100*ms_per_loss_percent)
+        # 的bucket减少的丢包代价更多，才可能成为最小值，由直方图在add时找出这些bucket
+        loss_cost = 100 * ms_per_lost_percent
+        self.hist.set_heavy_threshold((bucket_size_ms << 30) // max(loss_cost, 1))
         self.optimal_delay_ms = None
 
     def update(self,
                relative_delay_ms: int,
                reordered: bool,
                base_delay: int):
-        index = relative_delay_ms / BUCKET_SIZE_MS if reordered else 0
+        index = int(relative_delay_ms // self.bucket_size_ms) if reordered else 0
         if index < self.hist.num_buckets:
             self.hist.add(index)
 
         bucket_index = self.minimize_cost_function(base_delay)
-        self.optimal_delay_ms = (1 + bucket_index) * BUCKET_SIZE_MS
+        self.optimal_delay_ms = (1 + bucket_index) * self.bucket_size_ms
 
     def get_optimal_delay_ms(self):
         return self.optimal_delay_ms
@@ -35,22 +43,31 @@ class ReorderOptimizer:
         self.optimal_delay_ms = None
 
     def minimize_cost_function(self, base_delay_ms: int):
-        loss_probability = 1 << 30  # 100%
-        min_cost = 18446744073709551615  # max int64
-        min_buckets = 0
-        for i in range(self.hist.num_buckets):
-            # 如果以i为最终结果，将导致多少的丢包，这里是jitter buffer主动丢弃
-            loss_probability -= self.hist.buckets[i]
-            # 如果以i为最终结果，将会多引入多长时间的延迟
-            delay_ms = max(0, i * BUCKET_SIZE_MS - base_delay_ms) << 30
-            # 每丢1%的包，需要增加ms_per_loss_percent延迟来抗
+        hist = self.hist
+        # 每丢1%的包，需要增加ms_per_loss_percent延迟来抗
+        loss_cost = 100 * self.ms_per_loss_percent
+        if loss_cost == 0:
+            # 只有延迟代价，第一个bucket最小
+            return 0
+        min_buckets = None
+        min_cost = None
+        # 不超过基础延迟的bucket不引入额外延迟，代价随累积概率单调不增，
+        # 最小值在last，取累积概率和last相同的第一个bucket
+        last = min(int(base_delay_ms // self.bucket_size_ms), hist.num_buckets - 1)
+        if last >= 0:
+            cumulative = hist.cumulative(last)
+            min_buckets = min(hist.quantile(cumulative), last)
+            min_cost = loss_cost * ((1 << 30) - cumulative)
+        # 之后的bucket每个增加bucket_size_ms的延迟(第一个可能不足)，只有第一个和概率足够大的bucket能让代价下降
+        for i in (last + 1, *hist.heavy_buckets()):
+            if i <= last or i >= hist.num_buckets:
+                continue
+            # 如果以i为最终结果，将会多引入多长时间的延迟，以及导致多少的丢包，这里是jitter buffer主动丢弃
             # 总代价就是为了超过基础延迟的部分和为了抗剩余丢包的部分
-            cost = delay_ms + 100 * self.ms_per_loss_percent * loss_probability
-            # 迭代得到最低的带宽
-            if cost < min_cost:
+            cost = (max(0, i * self.bucket_size_ms - base_delay_ms) << 30) + \
+                loss_cost * ((1 << 30) - hist.cumulative(i))
+            # 代价相同时取下标小的
+            if min_cost is None or cost < min_cost or (cost == min_cost and i < min_buckets):
                 min_cost = cost
                 min_buckets = i
-
-            if loss_probability == 0:
-                break
         return min_buckets
@@ -0,0 +1,117 @@
+"""
+从pcap流式读取RTP包并送入NetEQ的延迟估计模块。
+
+每一级都是generator，整个pipeline只持有当前读缓冲区和各模块自身的状态，
+回放数小时的录制文件时内存占用不随文件大小增长。
+
+    packets = iter_rtp_packets('call.pcap', ssrc=0x1234)
+    records = iter_arrival_records(packets)
+    for record, target_delay_ms in feed_neteq(records, history, delay_manager):
+        ...
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from pirtc.base.number_unwrapper import NumberUnwrapper
+from pirtc.base.packet_trace import PacketTraceWriter, FLAG_MARKER
+from pirtc.base.pcap import iter_pcap_records, parse_udp, parse_rtp
+from pirtc.neteq.delay_manager import DelayManager
+from pirtc.neteq.packet_arrival_history import PacketArrivalHistory
+
+
+@dataclass
+class ArrivalRecord:
+    ssrc: int
+    rtp_timestamp: int
+    unwrapped_timestamp: int
+    unwrapped_sequence_number: int
+    arrival_time_ms: float
+    reordered: bool
+
+
+def iter_rtp_packets(path: str,
+                     ssrc: int = None,
+                     payload_type: int = None,
+                     udp_port: int = None,
+                     chunk_size: int = 1 << 20):
+    for linktype, arrival_time_ms, frame in iter_pcap_records(path, chunk_size):
+        udp = parse_udp(linktype, frame)
+        if not udp:
+            continue
+        src_port, dst_port, payload = udp
+        if udp_port is not None and udp_port not in (src_port, dst_port):
+            continue
+        packet = parse_rtp(payload, arrival_time_ms)
+        if not packet:
+            continue
+        if ssrc is not None and packet.ssrc != ssrc:
+            continue
+        if payload_type is not None and packet.payload_type != payload_type:
+            continue
+        yield packet
+
+
+def iter_arrival_records(packets):
+    """
+    按SSRC分别unwrap序列号和时间戳，序列号小于已收到的最大序列号认为是乱序包。
+    """
+    streams = {}
+    for packet in packets:
+        if packet.ssrc not in streams:
+            streams[packet.ssrc] = [NumberUnwrapper(16), NumberUnwrapper(32), None]
+        state = streams[packet.ssrc]
+        sequence_number = state[0].unwrap(packet.sequence_number)
+        timestamp = state[1].unwrap(packet.timestamp)
+        reordered = state[2] is not None and sequence_number < state[2]
+        if not reordered:
+            state[2] = sequence_number
+        yield ArrivalRecord(packet.ssrc, packet.timestamp, timestamp, sequence_number,
+                            packet.arrival_time_ms, reordered)
+
+
+def feed_neteq(records,
+               packet_arrival_history: PacketArrivalHistory,
+               delay_manager: DelayManager):
+    """
+    records需要是同一个流的包。输出(record, target_delay_ms)。
+    tick timer按到达时间推进，第一个包到达时为0。
+    """
+    tick_timer = delay_manager.underrun_optimizer.tick_timer
+    first_arrival_time_ms = None
+    for record in records:
+        if first_arrival_time_ms is None:
+            first_arrival_time_ms = record.arrival_time_ms
+        tick = int((record.arrival_time_ms - first_arrival_time_ms) // tick_timer.get_ms_per_tick())
+        if tick > tick_timer.get_ticks():
+            tick_timer.increment(tick - tick_timer.get_ticks())
+
+        packet_arrival_history.insert(record.rtp_timestamp, record.arrival_time_ms)
+        arrival_delay_ms = packet_arrival_history.get_delay_ms(record.rtp_timestamp, record.arrival_time_ms)
+        delay_manager.update(arrival_delay_ms, record.reordered)
+        yield record, delay_manager.get_target_delay_ms()
+
+
+def write_packet_trace(packets, path: str, chunk_size: int = 65536):
+    """
+    把RTP包流式转成packet trace，每chunk_size个包写一次
+    """
+    columns = {name: [] for name in ('rtp_timestamp', 'sequence_number', 'arrival_time_ms',
+                                     'payload_type', 'size', 'flags')}
+
+    def flush():
+        writer.write(**{name: np.asarray(values) for name, values in columns.items()})
+        for values in columns.values():
+            values.clear()
+
+    with PacketTraceWriter(path) as writer:
+        for packet in packets:
+            columns['rtp_timestamp'].append(packet.timestamp)
+            columns['sequence_number'].append(packet.sequence_number)
+            columns['arrival_time_ms'].append(packet.arrival_time_ms)
+            columns['payload_type'].append(packet.payload_type)
+            columns['size'].append(packet.payload_size)
+            columns['flags'].append(FLAG_MARKER if packet.marker else 0)
+            if len(columns['rtp_timestamp']) >= chunk_size:
+                flush()
+        flush()
@@ -0,0 +1,270 @@
+"""
+基于asyncio的实时抖动缓冲服务：从本地UDP端口接收RTP，每个SSRC一个NetEq，10ms定时器驱动get_audio，
+输出的帧通过异步迭代器读取。
+
+    async with RtpReceiver(NetEqConfig(), port=5004) as receiver:
+        stream = await receiver.accept()
+        async for frame in stream:
+            ...
+
+内存有上界：流的个数不超过max_streams，每个流的packet buffer不超过max_packets_in_buffer个包，
+输出队列不超过max_queued_frames帧（消费太慢时丢弃最老的帧），超过stream_timeout_ms没有收到包的流会被关闭。
+
+包直接收到预先分配的ReceiveArena中，payload是指向arena的memoryview，解析、缓存和解码都不复制，
+包被丢弃或者解码之后归还arena。arena用完时退化为每个包分配内存。
+"""
+import asyncio
+import random
+import socket
+from collections import deque
+
+from pirtc.base.audio_decoder import SimulatedAudioFrame
+from pirtc.base.pcap import parse_rtp, build_rtp
+from pirtc.base.receive_arena import ReceiveArena
+from pirtc.base.tick_timer import TickTimer
+from pirtc.neteq.neteq import NetEq, NetEqConfig
+from pirtc.neteq.packet import PacketPool
+
+MAX_DATAGRAM_SIZE = 65536
+# arena每个槽的大小，大于这个大小的包被丢弃
+ARENA_SLOT_SIZE = 2048
+# 返回包的实际长度，用来发现被截断的包
+RECV_FLAGS = getattr(socket, 'MSG_TRUNC', 0)
+# 每次socket可读时最多读的包数，避免一直收包饿死定时器
+MAX_READS_PER_WAKEUP = 256
+
+
+class RtpStream:
+    """
+    一个SSRC的NetEq和输出队列，异步迭代得到get_audio输出的帧，流关闭后读完剩余的帧迭代结束
+    """
+    def __init__(self, ssrc: int, config: NetEqConfig, max_queued_frames: int, packet_pool: PacketPool = None):
+        self.ssrc = ssrc
+        self.neteq = NetEq(config, TickTimer(), packet_pool)
+        # 消费者跟不上时丢弃最老的帧
+        self.frames = deque(maxlen=max_queued_frames)
+        self.waiter = None
+        self.dropped_frames = 0
+        self.last_packet_time_ms = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.frames:
+            if self.closed:
+                raise StopAsyncIteration
+            self.waiter = asyncio.get_running_loop().create_future()
+            await self.waiter
+        return self.frames.popleft()
+
+    def tick(self):
+        if len(self.frames) == self.frames.maxlen:
+            self.dropped_frames += 1
+        self.frames.append(self.neteq.get_audio())
+        self.wake_up()
+
+    def close(self):
+        self.closed = True
+        # 归还packet buffer中的包占用的arena
+        self.neteq.packet_buffer.flush()
+        self.wake_up()
+
+    def wake_up(self):
+        if self.waiter is not None:
+            if not self.waiter.done():
+                self.waiter.set_result(None)
+            self.waiter = None
+
+
+class RtpReceiver:
+    def __init__(self,
+                 config: NetEqConfig = None,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 packet_duration_ms: int = 20,
+                 max_streams: int = 256,
+                 max_queued_frames: int = 50,
+                 stream_timeout_ms: int = 10000,
+                 receive_buffer_size: int = 1 << 22,
+                 arena_slots: int = 4096,
+                 frame_factory=None):
+        """
+        frame_factory(payload)根据payload的memoryview生成EncodedAudioFrame，缺省生成固定时长的SimulatedAudioFrame
+        """
+        self.config = config or NetEqConfig()
+        self.host = host
+        self.port = port
+        self.packet_samples = self.config.sample_rate_hz * packet_duration_ms // 1000
+        self.max_streams = max_streams
+        self.max_queued_frames = max_queued_frames
+        self.stream_timeout_ms = stream_timeout_ms
+        self.streams = {}
+        self.new_streams = asyncio.Queue()
+        self.receive_buffer_size = receive_buffer_size
+        self.arena = ReceiveArena(arena_slots, ARENA_SLOT_SIZE)
+        # 所有流共用，丢弃和解码完的包回到池中
+        self.packet_pool = PacketPool(arena_slots)
+        self.frame_factory = frame_factory
+        self.sock = None
+        self.tick_task = None
+        self.start_time = 0
+        self.ignored_packets = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.start_time = loop.time()
+        family, _, _, _, address = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_DGRAM)[0]
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size)
+        self.sock.bind(address)
+        self.sock.setblocking(False)
+        self.port = self.sock.getsockname()[1]
+        loop.add_reader(self.sock.fileno(), self.on_readable)
+        self.tick_task = asyncio.create_task(self.run_ticks())
+
+    async def close(self):
+        if self.tick_task:
+            self.tick_task.cancel()
+            try:
+                await self.tick_task
+            except asyncio.CancelledError:
+                pass
+            self.tick_task = None
+        if self.sock:
+            asyncio.get_running_loop().remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+        for stream in self.streams.values():
+            stream.close()
+        self.streams.clear()
+        self.new_streams.put_nowait(None)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def accept(self) -> RtpStream:
+        """
+        等待下一个新的SSRC，接收器关闭后返回None
+        """
+        stream = await self.new_streams.get()
+        if stream is None:
+            self.new_streams.put_nowait(None)
+        return stream
+
+    def now_ms(self):
+        return (asyncio.get_running_loop().time() - self.start_time) * 1000
+
+    def on_readable(self):
+        # DatagramProtocol每次事件循环只读一个包，这里一次读完socket中的包，包很多时也不会堆积
+        for _ in range(MAX_READS_PER_WAKEUP):
+            slot = self.arena.acquire()
+            try:
+                if slot is None:
+                    data = memoryview(self.sock.recv(MAX_DATAGRAM_SIZE))
+                else:
+                    size = self.sock.recv_into(slot.view, 0, RECV_FLAGS)
+                    data = slot.view[:size]
+            except (BlockingIOError, InterruptedError):
+                # socket已经读空，这次acquire没有存放包
+                self.arena.cancel(slot)
+                return
+            if slot is not None and size > len(slot.view):
+                # 包被截断
+                slot.release()
+                self.ignored_packets += 1
+                continue
+            self.on_datagram(data, slot)
+
+    def on_datagram(self, data, slot=None):
+        """
+        data是收到的包，slot是它所在的arena槽，包被丢弃或者解码之后归还
+        """
+        arrival_time_ms = self.now_ms()
+        rtp = parse_rtp(data, arrival_time_ms)
+        if not rtp:
+            self.ignored_packets += 1
+            if slot is not None:
+                slot.release()
+            return
+
+        stream = self.streams.get(rtp.ssrc)
+        if stream is None:
+            if len(self.streams) >= self.max_streams:
+                self.ignored_packets += 1
+                if slot is not None:
+                    slot.release()
+                return
+            stream = RtpStream(rtp.ssrc, self.config, self.max_queued_frames, self.packet_pool)
+            self.streams[rtp.ssrc] = stream
+            self.new_streams.put_nowait(stream)
+
+        packet = self.packet_pool.acquire()
+        packet.timestamp = rtp.timestamp
+        packet.sequence_number = rtp.sequence_number
+        packet.payload_type = rtp.payload_type
+        packet.payload = data[rtp.header_size:rtp.header_size + rtp.payload_size]
+        packet.arena_slot = slot
+        packet.frame = self.frame_factory(packet.payload) if self.frame_factory \
+            else SimulatedAudioFrame(self.packet_samples)
+        stream.neteq.insert_packet(packet, arrival_time_ms)
+        stream.last_packet_time_ms = arrival_time_ms
+
+    async def run_ticks(self):
+        """
+        每个tick所有的流输出一帧。按绝对时间调度，落后时逐个补齐tick，每个tick之后都让出事件循环去收包。
+        """
+        loop = asyncio.get_running_loop()
+        tick_s = TickTimer().get_ms_per_tick() / 1000
+        next_time = loop.time() + tick_s
+        while True:
+            await asyncio.sleep(max(0.0, next_time - loop.time()))
+            if next_time <= loop.time():
+                self.tick()
+                next_time += tick_s
+
+    def tick(self):
+        now_ms = self.now_ms()
+        for ssrc, stream in list(self.streams.items()):
+            if now_ms - stream.last_packet_time_ms > self.stream_timeout_ms:
+                stream.close()
+                del self.streams[ssrc]
+                continue
+            stream.tick()
+
+
+async def send_rtp_stream(host: str,
+                          port: int,
+                          ssrc: int,
+                          num_packets: int,
+                          packet_duration_ms: int = 20,
+                          sample_rate_hz: int = 16000,
+                          payload_type: int = 111,
+                          payload_size: int = 60,
+                          jitter_ms: float = 0,
+                          loss_rate: float = 0,
+                          seed: int = 0):
+    """
+    按实时节奏发送RTP，用于本地回环测试。每个包额外延迟0~jitter_ms的随机时间，按loss_rate随机丢包。
+    """
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, remote_addr=(host, port))
+    rnd = random.Random(seed)
+    payload = bytes(payload_size)
+    start = loop.time()
+    try:
+        for i in range(num_packets):
+            data = build_rtp(ssrc, payload_type, i, i * sample_rate_hz * packet_duration_ms // 1000, payload)
+            send_time = start + i * packet_duration_ms / 1000
+            if rnd.random() >= loss_rate:
+                loop.call_at(send_time + rnd.uniform(0, jitter_ms) / 1000, transport.sendto, data)
+            await asyncio.sleep(max(0.0, send_time - loop.time()))
+        # 等待延迟发送的包发出去
+        await asyncio.sleep(max(0.0, start + (num_packets * packet_duration_ms + jitter_ms) / 1000 - loop.time()))
+    finally:
+        transport.close()
@@ -0,0 +1,139 @@
+"""
+把packet trace回放到NetEQ的延迟估计模块。
+"""
+import math
+
+import numpy as np
+
+from pirtc.base.audio_decoder import SimulatedAudioFrame
+from pirtc.base.packet_trace import PacketTraceReader, FLAG_DTX, FLAG_FEC, FLAG_RETRANSMISSION
+from pirtc.base.tick_timer import EventScheduler
+from pirtc.neteq.delay_manager import DelayManager
+from pirtc.neteq.delay_manager_replay import replay_delay_manager
+from pirtc.neteq.delay_manager_sweep import save_delay_trace
+from pirtc.neteq.neteq import NetEq
+from pirtc.neteq.packet import Packet, PacketPool, PacketPriority
+from pirtc.neteq.packet_arrival_history import PacketArrivalHistory
+
+# 优先级不可变，trace中的包按flags共用实例，[codec_level][red_level]
+TRACE_PRIORITIES = [[PacketPriority(c, r) for r in range(2)] for c in range(2)]
+
+
+def iter_arrival_delays(reader: PacketTraceReader,
+                        sample_rate_hz: int,
+                        window_size_ms: int = 2000,
+                        ms_per_tick: int = 10,
+                        chunk_size: int = 65536):
+    """
+    按块输出(ticks, arrival_delays_ms, reordered)，与NetEQ收包时计算DelayManager输入的方式一致：
+    先插入PacketArrivalHistory，再取这个包的相对延迟，时间戳不是最新的包认为是乱序包。
+    """
+    history = PacketArrivalHistory(window_size_ms)
+    history.set_sample_rate(sample_rate_hz // 1000)
+    for chunk in reader.iter_chunks(chunk_size):
+        delays = np.zeros(len(chunk), dtype=np.float64)
+        reordered = np.zeros(len(chunk), dtype=np.bool_)
+        for i, (rtp_timestamp, arrival_time_ms) in enumerate(zip(chunk.rtp_timestamp.tolist(),
+                                                                 chunk.arrival_time_ms.tolist())):
+            history.insert(rtp_timestamp, arrival_time_ms)
+            delays[i] = history.get_delay_ms(rtp_timestamp, arrival_time_ms)
+            reordered[i] = not history.is_newest_rtp_timestamp(rtp_timestamp)
+        ticks = (chunk.arrival_time_ms // ms_per_tick).astype(np.int64)
+        yield ticks, delays, reordered
+
+
+def replay_trace(delay_manager: DelayManager,
+                 reader: PacketTraceReader,
+                 sample_rate_hz: int,
+                 window_size_ms: int = 2000) -> np.ndarray:
+    ms_per_tick = delay_manager.underrun_optimizer.tick_timer.get_ms_per_tick()
+    targets = [replay_delay_manager(delay_manager, delays, reordered, ticks)
+               for ticks, delays, reordered in iter_arrival_delays(reader, sample_rate_hz, window_size_ms,
+                                                                   ms_per_tick)]
+    return np.concatenate(targets) if targets else np.zeros(0, dtype=np.float64)
+
+
+def write_delay_trace(reader: PacketTraceReader,
+                      path: str,
+                      sample_rate_hz: int,
+                      window_size_ms: int = 2000,
+                      ms_per_tick: int = 10):
+    """
+    生成参数扫描使用的delay trace
+    """
+    parts = list(iter_arrival_delays(reader, sample_rate_hz, window_size_ms, ms_per_tick))
+    ticks, delays, reordered = (np.concatenate(column) for column in zip(*parts)) if parts else ([], [], [])
+    save_delay_trace(path, ticks, delays, reordered)
+
+
+def iter_trace_packets(reader: PacketTraceReader,
+                       packet_samples: int,
+                       chunk_size: int = 65536,
+                       packet_pool: PacketPool = None):
+    """
+    把trace中的记录转成(arrival_time_ms, Packet)，trace中没有帧长，所有包都是packet_samples
+    """
+    for chunk in reader.iter_chunks(chunk_size):
+        for rtp_timestamp, sequence_number, payload_type, arrival_time_ms, flags in zip(
+                chunk.rtp_timestamp.tolist(), chunk.sequence_number.tolist(), chunk.payload_type.tolist(),
+                chunk.arrival_time_ms.tolist(), chunk.flags.tolist()):
+            packet = packet_pool.acquire() if packet_pool is not None else Packet()
+            packet.timestamp = rtp_timestamp
+            packet.sequence_number = sequence_number
+            packet.payload_type = payload_type
+            packet.priority = TRACE_PRIORITIES[1 if flags & FLAG_FEC else 0][1 if flags & FLAG_RETRANSMISSION else 0]
+            packet.frame = SimulatedAudioFrame(packet_samples, bool(flags & FLAG_DTX))
+            yield arrival_time_ms, packet
+
+
+def replay_neteq(neteq: NetEq,
+                 reader: PacketTraceReader,
+                 packet_duration_ms: int = 20,
+                 chunk_size: int = 65536) -> float:
+    """
+    按到达时间把trace中的包送入NetEq，每个tick调用一次get_audio，包在到达时间之前的所有输出之后插入，
+    所有包插入之后继续输出直到packet buffer为空。返回仿真的时长(秒)。
+
+    用事件驱动：packet buffer为空时时钟直接跳到下一个包到达的tick，中间的输出批量处理，
+    静音/DTX很长的trace不需要逐tick调用get_audio，结果与逐tick调用相同。
+    """
+    tick_timer = neteq.tick_timer
+    ms_per_tick = tick_timer.get_ms_per_tick()
+    start_ticks = tick_timer.get_ticks()
+    scheduler = EventScheduler(tick_timer)
+    packets = iter_trace_packets(reader, neteq.sample_rate_hz * packet_duration_ms // 1000, chunk_size,
+                                 neteq.packet_buffer.packet_pool)
+    first_arrival_time_ms = None
+
+    def schedule_next_arrival():
+        nonlocal first_arrival_time_ms
+        item = next(packets, None)
+        if item is None:
+            return
+        arrival_time_ms, packet = item
+        if first_arrival_time_ms is None:
+            first_arrival_time_ms = arrival_time_ms
+        tick = start_ticks + math.ceil((arrival_time_ms - first_arrival_time_ms) / ms_per_tick)
+        # 同一个tick内先插包再输出
+        scheduler.schedule_at(max(tick, tick_timer.get_ticks()), lambda: on_arrival(arrival_time_ms, packet), 0)
+
+    def on_arrival(arrival_time_ms, packet):
+        neteq.insert_packet(packet, arrival_time_ms)
+        schedule_next_arrival()
+
+    def on_audio():
+        # 到下一个事件之前逐tick输出，packet buffer空了之后直接跳到下一个事件
+        next_tick = scheduler.next_event_tick()
+        while not neteq.packet_buffer.empty() and (next_tick is None or tick_timer.get_ticks() < next_tick):
+            neteq.get_audio()
+        if next_tick is None:
+            # 所有包都已经插入并且播放完
+            return
+        if tick_timer.get_ticks() < next_tick:
+            neteq.skip_idle(next_tick - tick_timer.get_ticks())
+        scheduler.schedule_at(next_tick, on_audio, 1)
+
+    schedule_next_arrival()
+    scheduler.schedule_at(start_ticks, on_audio, 1)
+    scheduler.run()
+    return (tick_timer.get_ticks() - start_ticks) * ms_per_tick / 1000
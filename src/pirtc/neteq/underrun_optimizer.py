@@ -1,5 +1,5 @@
 from pirtc.base.tick_timer import TickTimer, StopWatch
-from pirtc.neteq.histogram import Histogram
+from pirtc.neteq.histogram import create_histogram
 
 DELAY_BUCKETS = 100
 BUCKET_SIZE_MS = 20
@@ -11,11 +11,15 @@ class UnderRunOptimizer:
                  hist_quantile: int,
                  forget_factor: int,
                  start_forget_weight: float = None,
-                 resample_interval_ms: int = None):
+                 resample_interval_ms: int = None,
+                 hist_type: str = 'python',
+                 num_buckets: int = DELAY_BUCKETS,
+                 bucket_size_ms: int = BUCKET_SIZE_MS):
         self.tick_timer = tick_timer
         self.hist_quantile = hist_quantile
         self.resample_interval_ms = resample_interval_ms
-        self.hist = Histogram(DELAY_BUCKETS, forget_factor, start_forget_weight)
+        self.bucket_size_ms = bucket_size_ms
+        self.hist = create_histogram(hist_type, num_buckets, forget_factor, start_forget_weight)
         self.resample_stopwatch = None
         self.max_delay_in_interval_ms = 0
         self.optimal_delay_ms = 0
@@ -35,12 +39,12 @@ class UnderRunOptimizer:
         if not hist_update:
             return
 
-        index = hist_update / BUCKET_SIZE_MS
+        index = int(hist_update // self.bucket_size_ms)
         if index < self.hist.num_buckets:
             self.hist.add(index)
 
         bucket_index = self.hist.quantile(self.hist_quantile)
-        self.optimal_delay_ms = (1 + bucket_index) * BUCKET_SIZE_MS
+        self.optimal_delay_ms = (1 + bucket_index) * self.bucket_size_ms
         return self.optimal_delay_ms
 
     def get_optimal_delay_ms(self):